@@ -0,0 +1,72 @@
+import os
+import time
+import asyncpg
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from db import validate_session
+from metrics import POOL_WAIT_SECONDS, record_asyncpg_query, register_pool
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+async_pool = None
+
+async def get_async_pool():
+    global async_pool
+    if async_pool is None:
+        try:
+            async_pool = await asyncpg.create_pool(
+                min_size=1,
+                max_size=20,
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT"),
+                database=os.getenv("DB_NAME")
+            )
+            logger.info("Async database connection pool created successfully")
+        except Exception as e:
+            logger.error(f"Error creating async database connection pool: {e}")
+            raise
+    return async_pool
+
+async def close_async_pool():
+    global async_pool
+    if async_pool is not None:
+        await async_pool.close()
+        async_pool = None
+        logger.info("Async database connection pool closed")
+
+def pool_usage():
+    if async_pool is None:
+        return None
+    return async_pool.get_size() - async_pool.get_idle_size(), async_pool.get_max_size()
+
+register_pool("async", pool_usage)
+
+@asynccontextmanager
+async def acquire(session_token=None):
+    """Borrows a connection from the async pool; a session_token, when given, must be valid."""
+    if session_token is not None and not validate_session(session_token):
+        raise HTTPException(status_code=403, detail="Invalid session")
+    pool = await get_async_pool()
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - started, pool="async")
+        with conn.query_logger(record_asyncpg_query):
+            yield conn
+
+@asynccontextmanager
+async def transaction(session_token=None):
+    """Borrows a connection and runs the block in a transaction, rolling back on error."""
+    async with acquire(session_token) as conn:
+        async with conn.transaction():
+            yield conn
+
+async def iterate(conn, query, *args, prefetch=500):
+    """Async server-side cursor over a query; conn must be inside a transaction."""
+    async for record in conn.cursor(query, *args, prefetch=prefetch):
+        yield record
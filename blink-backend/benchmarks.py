@@ -0,0 +1,185 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from contraction import ContractionHierarchy
+from network import ALL_PAIRS_MAX_NODES, RouteMatrix, RoutingState
+from profiler import assert_max_queries
+from schedule_builder import plan_slices, render_slices
+from snapshot_file import read_snapshot, write_snapshot
+from synthetic import SyntheticNetwork
+from trip_manager import TripManager, timetable_cache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (20, 70, 1000, 10000)
+SERVICE_DATE = date(2025, 3, 18)
+NOON = datetime.combine(SERVICE_DATE, datetime.min.time()) + timedelta(hours=12)
+
+
+def measure(fn, repeat, number=1):
+    """Times repeat rounds of number calls; returns per-call milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) * 1000 / number)
+    return {
+        "calls": repeat * number,
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    }
+
+
+def benchmark_size(num_stations, repeat=5, queries=200, longest_max_stations=1000, seed=0, longest_budget=1.0):
+    """Runs every benchmark against one synthetic network; returns a list of result dicts."""
+    rng = random.Random(seed)
+    synthetic = SyntheticNetwork(num_stations, seed)
+    snapshot = synthetic.snapshot()
+    size = {"stations": num_stations, "nodes": snapshot.num_nodes, "edges": snapshot.num_edges}
+    results = []
+
+    def record(name, timing, **extra):
+        results.append({"benchmark": name, **size, **timing, **extra})
+        logger.info(f"{name} @ {num_stations} stations: median {timing['median_ms']:.3f} ms")
+
+    record("snapshot_build", measure(synthetic.snapshot, repeat))
+    # TripManager warms the route matrices (or hierarchies), which are cached on the snapshot;
+    # build them first so trip_manager_init does not time them (see *_build below).
+    RoutingState(snapshot, warm=True)
+    record("trip_manager_init", measure(lambda: TripManager(snapshot), repeat))
+    with assert_max_queries(0, "TripManager from a snapshot"):
+        trip_manager = TripManager(snapshot)
+        trip_manager.build_weighted_graph(NOON)
+    record("build_weighted_graph", measure(lambda: trip_manager.build_weighted_graph(NOON), repeat))
+    record("routing_state_build", measure(lambda: RoutingState(snapshot), repeat))
+
+    if snapshot.num_nodes <= ALL_PAIRS_MAX_NODES:
+        record("route_matrix_build", measure(lambda: RouteMatrix.build(snapshot, False), min(repeat, 3)))
+    else:
+        record("contraction_build", measure(lambda: ContractionHierarchy.build(
+            snapshot.indptr.tolist(), snapshot.indices.tolist(), snapshot.weight_offpeak.tolist()), 1))
+    station_names = [name for _, name in synthetic.stations]
+    pairs = [(rng.choice(station_names), rng.choice(station_names)) for _ in range(queries)]
+    trip_manager.find_shortest_path(*pairs[0], departure_time=NOON)
+    pair_iter = iter(pairs * repeat)
+    record("find_shortest_path", measure(lambda: trip_manager.find_shortest_path(*next(pair_iter), departure_time=NOON), repeat, queries),
+           mode="matrix" if snapshot.num_nodes <= ALL_PAIRS_MAX_NODES else "contraction")
+
+    calendar = synthetic.calendar(SERVICE_DATE)
+
+    def build_week():
+        slices = plan_slices(calendar, synthetic.patterns, synthetic.rules, {})
+        return render_slices(io.StringIO(), slices, synthetic.patterns)
+    record("generate_weekly_schedule", measure(build_week, repeat), rows=build_week())
+
+    record("timetable_build", measure(lambda: synthetic.timetable(snapshot, SERVICE_DATE), min(repeat, 3)))
+    trip_manager.service_timetables = timetable_cache({SERVICE_DATE: synthetic.timetable(snapshot, SERVICE_DATE)})
+    handle, snapshot_path = tempfile.mkstemp(suffix=".snapshot")
+    os.close(handle)
+    try:
+        write_snapshot(snapshot_path, snapshot, [timetable for _, timetable in trip_manager.service_timetables.items()])
+        record("snapshot_file_load", measure(lambda: read_snapshot(snapshot_path), repeat),
+               bytes=os.path.getsize(snapshot_path))
+        record("trip_manager_init_from_file", measure(lambda: TripManager(snapshot_path=snapshot_path), repeat))
+    finally:
+        os.remove(snapshot_path)
+    hops = [(trip_manager.valid_lines[line_id], trip_manager.station_map_inv[a], trip_manager.station_map_inv[b])
+            for _, line_id, a, b, _ in synthetic.routes]
+    lookups = [(*rng.choice(hops), NOON + timedelta(seconds=rng.randrange(-6 * 3600, 6 * 3600))) for _ in range(queries)]
+    lookup_iter = iter(lookups * repeat)
+    record("get_next_departure", measure(lambda: trip_manager.get_next_departure(*next(lookup_iter)), repeat, queries))
+
+    if num_stations <= longest_max_stations:
+        # A fresh TripManager each round, so the memoized route is not what gets timed.
+        managers = iter([TripManager(snapshot) for _ in range(repeat)])
+        route = []
+        record("longest_route_no_repeats", measure(lambda: route.append(next(managers).longest_route_no_repeats(longest_budget)), repeat),
+               stations_in_route=len(route[-1]), budget_s=longest_budget)
+    else:
+        results.append({"benchmark": "longest_route_no_repeats", **size, "skipped": f"more than {longest_max_stations} stations"})
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=5, queries=200, longest_max_stations=1000, seed=0, longest_budget=1.0):
+    results = []
+    for num_stations in sizes:
+        results.extend(benchmark_size(num_stations, repeat, queries, longest_max_stations, seed, longest_budget))
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=0.2):
+    """Returns (report lines, regressions) comparing median times with a baseline run."""
+    previous = {(r["benchmark"], r["stations"]): r for r in baseline["results"] if "median_ms" in r}
+    lines, regressions = [], []
+    for result in current["results"]:
+        before = previous.get((result["benchmark"], result["stations"]))
+        if before is None or "median_ms" not in result:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else float("inf")
+        line = f"{result['benchmark']:<26} {result['stations']:>6} {before['median_ms']:>12.3f} {result['median_ms']:>12.3f} {ratio:>7.2f}x"
+        lines.append(line)
+        if ratio > 1 + threshold:
+            regressions.append(line)
+    return lines, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark routing and scheduling on synthetic networks, no database needed")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma-separated station counts")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds per benchmark")
+    parser.add_argument("--queries", type=int, default=200, help="queries per round for per-query benchmarks")
+    parser.add_argument("--longest-max-stations", type=int, default=1000,
+                        help="skip longest_route_no_repeats above this many stations")
+    parser.add_argument("--longest-budget", type=float, default=1.0,
+                        help="time budget in seconds for each longest_route_no_repeats search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+    # Per-call INFO logging inside the measured code would dominate the timings.
+    for name in ("trip_manager", "network", "timetable", "schedule_builder", "snapshot_file", "longest_route", "contraction"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = run_benchmarks([int(size) for size in args.sizes.split(",")], args.repeat, args.queries,
+                            args.longest_max_stations, args.seed, args.longest_budget)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(report['results'])} results to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            lines, regressions = compare(report, json.load(f), args.threshold)
+        print(f"{'benchmark':<26} {'size':>6} {'baseline ms':>12} {'current ms':>12} {'ratio':>8}")
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}:")
+            print("\n".join(regressions))
+            sys.exit(1)
@@ -26,6 +26,7 @@ DROP TABLE IF EXISTS transactions CASCADE;
 DROP TABLE IF EXISTS trips CASCADE;
 DROP TABLE IF EXISTS peak_times CASCADE;
 DROP TABLE IF EXISTS transfer_times CASCADE;
+DROP TABLE IF EXISTS transfer_stations CASCADE;
 DROP TABLE IF EXISTS trains CASCADE;
 DROP TABLE IF EXISTS routes CASCADE;
 DROP TABLE IF EXISTS holidays CASCADE;
@@ -86,6 +87,12 @@ CREATE TABLE transfer_times (
     PRIMARY KEY (station_id, from_line_id, to_line_id)
 );
 
+CREATE TABLE transfer_stations (
+    station_id VARCHAR(10) REFERENCES stations(station_id),
+    line_id INTEGER REFERENCES lines(line_id),
+    PRIMARY KEY (station_id, line_id)
+);
+
 CREATE TABLE schedule_templates (
     template_id SERIAL PRIMARY KEY,
     template_name VARCHAR(50) NOT NULL,
@@ -156,11 +163,23 @@ CREATE TABLE schedules (
     line_id INTEGER REFERENCES lines(line_id),
     station_id VARCHAR(10) REFERENCES stations(station_id),
     departure_time TIME,
-    day_type VARCHAR(20),
+    day_type VARCHAR(64),
     next_station_id VARCHAR(10) REFERENCES stations(station_id),
     UNIQUE (line_id, station_id, departure_time, day_type)
 );
 
+-- One row per generated (day_type, line, pattern) slice of schedules; the
+-- fingerprint covers the pattern's stops and effective frequency rules so
+-- incremental regeneration can skip unchanged slices.
+CREATE TABLE schedule_slices (
+    day_type VARCHAR(64),
+    line_id INTEGER REFERENCES lines(line_id),
+    pattern_id INTEGER REFERENCES service_patterns(pattern_id),
+    fingerprint CHAR(40) NOT NULL,
+    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (day_type, line_id, pattern_id)
+);
+
 CREATE TABLE trips (
     trip_id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(user_id),
@@ -203,11 +222,46 @@ GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO "user";
 
 -- 5. Add Indexes
 CREATE INDEX IF NOT EXISTS idx_schedules_line_station ON schedules(line_id, station_id, next_station_id);
+CREATE INDEX IF NOT EXISTS idx_schedules_day_type_line ON schedules(day_type, line_id);
 CREATE INDEX IF NOT EXISTS idx_trips_user_start ON trips(user_id, start_time);
 CREATE INDEX IF NOT EXISTS idx_annual_calendar_template ON annual_calendar(template_id);
 CREATE INDEX IF NOT EXISTS idx_frequency_rules_template_line ON frequency_rules(template_id, line_id);
 CREATE INDEX IF NOT EXISTS idx_schedule_adjustments_date_line ON schedule_adjustments(date_id, line_id);
 
+-- Tell running backends (network_reloader.py) when the network tables change
+CREATE OR REPLACE FUNCTION notify_network_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('network_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stations_network_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON stations
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_network_changed();
+CREATE TRIGGER lines_network_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON lines
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_network_changed();
+CREATE TRIGGER routes_network_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON routes
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_network_changed();
+CREATE TRIGGER transfer_times_network_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON transfer_times
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_network_changed();
+CREATE TRIGGER transfer_stations_network_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON transfer_stations
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_network_changed();
+
+-- and when schedules are regenerated or the calendar moves, so cached timetables are dropped
+CREATE OR REPLACE FUNCTION notify_schedules_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('schedules_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER schedules_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON schedules
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_schedules_changed();
+CREATE TRIGGER annual_calendar_schedules_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON annual_calendar
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_schedules_changed();
+CREATE TRIGGER schedule_adjustments_schedules_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON schedule_adjustments
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_schedules_changed();
+
 -- 6. Insert Data
 -- Insert lines
 INSERT INTO lines (line_name, start_time, end_time) VALUES
@@ -0,0 +1,243 @@
+import heapq
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Witness searches give up after settling this many nodes and add the
+# shortcut anyway: a few redundant shortcuts are cheaper than exact searches.
+WITNESS_SETTLE_LIMIT = 64
+# The arrays that fully describe a hierarchy (see to_arrays / snapshot_file).
+CONTRACTION_FIELDS = ("up_indptr", "up_indices", "up_weights", "up_middle",
+                      "down_indptr", "down_indices", "down_weights", "down_middle")
+
+
+class ContractionHierarchy:
+    """Contraction hierarchy over a snapshot's (station, line) node graph.
+
+    Nodes are contracted one at a time, least important first; a shortcut
+    u -> x through the contracted node v is added whenever u -> v -> x was
+    the only shortest way between them. Every edge then leads either up or
+    down the order: up[n] holds the edges n -> m and down[n] the edges
+    m -> n for nodes m contracted after n, both CSR-style. A query runs
+    Dijkstra upwards from the sources and (on the reversed edges) from the
+    targets, so it only settles the few important nodes above them.
+    Shortcuts remember the node they skip (middle, -1 for real edges) so
+    routes unpack back to the original hops.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        # Views rather than lists, so workers share a mapped snapshot's pages.
+        self.up = tuple(_view(arrays[f"up_{name}"]) for name in ("indptr", "indices", "weights", "middle"))
+        self.down = tuple(_view(arrays[f"down_{name}"]) for name in ("indptr", "indices", "weights", "middle"))
+
+    @classmethod
+    def build(cls, indptr, indices, weights):
+        """Contracts the CSR graph given as Python lists, in edge-difference order."""
+        num_nodes = len(indptr) - 1
+        # Remaining graph: node -> {neighbor: (weight, middle)} both ways.
+        out_edges = [{} for _ in range(num_nodes)]
+        in_edges = [{} for _ in range(num_nodes)]
+        for u in range(num_nodes):
+            for e in range(indptr[u], indptr[u + 1]):
+                v, w = indices[e], weights[e]
+                if v != u and w < out_edges[u].get(v, (float('inf'),))[0]:
+                    out_edges[u][v] = (w, -1)
+                    in_edges[v][u] = (w, -1)
+
+        def shortcuts(v):
+            needed = []
+            for u, (w_in, _) in in_edges[v].items():
+                limits = {x: w_in + w_out for x, (w_out, _) in out_edges[v].items() if x != u}
+                if not limits:
+                    continue
+                witness = _witness_distances(out_edges, u, v, limits)
+                needed.extend((u, x, w) for x, w in limits.items() if witness.get(x, float('inf')) > w)
+            return needed
+
+        contracted_neighbors = [0] * num_nodes
+        level = [0] * num_nodes
+
+        def priority(v):
+            return len(shortcuts(v)) - len(in_edges[v]) - len(out_edges[v]) + contracted_neighbors[v] + level[v]
+
+        queue = [(priority(v), v) for v in range(num_nodes)]
+        heapq.heapify(queue)
+        up = [[] for _ in range(num_nodes)]
+        down = [[] for _ in range(num_nodes)]
+        num_shortcuts = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            # Lazy updates: priorities go stale as neighbours are contracted.
+            current = priority(v)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, v))
+                continue
+            for u, x, w in shortcuts(v):
+                if w < out_edges[u].get(x, (float('inf'),))[0]:
+                    out_edges[u][x] = (w, v)
+                    in_edges[x][u] = (w, v)
+                    num_shortcuts += 1
+            for x, (w, middle) in out_edges[v].items():
+                up[v].append((x, w, middle))
+                del in_edges[x][v]
+                contracted_neighbors[x] += 1
+                level[x] = max(level[x], level[v] + 1)
+            for u, (w, middle) in in_edges[v].items():
+                down[v].append((u, w, middle))
+                del out_edges[u][v]
+                contracted_neighbors[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            out_edges[v] = in_edges[v] = None
+        logger.info(f"Contracted {num_nodes} nodes with {num_shortcuts} shortcuts")
+        return cls({**_to_csr("up", up), **_to_csr("down", down)})
+
+    def to_arrays(self):
+        return {name: self.arrays[name] for name in CONTRACTION_FIELDS}
+
+    def route(self, sources, targets):
+        """Returns (node path, travel time) from the closest source to the closest target, or None."""
+        forward = _Search(self.up, self.down, sources)
+        backward = _Search(self.down, self.up, targets)
+        best, meeting = float('inf'), None
+        for node in forward.distances:
+            if node in backward.distances:
+                best, meeting = 0, node
+        while forward.queue or backward.queue:
+            search, other = (forward, backward) if backward.empty() or (not forward.empty() and forward.top() <= backward.top()) \
+                else (backward, forward)
+            dist, node = heapq.heappop(search.queue)
+            if dist >= best:
+                break
+            for reached, total in search.expand(dist, node):
+                if reached in other.distances and total + other.distances[reached] < best:
+                    best, meeting = total + other.distances[reached], reached
+        if meeting is None:
+            return None
+
+        path = [forward.origin(meeting)]
+        for node, edge in reversed(forward.edges_to(meeting)):
+            self._unpack(node, self.up[1][edge], self.up[3][edge], path)
+        for node, edge in backward.edges_to(meeting):
+            # Backward edges run against travel: the hop goes from edge target back to node.
+            self._unpack(self.down[1][edge], node, self.down[3][edge], path)
+        return path, int(best)
+
+    def _unpack(self, a, b, middle, path):
+        """Appends the original hops of edge a -> b (after a) to path."""
+        stack = [(a, b, middle)]
+        while stack:
+            a, b, middle = stack.pop()
+            if middle < 0:
+                path.append(b)
+                continue
+            # middle was contracted before a and b, so a -> middle is one of its down
+            # edges and middle -> b one of its up edges.
+            stack.append((middle, b, _middle_of(self.up, middle, b)))
+            stack.append((a, middle, _middle_of(self.down, middle, a)))
+
+
+class _Search:
+    """One direction of a hierarchy query, upward from its origins.
+
+    stall_graph holds the edges into each node from above; a node that one
+    of them reaches more cheaply is not on any shortest route and is not
+    expanded (stall-on-demand).
+    """
+
+    def __init__(self, graph, stall_graph, origins):
+        self.graph = graph
+        self.stall_graph = stall_graph
+        self.distances = {node: 0 for node in origins}
+        self.parent = {node: None for node in origins}
+        self.queue = [(0, node) for node in origins]
+
+    def empty(self):
+        return not self.queue
+
+    def top(self):
+        return self.queue[0][0]
+
+    def expand(self, dist, node):
+        """Relaxes the edges of a popped node; yields the nodes whose distance improved."""
+        distances = self.distances
+        if dist > distances[node]:
+            return
+        indptr, indices, weights, _ = self.stall_graph
+        for e in range(indptr[node], indptr[node + 1]):
+            if distances.get(indices[e], float('inf')) + weights[e] < dist:
+                return
+        indptr, indices, weights, _ = self.graph
+        for e in range(indptr[node], indptr[node + 1]):
+            neighbor = indices[e]
+            new_dist = dist + weights[e]
+            if new_dist < self.distances.get(neighbor, float('inf')):
+                self.distances[neighbor] = new_dist
+                self.parent[neighbor] = (node, e)
+                heapq.heappush(self.queue, (new_dist, neighbor))
+                yield neighbor, new_dist
+
+    def edges_to(self, node):
+        """(from node, edge index) pairs from node back to its origin."""
+        edges = []
+        while self.parent[node] is not None:
+            edges.append(self.parent[node])
+            node = self.parent[node][0]
+        return edges
+
+    def origin(self, node):
+        while self.parent[node] is not None:
+            node = self.parent[node][0]
+        return node
+
+
+def _witness_distances(out_edges, source, skip, limits):
+    """Distances from source avoiding skip, searched only as far as the longest limit."""
+    max_dist = max(limits.values())
+    remaining = len(limits)
+    distances = {source: 0}
+    queue = [(0, source)]
+    settled = 0
+    while queue and remaining and settled < WITNESS_SETTLE_LIMIT:
+        dist, node = heapq.heappop(queue)
+        if dist > distances[node]:
+            continue
+        if dist > max_dist:
+            break
+        settled += 1
+        if node in limits:
+            remaining -= 1
+        for neighbor, (w, _) in out_edges[node].items():
+            new_dist = dist + w
+            if neighbor != skip and new_dist < distances.get(neighbor, float('inf')):
+                distances[neighbor] = new_dist
+                heapq.heappush(queue, (new_dist, neighbor))
+    return distances
+
+
+def _middle_of(graph, node, neighbor):
+    indptr, indices, _, middle = graph
+    for e in range(indptr[node], indptr[node + 1]):
+        if indices[e] == neighbor:
+            return middle[e]
+    raise KeyError(f"No hierarchy edge between {node} and {neighbor}")
+
+
+def _view(array):
+    """Zero-copy sequence of Python ints over a 1-D integer array (see timetable._view)."""
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("="))
+    return memoryview(array) if len(array) else []
+
+
+def _to_csr(prefix, edges):
+    indptr = np.zeros(len(edges) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(node_edges) for node_edges in edges])
+    flat = [edge for node_edges in edges for edge in node_edges]
+    return {
+        f"{prefix}_indptr": indptr,
+        f"{prefix}_indices": np.array([edge[0] for edge in flat], dtype=np.int32),
+        f"{prefix}_weights": np.array([edge[1] for edge in flat], dtype=np.int32),
+        f"{prefix}_middle": np.array([edge[2] for edge in flat], dtype=np.int32),
+    }
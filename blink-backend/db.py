@@ -1,41 +1,117 @@
 import os
+import threading
+import time
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extensions import cursor as base_cursor
 from fastapi import HTTPException
 from dotenv import load_dotenv
-import uuid
+from metrics import POOL_EXHAUSTED, POOL_WAIT_SECONDS, REGISTRY, record_query, register_pool
+from sessions import create_session_store
+import profiler
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-session_store = {}
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+# Seconds a caller waits for a free connection before the request fails with 503.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+session_store = create_session_store()
 db_pool = None
 
+def connection_params():
+    return {
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "database": os.getenv("DB_NAME"),
+    }
+
+class TimedCursor(base_cursor):
+    """Cursor that reports every execute to the metrics and the query profiler."""
+
+    def _timed(self, run, query):
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            seconds = time.perf_counter() - started
+            record_query(seconds)
+            if profiler.is_profiling():
+                profiler.record_query(query, seconds, self.rowcount)
+
+    def execute(self, query, vars=None):
+        return self._timed(lambda: super(TimedCursor, self).execute(query, vars), query)
+
+    def executemany(self, query, vars_list):
+        return self._timed(lambda: super(TimedCursor, self).executemany(query, vars_list), query)
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """Thread-safe pool whose getconn waits up to timeout for a free connection.
+
+    psycopg2's own pools raise PoolError at once when every connection is
+    borrowed; this one raises it only after the wait.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=DB_POOL_TIMEOUT, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"connection pool exhausted after {self.timeout}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
 def get_db_pool():
     global db_pool
     if db_pool is None:
         try:
-            db_pool = psycopg2.pool.SimpleConnectionPool(
-                1, 20,
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT"),
-                database=os.getenv("DB_NAME")
-            )
+            db_pool = BlockingConnectionPool(1, DB_POOL_MAX, cursor_factory=TimedCursor, **connection_params())
             logger.info("Database connection pool created successfully")
         except Exception as e:
             logger.error(f"Error creating database connection pool: {e}")
             raise
     return db_pool
 
-def get_db_connection(session_token):
-    if not validate_session(session_token):
+def close_db_pool():
+    global db_pool
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+        logger.info("Database connection pool closed")
+
+def get_db_connection(session_token=None, internal=False):
+    """Borrows a pooled connection for a valid session.
+
+    In-process callers (TripManager loaders, the simulator, the reloader)
+    pass internal=True instead of a token; there is no credential that
+    lets an HTTP client do the same.
+    """
+    if not internal and not validate_session(session_token):
         raise HTTPException(status_code=403, detail="Invalid session")
-    pool = get_db_pool()
-    conn = pool.getconn()
+    connections = get_db_pool()
+    started = time.perf_counter()
+    try:
+        conn = connections.getconn()
+    except pool.PoolError as e:
+        POOL_EXHAUSTED.inc(pool="sync")
+        logger.error(f"No database connection available: {e}")
+        raise HTTPException(status_code=503, detail="Database busy, try again")
+    finally:
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - started, pool="sync")
     if conn:
         logger.info("Borrowing connection from pool")
         return conn
@@ -46,12 +122,18 @@ def release_db_connection(conn):
         logger.info("Releasing connection back to pool")
         get_db_pool().putconn(conn)
 
-def create_session(role):
-    token = str(uuid.uuid4())
-    session_store[token] = {"role": role}
+def create_session(role, user_id=None):
+    token = session_store.create(role, user_id)
     logger.info(f"Session created: {token} with role {role}")
     return token
 
+def revoke_session(session_token):
+    session_store.revoke(session_token)
+
+def get_session(session_token):
+    """Returns the stored session ({"role", "user_id"}) for a token, or None."""
+    return session_store.get(session_token)
+
 def validate_session(session_token, required_role=None):
     session = session_store.get(session_token)
     if not session:
@@ -67,4 +149,18 @@ def get_max_connections():
     return db_pool.maxconn
 
 def get_all_sessions():
-    return [{"token": k, "role": v["role"]} for k, v in session_store.items()]
\ No newline at end of file
+    return [{"token": k, "role": v["role"]} for k, v in session_store.items()]
+
+def pool_usage():
+    if db_pool is None:
+        return None
+    return len(get_active_connections()), get_max_connections()
+
+def collect_sessions():
+    roles = {}
+    for session in get_all_sessions():
+        roles[session["role"]] = roles.get(session["role"], 0) + 1
+    return [({"role": role}, count) for role, count in sorted(roles.items())]
+
+register_pool("sync", pool_usage)
+REGISTRY.gauge("blink_sessions", "Stored sessions by role", collect_sessions)
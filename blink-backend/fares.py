@@ -0,0 +1,200 @@
+import os
+import numpy as np
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from cache import TTLCache
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+SETTLE_CHUNK = 50000
+# Fares priced on demand for networks without a fare matrix, kept per station pair.
+FARE_PAIR_CACHE_SIZE = int(os.getenv("FARE_PAIR_CACHE_SIZE", "100000"))
+FARE_PAIR_CACHE_TTL = float(os.getenv("FARE_PAIR_CACHE_TTL", "86400"))
+
+
+class FareRules:
+    """Distance-based fare: base + per_stop for every stop after the first + per_transfer, capped at cap.
+
+    Amounts are in VND; the defaults follow the Line 1 7,000-20,000 VND range.
+    """
+
+    def __init__(self, base=None, per_stop=None, per_transfer=None, cap=None):
+        self.base = base if base is not None else float(os.getenv("FARE_BASE", "7000"))
+        self.per_stop = per_stop if per_stop is not None else float(os.getenv("FARE_PER_STOP", "1000"))
+        self.per_transfer = per_transfer if per_transfer is not None else float(os.getenv("FARE_PER_TRANSFER", "0"))
+        self.cap = cap if cap is not None else float(os.getenv("FARE_CAP", "20000"))
+
+    def price(self, stops, transfers):
+        """Vectorized fare for arrays of ride stops and transfer counts; NaN stays NaN."""
+        stops = np.asarray(stops, dtype=np.float64)
+        transfers = np.asarray(transfers, dtype=np.float64)
+        fare = self.base + self.per_stop * np.maximum(stops - 1, 0) + self.per_transfer * transfers
+        return np.round(np.minimum(fare, self.cap), 2)
+
+
+def count_hops(network, sources, targets, next_hop):
+    """Walks many node paths of a RouteMatrix at once; returns (ride stops, transfers) per pair.
+
+    Paths that cannot reach their target come back as -1.
+    """
+    n = network.num_nodes
+    src = np.repeat(np.arange(n, dtype=np.int32), np.diff(network.indptr))
+    ride = np.zeros((n, n), dtype=bool)
+    ride[src[~network.edge_is_transfer], network.indices[~network.edge_is_transfer]] = True
+    transfer = np.zeros((n, n), dtype=bool)
+    transfer[src[network.edge_is_transfer], network.indices[network.edge_is_transfer]] = True
+
+    current = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    stops = np.zeros(len(current), dtype=np.int32)
+    transfers = np.zeros(len(current), dtype=np.int32)
+    reachable = next_hop[current, targets] >= 0
+    active = reachable & (current != targets)
+    while active.any():
+        step = np.where(active, next_hop[current, targets], current)
+        stops += ride[current, step] & active
+        transfers += transfer[current, step] & active
+        current = step
+        active &= current != targets
+    stops[~reachable] = -1
+    transfers[~reachable] = -1
+    return stops, transfers
+
+
+class FareEngine:
+    """Prices trips between stations from the network's shortest routes.
+
+    For networks small enough to have an all-pairs RouteMatrix, the route
+    every station pair would take is walked once up front into station x
+    station stop and transfer matrices, and the fare matrix is derived from
+    those, so pricing a batch is a single fancy-index lookup. Larger
+    networks price each distinct origin-destination pair on demand with a
+    contraction hierarchy query and remember the result in a bounded LRU.
+    Fares use the off-peak weights so a trip costs the same at any time of
+    day.
+    """
+
+    def __init__(self, network, rules=None):
+        self.network = network
+        self.rules = rules or FareRules()
+        self.fare_matrix = None
+        self._pair_fares = TTLCache(FARE_PAIR_CACHE_SIZE, FARE_PAIR_CACHE_TTL)
+        matrix = network.route_matrix(False)
+        if matrix is not None:
+            self.stops, self.transfers = self._station_matrices(matrix)
+            fare = self.rules.price(self.stops, self.transfers)
+            fare[self.stops < 0] = np.nan
+            self.fare_matrix = fare
+
+    def _station_matrices(self, matrix):
+        network = self.network
+        n = network.num_nodes
+        num_stations = len(network.station_ids)
+        # For every station pair keep the node pair with the shortest travel time.
+        node_station = network.node_station.astype(np.int64)
+        key = (node_station[:, None] * num_stations + node_station[None, :]).ravel()
+        order = np.lexsort((matrix.dist.ravel(), key))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key[order][1:] != key[order][:-1]
+        chosen = order[first]
+        stops, transfers = count_hops(network, chosen // n, chosen % n, matrix.next_hop)
+        stop_matrix = np.full(num_stations * num_stations, -1, dtype=np.int32)
+        transfer_matrix = np.full(num_stations * num_stations, -1, dtype=np.int32)
+        stop_matrix[key[chosen]] = stops
+        transfer_matrix[key[chosen]] = transfers
+        logger.info(f"Built fare matrix over {num_stations} stations")
+        return stop_matrix.reshape(num_stations, -1), transfer_matrix.reshape(num_stations, -1)
+
+    def _pair_fare(self, origin, destination):
+        fare = self._pair_fares.get((origin, destination))
+        if fare is None:
+            network = self.network
+            route = network.contraction(False).route(network.station_nodes.get(origin, []),
+                                                     network.station_nodes.get(destination, []))
+            fare = np.nan
+            if route is not None:
+                nodes = route[0]
+                rides = sum(1 for a, b in zip(nodes, nodes[1:]) if network.node_station[a] != network.node_station[b])
+                fare = float(self.rules.price(rides, len(nodes) - 1 - rides))
+            self._pair_fares.set((origin, destination), fare)
+        return fare
+
+    def price(self, start_station_ids, end_station_ids):
+        """Returns a float array of fares for parallel lists of station ids; NaN where no fare applies."""
+        index = self.network.station_index
+        origins = np.array([index.get(station_id, -1) for station_id in start_station_ids], dtype=np.int64)
+        destinations = np.array([index.get(station_id, -1) for station_id in end_station_ids], dtype=np.int64)
+        known = (origins >= 0) & (destinations >= 0)
+        fares = np.full(len(origins), np.nan)
+        if self.fare_matrix is not None:
+            fares[known] = self.fare_matrix[origins[known], destinations[known]]
+        else:
+            for position in np.flatnonzero(known):
+                fares[position] = self._pair_fare(int(origins[position]), int(destinations[position]))
+        return fares
+
+
+def settle_trips(conn, engine, ended_before=None, payment_method="balance"):
+    """Prices every completed, unpriced trip and settles it in one transaction.
+
+    Trips are read through a server-side cursor in chunks of SETTLE_CHUNK;
+    each chunk is priced in one vectorized call, its fares written with one
+    UPDATE, rider balances debited with one UPDATE over per-user totals and
+    a transactions row inserted per trip. Everything commits together at the
+    end. Trips with no route between their stations are left unpriced.
+    Returns (trips settled, trips skipped, total amount).
+    """
+    reader = conn.cursor(name="settle_trips")
+    writer = conn.cursor()
+    settled = skipped = 0
+    total = 0.0
+    try:
+        reader.execute("""
+            SELECT trip_id, user_id, start_station_id, end_station_id, end_time
+            FROM trips
+            WHERE fare IS NULL AND end_station_id IS NOT NULL AND end_time IS NOT NULL
+              AND user_id IS NOT NULL AND (%s::timestamp IS NULL OR end_time < %s::timestamp)
+            FOR UPDATE
+        """, (ended_before, ended_before))
+        while True:
+            rows = reader.fetchmany(SETTLE_CHUNK)
+            if not rows:
+                break
+            trip_ids, user_ids, starts, ends, end_times = zip(*rows)
+            fares = engine.price(starts, ends)
+            priced = np.flatnonzero(~np.isnan(fares))
+            skipped += len(rows) - len(priced)
+            if not len(priced):
+                continue
+            user_array = np.array(user_ids, dtype=np.int64)[priced]
+            users, slot = np.unique(user_array, return_inverse=True)
+            totals = np.round(np.bincount(slot, weights=fares[priced]), 2)
+            execute_values(writer, """
+                UPDATE trips t SET fare = v.fare
+                FROM (VALUES %s) AS v(trip_id, fare)
+                WHERE t.trip_id = v.trip_id
+            """, [(trip_ids[i], float(fares[i])) for i in priced], template="(%s, %s::numeric)", page_size=5000)
+            execute_values(writer, """
+                UPDATE users u SET balance = u.balance - v.amount
+                FROM (VALUES %s) AS v(user_id, amount)
+                WHERE u.user_id = v.user_id
+            """, list(zip(users.tolist(), totals.tolist())), template="(%s, %s::numeric)", page_size=5000)
+            execute_values(writer, """
+                INSERT INTO transactions (user_id, station_id, amount, payment_method, timestamp, status)
+                VALUES %s
+            """, [(user_ids[i], ends[i], float(fares[i]), payment_method, end_times[i], "settled") for i in priced],
+                page_size=5000)
+            settled += len(priced)
+            total += float(totals.sum())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        reader.close()
+        writer.close()
+    logger.info(f"Settled {settled} trips for {total:.2f}, skipped {skipped} without a route")
+    return settled, skipped, round(total, 2)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TAP_KINDS = ("in", "out")
+
+
+def parse_records(records, station_map, default_user_id=None):
+    """Validates trip and tap records against station_map in one pass.
+
+    A record with "tap" set to "in" or "out" is a gate tap: a tap-in opens a
+    trip at "station", a tap-out closes the rider's latest open trip there.
+    Any other record is a full trip with start_station/end_station.
+    Returns (rows, results): rows are ("insert", index, (user_id,
+    start_station_id, end_station_id, start_time, end_time, description)) or
+    ("close", index, (user_id, end_station_id, end_time)), and results has a
+    rejection dict for every invalid record and None for the rest.
+    """
+    rows = []
+    results = [None] * len(records)
+    for index, record in enumerate(records):
+        user_id = record.get("user_id") or default_user_id
+        tap = record.get("tap")
+        error = None
+        if user_id is None:
+            error = "user_id is required"
+        elif tap is not None:
+            station_id = station_map.get(record.get("station"))
+            tapped_at = record.get("time")
+            if tap not in TAP_KINDS:
+                error = f"Unknown tap kind {tap}"
+            elif station_id is None:
+                error = f"Unknown station {record.get('station')}"
+            elif tapped_at is None:
+                error = "Tap time is required"
+            elif tap == "in":
+                rows.append(("insert", index, (user_id, station_id, None, tapped_at, None, record.get("description"))))
+            else:
+                rows.append(("close", index, (user_id, station_id, tapped_at)))
+        else:
+            start_id = station_map.get(record.get("start_station"))
+            end_id = station_map.get(record.get("end_station"))
+            if start_id is None:
+                error = f"Unknown station {record.get('start_station')}"
+            elif record.get("end_station") is not None and end_id is None:
+                error = f"Unknown station {record.get('end_station')}"
+            else:
+                rows.append(("insert", index, (user_id, start_id, end_id, record.get("start_time"),
+                                               record.get("end_time"), record.get("description"))))
+        if error:
+            results[index] = {"index": index, "status": "rejected", "error": error}
+    return rows, results
+
+
+class GroupCommitter:
+    """Coalesces concurrent submissions into a single write.
+
+    submit() queues its items and waits. One flusher task collects everything
+    queued for up to max_delay seconds (or until max_batch items are waiting),
+    hands it to write(items) in one call and gives each submitter back its
+    own slice of the returned per-item results. Only one write runs at a
+    time; items submitted meanwhile go into the next group.
+    """
+
+    def __init__(self, write, max_batch=5000, max_delay=0.005):
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._pending_items = 0
+        self._full = asyncio.Event()
+        self._task = None
+        self.commits = 0
+        self.items_written = 0
+
+    async def submit(self, items):
+        if not items:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((items, future))
+        self._pending_items += len(items)
+        if self._pending_items >= self.max_batch:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            group, self._pending, self._pending_items = self._pending, [], 0
+            items = [item for submitted, _ in group for item in submitted]
+            try:
+                results = await self.write(items)
+            except Exception as e:
+                logger.error(f"Group commit of {len(items)} items from {len(group)} requests failed: {e}")
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.commits += 1
+            self.items_written += len(items)
+            offset = 0
+            for submitted, future in group:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(submitted)])
+                offset += len(submitted)
@@ -0,0 +1,155 @@
+import asyncio
+import json
+from datetime import datetime
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TRAIN_FIELDS = ("line_id", "current_route_id", "current_station_id", "next_station_id", "status", "last_updated")
+_CLOSED = object()
+
+
+class Subscription:
+    """One client's filtered view of the train stream; iterate it to receive events."""
+
+    def __init__(self, hub, lines, stations, queue_size):
+        self.hub = hub
+        self.lines = frozenset(lines or ())
+        self.stations = frozenset(stations or ())
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+        # Last state sent to this subscriber per train; events are diffed against it.
+        self.sent = {}
+
+    def matches(self, state):
+        if not self.lines and not self.stations:
+            return True
+        return (
+            state.get("line_id") in self.lines
+            or state.get("current_station_id") in self.stations
+            or state.get("next_station_id") in self.stations
+        )
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is _CLOSED:
+            raise StopAsyncIteration
+        return event
+
+
+class BroadcastHub:
+    """In-process fan-out of train state changes to many subscribers.
+
+    Publishers hand over full train states; the hub remembers the last state
+    of every train and forwards each subscriber only the fields that changed
+    since the state it was last sent (all of them for a train it has not
+    seen), so a train coming back into a filter arrives up to date. Subscribers
+    are indexed by line and station so each event only visits interested
+    clients. Every subscriber has a bounded queue: one that falls behind by
+    queue_size events is dropped rather than slowing everyone else down.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.loop = None
+        self.states = {}
+        self._everything = set()
+        self._by_line = {}
+        self._by_station = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def bind(self, loop):
+        """Sets the event loop that owns the subscriber queues."""
+        self.loop = loop
+
+    @property
+    def subscriber_count(self):
+        subscribers = set(self._everything)
+        for group in (self._by_line, self._by_station):
+            for subs in group.values():
+                subscribers |= subs
+        return len(subscribers)
+
+    def subscribe(self, lines=None, stations=None):
+        """Registers a subscriber and queues the current state of every matching train."""
+        subscription = Subscription(self, lines, stations, self.queue_size)
+        if not subscription.lines and not subscription.stations:
+            self._everything.add(subscription)
+        for line_id in subscription.lines:
+            self._by_line.setdefault(line_id, set()).add(subscription)
+        for station_id in subscription.stations:
+            self._by_station.setdefault(station_id, set()).add(subscription)
+        for train_id, state in self.states.items():
+            if subscription.matches(state) and not subscription.queue.full():
+                subscription.queue.put_nowait({"train_id": train_id, **state})
+                subscription.sent[train_id] = state
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._everything.discard(subscription)
+        for line_id in subscription.lines:
+            self._by_line.get(line_id, set()).discard(subscription)
+        for station_id in subscription.stations:
+            self._by_station.get(station_id, set()).discard(subscription)
+
+    def publish_train(self, train, event_time):
+        """Simulation engine listener; safe to call from any thread."""
+        state = {field: getattr(train, field) for field in TRAIN_FIELDS}
+        state["last_updated"] = event_time
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.publish, train.train_id, state)
+
+    def publish(self, train_id, state):
+        """Forwards the changed fields of one train's state; must run on the hub's loop."""
+        previous = self.states.get(train_id, {})
+        delta = {key: value for key, value in state.items() if previous.get(key) != value}
+        if not delta:
+            return
+        current = self.states[train_id] = {**previous, **state}
+        self.published += 1
+        event = {"train_id": train_id, **delta}
+        recipients = set(self._everything)
+        recipients |= self._by_line.get(state.get("line_id"), set())
+        for station_id in {previous.get("current_station_id"), state.get("current_station_id"), state.get("next_station_id")}:
+            recipients |= self._by_station.get(station_id, set())
+        for subscription in recipients:
+            sent = subscription.sent.get(train_id)
+            if sent is None:
+                own_event = {"train_id": train_id, **current}
+            elif sent is previous:
+                # Up to date until now: the shared delta is exactly what changed for it.
+                own_event = event
+            else:
+                changed = {key: value for key, value in current.items() if sent.get(key) != value}
+                if not changed:
+                    continue
+                own_event = {"train_id": train_id, **changed}
+            try:
+                subscription.queue.put_nowait(own_event)
+                subscription.sent[train_id] = current
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self._drop(subscription)
+
+    def _drop(self, subscription):
+        logger.warning(f"Dropping slow live subscriber after {self.queue_size} undelivered events")
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(_CLOSED)
+        self.dropped += 1
+
+
+def encode_event(event):
+    return json.dumps(event, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
@@ -0,0 +1,189 @@
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# (junction, visited junctions, first segment) states remembered for dominance pruning.
+MAX_MEMO_STATES = 200000
+BUDGET_CHECK_EVERY = 256
+
+
+class SegmentGraph:
+    """A station graph with every chain of degree-2 stations collapsed into one segment.
+
+    Junctions are the stations whose degree is not 2 (interchanges, branch
+    points and termini; one station stands in for each plain loop). Each
+    segment joins two junctions, possibly the same one, through the
+    interior stations listed from a to b.
+    """
+
+    def __init__(self, adjacency):
+        neighbors = {station: set() for station in adjacency}
+        for station, adjacent in adjacency.items():
+            for other in adjacent:
+                if other != station:
+                    neighbors[station].add(other)
+                    neighbors.setdefault(other, set()).add(station)
+        self.num_stations = len(neighbors)
+        junctions = [station for station in sorted(neighbors) if len(neighbors[station]) != 2]
+        junction_set = set(junctions)
+
+        self.segments = []
+        walked = set()
+
+        def walk(start, first):
+            interior, previous, current = [], start, first
+            while current not in junction_set:
+                walked.add((previous, current))
+                interior.append(current)
+                previous, current = current, next(n for n in neighbors[current] if n != previous)
+            walked.add((previous, current))
+            walked.add((current, previous))
+            if interior:
+                walked.add((first, start))
+            self.segments.append((start, current, tuple(interior)))
+
+        for junction in junctions:
+            for first in sorted(neighbors[junction]):
+                if (junction, first) not in walked:
+                    walk(junction, first)
+        # Whatever is left are rings of degree-2 stations; anchor each on one of its stations.
+        for station in sorted(neighbors):
+            if station not in junction_set and not any((station, n) in walked for n in neighbors[station]):
+                junctions.append(station)
+                junction_set.add(station)
+                walk(station, min(neighbors[station]))
+
+        self.junctions = junctions
+        self.index = {junction: i for i, junction in enumerate(junctions)}
+        # Per junction: (segment, other junction index, interior length), longest first.
+        self.adjacent = [[] for _ in junctions]
+        for s, (a, b, interior) in enumerate(self.segments):
+            self.adjacent[self.index[a]].append((s, self.index[b], len(interior)))
+            if a != b:
+                self.adjacent[self.index[b]].append((s, self.index[a], len(interior)))
+        for moves in self.adjacent:
+            moves.sort(key=lambda move: -move[2])
+        self.component_size = self._component_sizes()
+
+    def _component_sizes(self):
+        component = [None] * len(self.junctions)
+        sizes = []
+        for root in range(len(self.junctions)):
+            if component[root] is not None:
+                continue
+            component[root] = len(sizes)
+            stack, members = [root], [root]
+            while stack:
+                for _, other, _ in self.adjacent[stack.pop()]:
+                    if component[other] is None:
+                        component[other] = len(sizes)
+                        stack.append(other)
+                        members.append(other)
+            segments = {s for member in members for s, _, _ in self.adjacent[member]}
+            sizes.append(len(members) + sum(len(self.segments[s][2]) for s in segments))
+        return [sizes[c] for c in component]
+
+    def stations_towards(self, segment, junction):
+        """Interior stations of a segment, ordered to end next to junction."""
+        a, b, interior = self.segments[segment]
+        return list(interior) if junction == b else list(reversed(interior))
+
+
+def longest_simple_path(adjacency, time_budget=None, max_expansions=None, clock=time.monotonic):
+    """Longest path visiting no station twice, or the best found within the budget; returns (stations, exact)."""
+    graph = SegmentGraph(adjacency)
+    junctions, adjacent = graph.junctions, graph.adjacent
+    if not junctions:
+        return [], True
+    deadline = None if time_budget is None else clock() + time_budget
+    largest = max(graph.component_size)
+    best_length, best_moves = 0, None
+    memo = {}
+    expansions = 0
+    exhausted = False
+
+    def visit(junction, mask, unavailable, bonus, start_segment, arrived_by=None):
+        """Closes the segments whose ends are now both visited: (stations consumed, longest dead-end)."""
+        for s, other, length in adjacent[junction]:
+            if s != start_segment and (other == junction or mask >> other & 1):
+                unavailable += length
+                if s != arrived_by:
+                    bonus = max(bonus, length)
+        return unavailable, bonus
+
+    starts = [(j, None, 0) for j in range(len(junctions))]
+    starts += [(j, s, length) for j in range(len(junctions)) for s, _, length in adjacent[j] if length]
+    starts.sort(key=lambda start: -start[2])
+    for junction, start_segment, lead in starts:
+        if exhausted or best_length >= largest:
+            break
+        mask = 1 << junction
+        used = 0 if start_segment is None else 1 << start_segment
+        unavailable, bonus = visit(junction, mask, 1 + lead, 0, start_segment)
+        length = 1 + lead
+        total = graph.component_size[junction]
+        if length > best_length:
+            best_length, best_moves = length, [(junction, start_segment)]
+        if length + (total - unavailable) + bonus <= best_length:
+            continue
+        moves = [(junction, start_segment)]
+        stack = [(junction, mask, used, length, unavailable, bonus, iter(adjacent[junction]))]
+        while stack:
+            current, mask, used, length, unavailable, bonus, options = stack[-1]
+            step = next(options, None)
+            if step is None:
+                stack.pop()
+                moves.pop()
+                continue
+            segment, other, interior = step
+            if used >> segment & 1:
+                continue
+            expansions += 1
+            if expansions % BUDGET_CHECK_EVERY == 0 and (
+                    (deadline is not None and clock() > deadline) or (max_expansions is not None and expansions > max_expansions)):
+                exhausted = True
+                break
+            if other == current or mask >> other & 1:
+                # Dead end: run into the segment and stop before its visited far end.
+                if length + interior > best_length:
+                    best_length, best_moves = length + interior, moves + [(segment, None)]
+                continue
+            new_mask = mask | 1 << other
+            new_length = length + interior + 1
+            new_unavailable, new_bonus = visit(other, new_mask, unavailable + 1, bonus, start_segment, segment)
+            if new_length > best_length:
+                best_length, best_moves = new_length, moves + [(segment, other)]
+            if new_length + (total - new_unavailable) + new_bonus <= best_length:
+                continue
+            key = (other, new_mask, start_segment)
+            reached = memo.get(key)
+            if reached is not None and reached >= new_length + new_bonus:
+                continue
+            if reached is not None or len(memo) < MAX_MEMO_STATES:
+                memo[key] = new_length if reached is None else max(reached, new_length)
+            moves.append((segment, other))
+            stack.append((other, new_mask, used | 1 << segment, new_length, new_unavailable, new_bonus, iter(adjacent[other])))
+
+    if exhausted:
+        logger.warning(f"Longest route search stopped after {expansions} expansions; returning the best of {best_length} stations")
+    return _stations(graph, best_moves), not exhausted
+
+
+def _stations(graph, moves):
+    junction, start_segment = moves[0]
+    current = graph.junctions[junction]
+    path = graph.stations_towards(start_segment, current) if start_segment is not None else []
+    path.append(current)
+    for segment, other in moves[1:]:
+        a, b, _ = graph.segments[segment]
+        if other is None:
+            # Dead end: the interior walked away from the current junction.
+            far = b if current == a else a
+            path.extend(graph.stations_towards(segment, far))
+            continue
+        path.extend(graph.stations_towards(segment, graph.junctions[other]))
+        current = graph.junctions[other]
+        path.append(current)
+    return path
@@ -1,8 +1,21 @@
-import bcrypt
-from fastapi import FastAPI, HTTPException, Form
-from datetime import datetime
-from trip_manager import TripManager
-from db import close_db_pool, create_session, get_active_connections, get_max_connections, get_all_sessions, ADMIN_USERNAME, validate_session, session_store, db_pool
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from fastapi import FastAPI, HTTPException, Form, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+from trip_manager import TripManager, TRIP_PAGE_MAX, decode_trip_cursor, trips_json
+from async_db import acquire, close_async_pool, get_async_pool
+from live import BroadcastHub, encode_event
+from metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from network_reloader import NetworkReloader
+from profiler import ProfilingMiddleware
+from passwords import password_hasher
+from db import close_db_pool, create_session, get_active_connections, get_max_connections, get_all_sessions, ADMIN_USERNAME, get_session, validate_session, session_store
 import logging
 
 # Configure logging
@@ -10,14 +23,38 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Blink Backend API", description="API for managing trips on the HCMC Metro")
+app.add_middleware(MetricsMiddleware)
+if os.getenv("QUERY_PROFILING") == "1":
+    app.add_middleware(ProfilingMiddleware)
 trip_manager = TripManager()
+live_hub = BroadcastHub(queue_size=int(os.getenv("LIVE_QUEUE_SIZE", "100")))
+network_reloader = NetworkReloader(trip_manager, interval=float(os.getenv("NETWORK_RELOAD_SECONDS", "60")))
 
 @app.on_event("startup")
 async def startup_event():
+    try:
+        await get_async_pool()
+    except Exception as e:
+        # Routing runs from the snapshot; DB-backed endpoints retry the pool on first use.
+        logger.warning(f"Starting in degraded mode without the database: {e}")
+    live_hub.bind(asyncio.get_running_loop())
+    if os.getenv("RUN_SIMULATION") == "1":
+        # Imported here so the API does not pull in the simulator unless asked to.
+        from simulation import run_simulation
+        threading.Thread(
+            target=run_simulation,
+            kwargs={"speed": float(os.getenv("SIMULATION_SPEED", "1.0")), "listeners": [live_hub.publish_train]},
+            name="simulation",
+            daemon=True,
+        ).start()
+    if network_reloader.interval > 0:
+        network_reloader.start()
     logger.info("Blink backend starting up...")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await asyncio.to_thread(network_reloader.stop)
+    await close_async_pool()
     close_db_pool()
     logger.info("Blink backend shutting down...")
 
@@ -27,82 +64,270 @@ async def root():
 
 @app.post("/signin")
 async def signin(username_or_email: str = Form(...), password: str = Form(...)):
-    conn = db_pool.getconn()
-    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            SELECT user_id, username, password_hash, role FROM users 
-            WHERE username = %s OR email = %s
-        """, (username_or_email, username_or_email))
-        result = cursor.fetchone()
+        async with acquire() as conn:
+            result = await conn.fetchrow("""
+                SELECT user_id, username, password_hash, role FROM users 
+                WHERE username = $1 OR email = $1
+            """, username_or_email)
         if not result:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
         user_id, username, stored_hash, role = result
-        if not bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8')):
+        valid, new_hash = await password_hasher.verify_and_upgrade(password, stored_hash)
+        if not valid:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        cursor.execute("UPDATE users SET last_login = NOW() WHERE user_id = %s", (user_id,))
-        conn.commit()
-        session_token = create_session(role=role)
+        async with acquire() as conn:
+            await conn.execute("""
+                UPDATE users SET last_login = NOW(), password_hash = COALESCE($2, password_hash)
+                WHERE user_id = $1
+            """, user_id, new_hash)
+        session_token = create_session(role=role, user_id=user_id)
         logger.info(f"User {username} signed in successfully")
         return {"message": f"Welcome back, {username}!", "session_token": session_token, "role": role}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Signin error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
-    finally:
-        cursor.close()
-        db_pool.putconn(conn)
 
 @app.post("/admin/login")
 async def admin_login(username: str, password: str):
     """Generate a new session token for an admin user."""
     if username != ADMIN_USERNAME:
         raise HTTPException(status_code=401, detail="Invalid admin credentials")
-    
-    conn = db_pool.getconn()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT password_hash FROM users WHERE username = %s", (username,))
-        result = cursor.fetchone()
-        if not result:
-            raise HTTPException(status_code=401, detail="Invalid admin credentials")
-        
-        stored_hash = result[0].encode('utf-8')
-        if not bcrypt.checkpw(password.encode('utf-8'), stored_hash):
-            raise HTTPException(status_code=401, detail="Invalid admin credentials")
-        
-        session_token = create_session(role="admin")
-        logger.info(f"Admin {username} logged in successfully")
-        return {"session_token": session_token}
-    finally:
-        cursor.close()
-        db_pool.putconn(conn)
+
+    async with acquire() as conn:
+        result = await conn.fetchval("SELECT password_hash FROM users WHERE username = $1", username)
+    if not result:
+        raise HTTPException(status_code=401, detail="Invalid admin credentials")
+
+    valid, new_hash = await password_hasher.verify_and_upgrade(password, result)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid admin credentials")
+    if new_hash:
+        async with acquire() as conn:
+            await conn.execute("UPDATE users SET password_hash = $2 WHERE username = $1", username, new_hash)
+
+    session_token = create_session(role="admin")
+    logger.info(f"Admin {username} logged in successfully")
+    return {"session_token": session_token}
 
 @app.post("/trips/add/")
 async def add_trip(trip: str, session_token: str):
-    if not validate_session(session_token):
+    session = get_session(session_token)
+    if not session:
         raise HTTPException(status_code=403, detail="Invalid session")
     try:
-        result = trip_manager.add_trip(trip, session_token)
+        result = await trip_manager.add_trip_async(trip, session_token, user_id=session.get("user_id"), start_time=datetime.now())
         logger.info(f"Trip '{trip}' added by session {session_token}")
         return result
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Invalid trip data: {str(e)}")
     except Exception as e:
         logger.error(f"Error adding trip: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-# Other endpoints remain largely unchanged; add logging where appropriate
-# Example for /trips/:
 @app.get("/trips/")
-async def get_trips(session_token: str):
+async def get_trips(session_token: str, limit: Optional[int] = None, cursor: Optional[str] = None, user_id: Optional[int] = None):
+    """Streams the caller's trips newest first as {"trips": [...], "next_cursor": ...}.
+
+    With limit the response is one page and next_cursor, when set, fetches
+    the next one. Admins may pass user_id to read another rider's trips.
+    """
+    session = get_session(session_token)
+    if not session:
+        raise HTTPException(status_code=403, detail="Invalid session")
+    if user_id is None or session["role"] != "admin":
+        user_id = session.get("user_id")
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="Session is not tied to a user")
+    if limit is not None and not 1 <= limit <= TRIP_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {TRIP_PAGE_MAX}")
+    try:
+        after = decode_trip_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Opens the query before the 200 goes out, so connection errors are still a 500.
+    body = await trips_json(trip_manager.get_trips_async(session_token, user_id, after, limit), limit)
+    logger.info(f"Streaming trips for user {user_id}")
+    return StreamingResponse(body, media_type="application/json")
+
+class TripRecord(BaseModel):
+    tap: Optional[str] = None
+    user_id: Optional[int] = None
+    station: Optional[str] = None
+    time: Optional[datetime] = None
+    start_station: Optional[str] = None
+    end_station: Optional[str] = None
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    description: Optional[str] = None
+
+class TripBatchRequest(BaseModel):
+    records: List[TripRecord]
+
+@app.post("/trips/batch")
+async def ingest_trips(request: TripBatchRequest, session_token: str):
+    """Ingests a batch of trips or gate taps; returns one result per record."""
+    session = get_session(session_token)
+    if not session:
+        raise HTTPException(status_code=403, detail="Invalid session")
+    records = [record.dict() for record in request.records]
+    if session["role"] != "admin":
+        # Riders can only record their own trips.
+        for record in records:
+            record["user_id"] = None
+    results = await trip_manager.ingest_trips_async(records, session_token, user_id=session.get("user_id"))
+    accepted = sum(1 for result in results if result["status"] == "ok")
+    logger.info(f"Ingested {accepted} of {len(results)} trip records for session {session_token}")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+TIMETABLE_MAX_AGE = int(os.getenv("TIMETABLE_MAX_AGE", "30"))
+
+def conditional_json(request, payload, max_age=TIMETABLE_MAX_AGE):
+    """JSON response with an ETag; answers 304 when the client already holds this body."""
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/schedules/")
+async def get_schedules(request: Request, line: str, station: str, session_token: str, service_date: Optional[date] = None):
+    """Scheduled departures from a station on a line, for one service date when given."""
     if not validate_session(session_token):
         raise HTTPException(status_code=403, detail="Invalid session")
     try:
-        trips = trip_manager.get_trips(session_token)
-        logger.info(f"Trips retrieved for session {session_token}")
-        return {"trips": trips}
+        schedules = await asyncio.to_thread(trip_manager.get_schedules, session_token, line, station, service_date)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error retrieving trips: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=str(e))
+    return conditional_json(request, schedules)
+
+@app.get("/timetable/")
+async def get_timetable(request: Request, line: str, station: str, session_token: str):
+    """Departures still to come today from a station on a line."""
+    if not validate_session(session_token):
+        raise HTTPException(status_code=403, detail="Invalid session")
+    times = await asyncio.to_thread(trip_manager.get_timetable, line, station, datetime.now())
+    return conditional_json(request, {"line": line, "station": station, "departures": times})
+
+@app.get("/lines/timetable/")
+async def get_line_timetable(request: Request, line: str, session_token: str, day_type: Optional[str] = None, service_date: Optional[date] = None):
+    """Whole-line timetable as trip x station offset matrices; pass day_type or service_date (default today)."""
+    if not validate_session(session_token):
+        raise HTTPException(status_code=403, detail="Invalid session")
+    if day_type is None and service_date is None:
+        service_date = date.today()
+    try:
+        timetable = await asyncio.to_thread(trip_manager.get_line_timetable, line, day_type, service_date)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return conditional_json(request, timetable)
+
+@app.get("/fares/")
+async def get_fare(start_station: str, end_station: str, session_token: str):
+    if not validate_session(session_token):
+        raise HTTPException(status_code=403, detail="Invalid session")
+    try:
+        fare = await asyncio.to_thread(trip_manager.get_fare, start_station, end_station)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if fare is None:
+        raise HTTPException(status_code=404, detail=f"No route from {start_station} to {end_station}")
+    return {"start_station": start_station, "end_station": end_station, "fare": fare}
+
+@app.get("/admin/metrics")
+async def get_metrics(session_token: str):
+    """Request latency, database use, pool saturation and simulator lag in Prometheus text format."""
+    if not validate_session(session_token, required_role="admin"):
+        raise HTTPException(status_code=403, detail="Admin session required")
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.post("/admin/network/reload")
+async def reload_network(session_token: str):
+    """Rebuilds the routing graphs from the database now instead of waiting for the reloader."""
+    if not validate_session(session_token, required_role="admin"):
+        raise HTTPException(status_code=403, detail="Admin session required")
+    await asyncio.to_thread(trip_manager.reload_network)
+    return {"nodes": trip_manager.network.num_nodes, "fingerprint": trip_manager.network.fingerprint}
+
+@app.post("/admin/settle")
+async def settle_fares(session_token: str, ended_before: Optional[datetime] = None):
+    """Charges every completed trip that has no fare yet; meant for the end-of-day run."""
+    if not validate_session(session_token, required_role="admin"):
+        raise HTTPException(status_code=403, detail="Admin session required")
+    result = await asyncio.to_thread(trip_manager.settle_fares, session_token, ended_before)
+    logger.info(f"Settled fares: {result}")
+    return result
+
+# Pairs (or destinations) routed per /routes/batch request.
+ROUTE_BATCH_MAX = int(os.getenv("ROUTE_BATCH_MAX", "1000"))
+
+class RouteBatchRequest(BaseModel):
+    pairs: Optional[List[Tuple[str, str]]] = None
+    origin: Optional[str] = None
+    destinations: Optional[List[str]] = None
+    departure_time: Optional[datetime] = None
+
+@app.post("/routes/batch")
+async def find_routes_batch(request: RouteBatchRequest, session_token: str):
+    """Routes many origin-destination pairs in one request, streamed as NDJSON."""
+    if not validate_session(session_token):
+        raise HTTPException(status_code=403, detail="Invalid session")
+    if request.pairs is not None:
+        results = trip_manager.find_shortest_paths(request.pairs, request.departure_time)
+        count = len(request.pairs)
+    elif request.origin is not None and request.destinations is not None:
+        results = trip_manager.find_shortest_paths_from(request.origin, request.destinations, request.departure_time)
+        count = len(request.destinations)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either pairs or origin and destinations")
+    if count > ROUTE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {ROUTE_BATCH_MAX} routes per batch")
+    logger.info(f"Routing {count} pairs for session {session_token}")
+    return StreamingResponse((json.dumps(result) + "\n" for result in results), media_type="application/x-ndjson")
+
+def parse_filter(value, cast=str):
+    return [cast(item) for item in value.split(",") if item] if value else []
+
+@app.websocket("/ws/trains")
+async def train_positions_ws(websocket: WebSocket, session_token: str, lines: str = None, stations: str = None):
+    """Pushes train state deltas for the requested lines/stations (all trains if neither is given)."""
+    if not validate_session(session_token):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = live_hub.subscribe(parse_filter(lines, int), parse_filter(stations))
+    try:
+        async for event in subscription:
+            await websocket.send_text(encode_event(event))
+        if subscription.dropped:
+            await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscription.close()
+
+@app.get("/trains/stream")
+async def train_positions_sse(session_token: str, lines: str = None, stations: str = None):
+    """Server-sent events version of /ws/trains."""
+    if not validate_session(session_token):
+        raise HTTPException(status_code=403, detail="Invalid session")
+    subscription = live_hub.subscribe(parse_filter(lines, int), parse_filter(stations))
+
+    async def events():
+        try:
+            async for event in subscription:
+                yield f"data: {encode_event(event)}\n\n"
+        finally:
+            subscription.close()
+    return StreamingResponse(events(), media_type="text/event-stream")
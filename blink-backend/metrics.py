@@ -0,0 +1,325 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import math
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(map(labels.__getitem__, self.labelnames))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(map(labels.__getitem__, self.labelnames)), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge read at scrape time: collect() returns [(labels dict, value), ...]."""
+
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = list(self.collect())
+        except Exception as e:
+            logger.warning(f"Could not collect {self.name}: {e}")
+            samples = []
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(map(labels.__getitem__, self.labelnames))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(map(labels.__getitem__, self.labelnames)))
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, collect):
+        return self.register(Gauge(name, help, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram("blink_http_request_duration_seconds", "HTTP request latency, including streamed bodies", ("method", "route"))
+REQUESTS = REGISTRY.counter("blink_http_requests_total", "HTTP requests by response status", ("method", "route", "status"))
+REQUEST_QUERIES = REGISTRY.histogram("blink_http_request_db_queries", "Database queries issued per HTTP request", ("method", "route"), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = REGISTRY.histogram("blink_http_request_db_seconds", "Database time per HTTP request", ("method", "route"))
+POOL_WAIT_SECONDS = REGISTRY.histogram("blink_db_pool_wait_seconds", "Time spent waiting for a pooled connection", ("pool",))
+POOL_EXHAUSTED = REGISTRY.counter("blink_db_pool_exhausted_total", "Connection requests that timed out waiting for the pool", ("pool",))
+DB_QUERIES = REGISTRY.counter("blink_db_queries_total", "Database queries by calling TripManager method", ("method",))
+DB_SECONDS = REGISTRY.counter("blink_db_query_seconds_total", "Database time by calling TripManager method", ("method",))
+METHOD_SECONDS = REGISTRY.histogram("blink_trip_manager_call_duration_seconds", "TripManager method latency", ("method",))
+SIMULATOR_LAG = REGISTRY.histogram("blink_simulator_event_lag_seconds", "How late simulator events fired against the wall clock")
+
+
+_pools = {}
+
+
+def register_pool(name, usage):
+    """Adds a connection pool to the pool gauges; usage() returns (in use, max) or None."""
+    _pools[name] = usage
+
+
+def _pool_samples(pick):
+    samples = []
+    for name, usage in sorted(_pools.items()):
+        current = usage()
+        if current is not None:
+            samples.append(({"pool": name}, pick(*current)))
+    return samples
+
+
+REGISTRY.gauge("blink_db_pool_connections_in_use", "Pooled connections currently borrowed",
+               lambda: _pool_samples(lambda in_use, maximum: in_use))
+REGISTRY.gauge("blink_db_pool_max_connections", "Pool size limit",
+               lambda: _pool_samples(lambda in_use, maximum: maximum))
+REGISTRY.gauge("blink_db_pool_saturation", "Share of the pool limit in use",
+               lambda: _pool_samples(lambda in_use, maximum: in_use / maximum if maximum else 0))
+
+
+class QueryTally:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_request_tally = contextvars.ContextVar("request_tally", default=None)
+_current_method = contextvars.ContextVar("current_method", default="other")
+
+
+def record_query(seconds):
+    """Counts one database query against the current request and TripManager method."""
+    method = _current_method.get()
+    DB_QUERIES.inc(method=method)
+    DB_SECONDS.inc(seconds, method=method)
+    tally = _request_tally.get()
+    if tally is not None:
+        tally.queries += 1
+        tally.seconds += seconds
+
+
+def record_asyncpg_query(record):
+    """asyncpg query logger (Connection.query_logger) feeding record_query."""
+    record_query(record.elapsed)
+
+
+def _track_generator(fn, name):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        generator = fn(*args, **kwargs)
+        elapsed = 0.0
+        try:
+            while True:
+                # The method is set around each step rather than for the whole
+                # iteration: consumers may resume the generator from other contexts.
+                token = _current_method.set(name)
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                    _current_method.reset(token)
+                yield item
+        finally:
+            generator.close()
+            METHOD_SECONDS.observe(elapsed, method=name)
+    return wrapper
+
+
+def _track_async_generator(fn, name):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        generator = fn(*args, **kwargs)
+        elapsed = 0.0
+        try:
+            while True:
+                token = _current_method.set(name)
+                started = time.perf_counter()
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                    _current_method.reset(token)
+                yield item
+        finally:
+            await generator.aclose()
+            METHOD_SECONDS.observe(elapsed, method=name)
+    return wrapper
+
+
+def track_method(fn):
+    """Times a TripManager method and attributes the queries it runs to it.
+
+    Works on plain functions, coroutines and (async) generators; for the
+    generators only the time spent producing items is counted.
+    """
+    name = fn.__qualname__
+    if inspect.isgeneratorfunction(fn):
+        return _track_generator(fn, name)
+    if inspect.isasyncgenfunction(fn):
+        return _track_async_generator(fn, name)
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            token = _current_method.set(name)
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                METHOD_SECONDS.observe(time.perf_counter() - started, method=name)
+                _current_method.reset(token)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_method.set(name)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            METHOD_SECONDS.observe(time.perf_counter() - started, method=name)
+            _current_method.reset(token)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and database use per route.
+
+    Routes are labelled with their path template (/trips/, not the URL) so
+    the number of series stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tally = QueryTally()
+        token = _request_tally.set(tally)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_tally.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route)
+            REQUESTS.inc(method=method, route=route, status=status)
+            REQUEST_QUERIES.observe(tally.queries, method=method, route=route)
+            REQUEST_DB_SECONDS.observe(tally.seconds, method=method, route=route)
@@ -0,0 +1,440 @@
+from collections import defaultdict
+import functools
+import heapq
+import logging
+import threading
+import numpy as np
+from contraction import ContractionHierarchy
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PEAK_HOURS = ((7, 9), (17, 19))
+# Dense all-pairs matrices cost O(n^2) memory and O(n^3) time to build (about
+# 1 s at 500 nodes, 10 s at 1200); past this many (station, line) nodes
+# routing queries a contraction hierarchy, which builds far faster.
+ALL_PAIRS_MAX_NODES = 500
+# The arrays that fully describe the node graph; everything else is derived from them.
+ARRAY_FIELDS = ("node_station", "node_line", "indptr", "indices", "weight_peak", "weight_offpeak", "edge_is_transfer")
+
+
+# Service period name -> whether it uses peak transfer weights. Each period
+# gets its own prebuilt graph; per-template periods can be added here.
+SERVICE_PERIODS = {"peak": True, "off_peak": False}
+NETWORK_FINGERPRINT_SQL = """
+    SELECT md5(concat_ws('|',
+        (SELECT string_agg(concat_ws(',', station_id, station_name), ';' ORDER BY station_id) FROM stations),
+        (SELECT string_agg(concat_ws(',', line_id, line_name), ';' ORDER BY line_id) FROM lines),
+        (SELECT string_agg(concat_ws(',', route_id, line_id, from_station_id, to_station_id, travel_time), ';' ORDER BY route_id) FROM routes),
+        (SELECT string_agg(concat_ws(',', station_id, line_id), ';' ORDER BY station_id, line_id) FROM transfer_stations),
+        (SELECT string_agg(concat_ws(',', station_id, from_line_id, to_line_id, transfer_time_peak, transfer_time_offpeak), ';'
+                           ORDER BY station_id, from_line_id, to_line_id) FROM transfer_times)
+    ))
+"""
+
+
+def is_peak_time(current_time):
+    """Returns True when current_time falls inside a peak transfer window."""
+    return any(start <= current_time.hour < end for start, end in PEAK_HOURS)
+
+
+def service_period(current_time):
+    return "peak" if is_peak_time(current_time) else "off_peak"
+
+
+def network_fingerprint(cursor):
+    """Hash of every table the network snapshot is built from; changes whenever any of them does."""
+    cursor.execute(NETWORK_FINGERPRINT_SQL)
+    return cursor.fetchone()[0]
+
+
+class NetworkSnapshot:
+    """Integer-indexed, read-only view of the transit network.
+
+    Nodes are (station, line) pairs. Edges are stored CSR-style: the edges
+    leaving node n are indices[indptr[n]:indptr[n + 1]], with the matching
+    weights in weight_peak / weight_offpeak (ride edges carry the same
+    travel time in both arrays, transfer edges differ).
+    """
+
+    def __init__(self, stations, lines, routes, transfer_stations, transfer_times):
+        self._index_names(stations, lines)
+
+        # Lines serving each station: every line with a route touching it,
+        # plus the lines registered for it in transfer_stations.
+        station_lines = defaultdict(set)
+        for _, line_id, from_station, to_station, _ in routes:
+            station_lines[self.station_index[from_station]].add(self.line_index[line_id])
+            station_lines[self.station_index[to_station]].add(self.line_index[line_id])
+        transfer_lines = defaultdict(set)
+        for station_id, line_id in transfer_stations:
+            transfer_lines[self.station_index[station_id]].add(self.line_index[line_id])
+        for station, lines_at_station in transfer_lines.items():
+            if len(lines_at_station) > 1:
+                station_lines[station] |= lines_at_station
+
+        node_station, node_line = [], []
+        for station in sorted(station_lines):
+            for line in sorted(station_lines[station]):
+                node_station.append(station)
+                node_line.append(line)
+        self.node_station = np.array(node_station, dtype=np.int32)
+        self.node_line = np.array(node_line, dtype=np.int32)
+        self._index_nodes()
+
+        edges = defaultdict(list)
+        for _, line_id, from_station, to_station, travel_time in routes:
+            line = self.line_index[line_id]
+            src = self.node_index[(self.station_index[from_station], line)]
+            dst = self.node_index[(self.station_index[to_station], line)]
+            edges[src].append((dst, travel_time, travel_time, False))
+        for station_id, from_line_id, to_line_id, peak, offpeak in transfer_times:
+            station = self.station_index.get(station_id)
+            src = self.node_index.get((station, self.line_index.get(from_line_id)))
+            dst = self.node_index.get((station, self.line_index.get(to_line_id)))
+            if src is None or dst is None:
+                continue
+            edges[src].append((dst, peak, offpeak, True))
+
+        num_nodes = len(node_station)
+        indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+        indices, weight_peak, weight_offpeak, is_transfer = [], [], [], []
+        for n in range(num_nodes):
+            for dst, peak, offpeak, transfer in edges.get(n, ()):
+                indices.append(dst)
+                weight_peak.append(peak)
+                weight_offpeak.append(offpeak)
+                is_transfer.append(transfer)
+            indptr[n + 1] = len(indices)
+        self.indptr = indptr
+        self.indices = np.array(indices, dtype=np.int32)
+        self.weight_peak = np.array(weight_peak, dtype=np.int32)
+        self.weight_offpeak = np.array(weight_offpeak, dtype=np.int32)
+        self.edge_is_transfer = np.array(is_transfer, dtype=bool)
+
+        self._routes = routes
+        self._transfer_stations = transfer_stations
+        self._route_matrices = {}
+        self._contractions = {}
+        self._build_lock = threading.Lock()
+        self.fingerprint = None
+
+    @classmethod
+    def from_arrays(cls, stations, lines, routes, transfer_stations, arrays, fingerprint=None, contractions=None,
+                    route_matrices=None):
+        """Rebuilds a snapshot around already computed node and CSR arrays (see snapshot_file).
+
+        contractions and route_matrices map is_peak to the arrays of a stored
+        ContractionHierarchy or RouteMatrix.
+        """
+        snapshot = cls.__new__(cls)
+        snapshot._index_names(stations, lines)
+        for name in ARRAY_FIELDS:
+            setattr(snapshot, name, arrays[name])
+        snapshot._index_nodes()
+        snapshot._routes = routes
+        snapshot._transfer_stations = transfer_stations
+        snapshot._route_matrices = {is_peak: RouteMatrix.from_arrays(m_arrays) for is_peak, m_arrays in (route_matrices or {}).items()}
+        snapshot._contractions = {is_peak: ContractionHierarchy(ch_arrays) for is_peak, ch_arrays in (contractions or {}).items()}
+        snapshot._build_lock = threading.Lock()
+        snapshot.fingerprint = fingerprint
+        return snapshot
+
+    def _index_names(self, stations, lines):
+        self.station_ids = [row[0] for row in stations]
+        self.station_names = [row[1] for row in stations]
+        self.station_index = {sid: i for i, sid in enumerate(self.station_ids)}
+        self.line_ids = [row[0] for row in lines]
+        self.line_names = [row[1] for row in lines]
+        self.line_index = {lid: i for i, lid in enumerate(self.line_ids)}
+
+    def _index_nodes(self):
+        node_station = self.node_station.tolist()
+        self.node_index = {(s, l): n for n, (s, l) in enumerate(zip(node_station, self.node_line.tolist()))}
+        self.station_nodes = defaultdict(list)
+        for n, s in enumerate(node_station):
+            self.station_nodes[s].append(n)
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        """Loads the network with one set-based query per table."""
+        cursor.execute("SELECT station_id, station_name FROM stations ORDER BY station_id")
+        stations = cursor.fetchall()
+        cursor.execute("SELECT line_id, line_name FROM lines ORDER BY line_id")
+        lines = cursor.fetchall()
+        cursor.execute("""
+            SELECT route_id, line_id, from_station_id, to_station_id, travel_time
+            FROM routes
+            ORDER BY line_id, route_id
+        """)
+        routes = cursor.fetchall()
+        cursor.execute("SELECT station_id, line_id FROM transfer_stations")
+        transfer_stations = cursor.fetchall()
+        cursor.execute("""
+            SELECT station_id, from_line_id, to_line_id, transfer_time_peak, transfer_time_offpeak
+            FROM transfer_times
+        """)
+        transfer_times = cursor.fetchall()
+        snapshot = cls(stations, lines, routes, transfer_stations, transfer_times)
+        snapshot.fingerprint = network_fingerprint(cursor)
+        logger.info(f"Loaded network snapshot: {len(stations)} stations, {snapshot.num_nodes} nodes, {snapshot.num_edges} edges")
+        return snapshot
+
+    @property
+    def num_nodes(self):
+        return len(self.node_station)
+
+    @property
+    def uses_contraction(self):
+        """True when the network is too big for route matrices and routes through contraction hierarchies."""
+        return self.num_nodes > ALL_PAIRS_MAX_NODES
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def weights(self, is_peak):
+        return self.weight_peak if is_peak else self.weight_offpeak
+
+    def route_matrix(self, is_peak):
+        """Returns the all-pairs RouteMatrix for a period, building it on first use."""
+        if self.uses_contraction:
+            return None
+        if is_peak not in self._route_matrices:
+            # One build even when several first requests race for it.
+            with self._build_lock:
+                if is_peak not in self._route_matrices:
+                    self._route_matrices[is_peak] = RouteMatrix.build(self, is_peak)
+        return self._route_matrices[is_peak]
+
+    def contraction(self, is_peak):
+        """Returns the ContractionHierarchy for a period, building it on first use."""
+        if is_peak not in self._contractions:
+            with self._build_lock:
+                if is_peak not in self._contractions:
+                    self._contractions[is_peak] = ContractionHierarchy.build(
+                        self.indptr.tolist(), self.indices.tolist(), self.weights(is_peak).tolist())
+        return self._contractions[is_peak]
+
+    def origin_tree(self, sources, is_peak):
+        """Returns the shortest-route tree from a set of source nodes to every node."""
+        if not sources:
+            return OriginTree(np.full(self.num_nodes, np.inf), None)
+        matrix = self.route_matrix(is_peak)
+        if matrix is not None:
+            rows = matrix.dist[sources]
+            best = np.argmin(rows, axis=0)
+            distances = rows[best, np.arange(self.num_nodes)]
+            return OriginTree(distances, lambda node: matrix.path(sources[best[node]], node))
+        distances, parent, _ = dijkstra(self.indptr.tolist(), self.indices.tolist(), self.weights(is_peak).tolist(), sources)
+        dense = np.full(self.num_nodes, np.inf)
+        for node, dist in distances.items():
+            dense[node] = dist
+
+        def walk(node):
+            path = []
+            while node is not None:
+                path.append(node)
+                node = parent[node]
+            path.reverse()
+            return path
+        return OriginTree(dense, walk)
+
+    def node_key(self, node):
+        """Returns the (station_id, line_name) pair for a node index."""
+        return self.station_ids[self.node_station[node]], self.line_names[self.node_line[node]]
+
+    def nodes_for_station(self, station_id):
+        return self.station_nodes.get(self.station_index.get(station_id), [])
+
+    def routes_by_origin(self):
+        """Returns {(line_id, from_station_id): [(route_id, to_station_id, travel_time)]}."""
+        routes = defaultdict(list)
+        for route_id, line_id, from_station, to_station, travel_time in self._routes:
+            routes[(line_id, from_station)].append((route_id, to_station, travel_time))
+        return dict(routes)
+
+    def station_graph(self):
+        """Builds the legacy station -> [(neighbor, line_name)] adjacency."""
+        graph = defaultdict(list)
+        for _, line_id, from_station, to_station, _ in self._routes:
+            line_name = self.line_names[self.line_index[line_id]]
+            graph[from_station].append((to_station, line_name))
+            graph[to_station].append((from_station, line_name))
+        transfer_lines = defaultdict(list)
+        for station_id, line_id in self._transfer_stations:
+            transfer_lines[station_id].append(self.line_names[self.line_index[line_id]])
+        for station, lines_at_station in transfer_lines.items():
+            for line1 in lines_at_station:
+                for line2 in lines_at_station:
+                    if line1 != line2:
+                        graph[station].append((station, line2))
+        return graph
+
+    def weighted_graph(self, is_peak):
+        """Builds the legacy (station, line) -> [((station, line), weight)] dict."""
+        weights = self.weights(is_peak).tolist()
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        keys = [self.node_key(n) for n in range(self.num_nodes)]
+        return {
+            keys[n]: [(keys[indices[e]], weights[e]) for e in range(indptr[n], indptr[n + 1])]
+            for n in range(self.num_nodes)
+        }
+
+
+class PeriodGraph:
+    """Routing structures prebuilt for one service period of a snapshot."""
+
+    def __init__(self, network, period):
+        self.network = network
+        self.period = period
+        self.is_peak = SERVICE_PERIODS[period]
+
+    @functools.cached_property
+    def weighted_graph(self):
+        """Legacy dict-of-dicts view of the period's graph; nothing routes over it."""
+        return self.network.weighted_graph(self.is_peak)
+
+    def route_matrix(self):
+        return self.network.route_matrix(self.is_peak)
+
+    def contraction(self):
+        """The period's ContractionHierarchy when the network is too big for a route matrix."""
+        if not self.network.uses_contraction:
+            return None
+        return self.network.contraction(self.is_peak)
+
+
+class RoutingState:
+    """Everything a routing query reads, derived from one NetworkSnapshot.
+
+    The state is never modified after construction; reloading builds a new
+    one and swaps the reference, so a query that took a state keeps a
+    consistent view while the next is installed. warm=True also builds
+    every period's route matrix (or contraction hierarchy) up front.
+    """
+
+    def __init__(self, network, warm=False):
+        self.network = network
+        self.station_map = dict(zip(network.station_names, network.station_ids))
+        self.station_map_inv = dict(zip(network.station_ids, network.station_names))
+        self.valid_lines = dict(zip(network.line_ids, network.line_names))
+        self.line_map = dict(zip(network.line_names, network.line_ids))
+        self.station_graph = network.station_graph()
+        self.lines_per_station = defaultdict(set)
+        for n in range(network.num_nodes):
+            station_id, line_name = network.node_key(n)
+            self.lines_per_station[station_id].add(line_name)
+        self.graphs = {period: PeriodGraph(network, period) for period in SERVICE_PERIODS}
+        if warm:
+            for graph in self.graphs.values():
+                graph.route_matrix()
+                graph.contraction()
+
+    def graph_for(self, current_time):
+        return self.graphs[service_period(current_time)]
+
+    def station_path(self, nodes):
+        network = self.network
+        return [self.station_map_inv[network.station_ids[network.node_station[n]]] for n in nodes]
+
+
+class RouteMatrix:
+    """All-pairs travel times and next hops over the (station, line) nodes.
+
+    dist[i, j] is the shortest travel time from node i to node j (inf when
+    unreachable) and next_hop[i, j] is the node to move to from i on that
+    path, so a route is recovered with one lookup per hop.
+    """
+
+    def __init__(self, dist, next_hop):
+        self.dist = dist
+        self.next_hop = next_hop
+
+    @classmethod
+    def build(cls, network, is_peak):
+        """Vectorized Floyd-Warshall over the snapshot's CSR edges."""
+        n = network.num_nodes
+        dist = np.full((n, n), np.inf, dtype=np.float32)
+        src = np.repeat(np.arange(n, dtype=np.int32), np.diff(network.indptr))
+        np.minimum.at(dist, (src, network.indices), network.weights(is_peak).astype(np.float32))
+        np.fill_diagonal(dist, 0)
+        next_hop = np.tile(np.arange(n, dtype=np.int32), (n, 1))
+        next_hop[np.isinf(dist)] = -1
+        for k in range(n):
+            candidate = dist[:, k, None] + dist[None, k, :]
+            improved = candidate < dist
+            if improved.any():
+                dist = np.where(improved, candidate, dist)
+                next_hop = np.where(improved, next_hop[:, k, None], next_hop)
+        logger.info(f"Built {'peak' if is_peak else 'off-peak'} route matrix over {n} nodes")
+        return cls(dist, next_hop)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["dist"], arrays["next_hop"])
+
+    def to_arrays(self):
+        return {"dist": self.dist, "next_hop": self.next_hop}
+
+    def best_pair(self, sources, targets):
+        """Returns the (source, target, travel_time) with the smallest travel time, or None."""
+        if not sources or not targets:
+            return None
+        block = self.dist[np.ix_(sources, targets)]
+        i, j = np.unravel_index(np.argmin(block), block.shape)
+        if np.isinf(block[i, j]):
+            return None
+        return sources[i], targets[j], int(block[i, j])
+
+    def path(self, source, target):
+        nodes = [source]
+        while source != target:
+            source = int(self.next_hop[source, target])
+            nodes.append(source)
+        return nodes
+
+
+class OriginTree:
+    """Shortest routes from one origin to every node, shared by many destinations."""
+
+    def __init__(self, distances, path_to):
+        self.distances = distances
+        self._path_to = path_to
+
+    def route_to(self, targets):
+        """Returns (node path, travel time) to the closest of targets, or None."""
+        if not targets:
+            return None
+        target = min(targets, key=lambda node: self.distances[node])
+        if np.isinf(self.distances[target]):
+            return None
+        return self._path_to(target), int(self.distances[target])
+
+
+def dijkstra(indptr, indices, weights, sources, targets=None):
+    """Runs Dijkstra over CSR arrays given as Python lists.
+
+    Returns (distances, parent) dicts keyed by node index. When targets is
+    given the search stops at the first settled target and returns it as
+    well; otherwise the full one-to-all tree is returned with target None.
+    """
+    distances = {node: 0 for node in sources}
+    parent = {node: None for node in sources}
+    pq = [(0, node) for node in sources]
+    heapq.heapify(pq)
+    while pq:
+        dist, current = heapq.heappop(pq)
+        if dist > distances[current]:
+            continue
+        if targets is not None and current in targets:
+            return distances, parent, current
+        for e in range(indptr[current], indptr[current + 1]):
+            neighbor = indices[e]
+            new_dist = dist + weights[e]
+            if new_dist < distances.get(neighbor, float('inf')):
+                distances[neighbor] = new_dist
+                parent[neighbor] = current
+                heapq.heappush(pq, (new_dist, neighbor))
+    return distances, parent, None
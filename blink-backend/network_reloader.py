@@ -0,0 +1,133 @@
+import select
+import socket
+import threading
+import psycopg2
+from db import connection_params, get_db_connection, release_db_connection
+from network import network_fingerprint
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+NETWORK_CHANNEL = "network_changed"
+SCHEDULES_CHANNEL = "schedules_changed"
+
+
+class NetworkReloader:
+    """Keeps a TripManager's routing state in step with the network tables.
+
+    Every interval seconds the fingerprint of the network tables is compared
+    with the one the loaded snapshot was built from, and a change triggers
+    TripManager.reload_network on this thread. With listen=True the thread
+    also LISTENs on NETWORK_CHANNEL (see the triggers in blink.sql) so a
+    change is picked up right away instead of at the next poll. A
+    SCHEDULES_CHANNEL notification refreshes the timetables and drops the
+    schedule cache, since schedules can be regenerated by another process.
+    """
+
+    def __init__(self, trip_manager, interval=60.0, listen=True):
+        self.trip_manager = trip_manager
+        self.interval = interval
+        self.listen = listen
+        self.reloads = 0
+        self.failures = 0
+        self._listener = None
+        self._stop = threading.Event()
+        # stop() writes to this pair to wake a select() waiting on the listener.
+        self._wakeup = socket.socketpair()
+        self._thread = None
+
+    def check(self):
+        """Reloads the network if its tables changed; returns True when it did."""
+        try:
+            conn = get_db_connection(internal=True)
+            cursor = conn.cursor()
+            try:
+                fingerprint = network_fingerprint(cursor)
+            finally:
+                cursor.close()
+                release_db_connection(conn)
+            if fingerprint == self.trip_manager.network.fingerprint:
+                return False
+            logger.info("Network tables changed, reloading routing state")
+            self.trip_manager.reload_network()
+            self.reloads += 1
+            return True
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Network reload check failed, keeping the current network: {e}")
+            return False
+
+    def schedules_changed(self):
+        try:
+            self.trip_manager.refresh_service_timetables()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Could not refresh timetables after a schedule change: {e}")
+        self.trip_manager.invalidate_schedule_cache()
+
+    def _connect_listener(self):
+        try:
+            conn = psycopg2.connect(**connection_params())
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NETWORK_CHANNEL}")
+                cursor.execute(f"LISTEN {SCHEDULES_CHANNEL}")
+            return conn
+        except psycopg2.Error as e:
+            logger.warning(f"Could not LISTEN for network changes, polling only: {e}")
+            return None
+
+    def _wait(self):
+        """Waits up to interval for a notification; returns early on one."""
+        if self._listener is None and self.listen:
+            self._listener = self._connect_listener()
+        if self._listener is None:
+            self._stop.wait(self.interval)
+            return
+        try:
+            readable, _, _ = select.select([self._listener, self._wakeup[0]], [], [], self.interval)
+            if self._wakeup[0] in readable:
+                self._wakeup[0].recv(64)
+                return
+            if readable:
+                self._listener.poll()
+                channels = {notify.channel for notify in self._listener.notifies}
+                self._listener.notifies.clear()
+                if SCHEDULES_CHANNEL in channels:
+                    self.schedules_changed()
+        except (psycopg2.Error, OSError, ValueError) as e:
+            logger.warning(f"Lost the network change listener: {e}")
+            self._close_listener()
+            self._stop.wait(self.interval)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wait()
+            if not self._stop.is_set():
+                self.check()
+
+    def _close_listener(self):
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except psycopg2.Error:
+                pass
+            self._listener = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="network-reloader", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self._wakeup[1].send(b"\0")
+        except OSError:
+            pass
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+        self._close_listener()
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from dotenv import load_dotenv
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+
+def hash_rounds(stored_hash):
+    """Returns the bcrypt cost factor encoded in a hash like $2b$12$..., or None."""
+    parts = stored_hash.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop with a bounded number of concurrent hashes.
+
+    At most max_concurrency hashes run at once on a dedicated thread pool
+    (bcrypt releases the GIL); up to max_queue more callers may wait for a
+    slot, beyond that calls are rejected with 503 instead of piling up.
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=None, target_rounds=None, executor=None):
+        self.max_concurrency = max_concurrency or int(os.getenv("BCRYPT_MAX_CONCURRENCY", os.cpu_count() or 2))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("BCRYPT_MAX_QUEUE", "100"))
+        self.target_rounds = target_rounds or int(os.getenv("BCRYPT_TARGET_ROUNDS", "12"))
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self.waiting >= self.max_queue and self._slots.locked():
+            self.rejected += 1
+            logger.warning(f"Password hashing queue full ({self.waiting} waiting), rejecting request")
+            raise HTTPException(status_code=503, detail="Too many concurrent logins, try again shortly")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, password):
+        hashed = await self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.target_rounds))
+        return hashed.decode('utf-8')
+
+    async def verify(self, password, stored_hash):
+        return await self._run(bcrypt.checkpw, password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+    async def verify_and_upgrade(self, password, stored_hash):
+        """Verifies a password; returns (valid, new_hash).
+
+        new_hash is set when the password is valid but the stored hash uses a
+        cost factor above target_rounds, so the caller can store the cheaper
+        hash and make future logins faster.
+        """
+        if not await self.verify(password, stored_hash):
+            return False, None
+        rounds = hash_rounds(stored_hash)
+        if rounds is None or rounds <= self.target_rounds:
+            return True, None
+        self.rehashed += 1
+        logger.info(f"Rehashing password from cost {rounds} to {self.target_rounds}")
+        return True, await self.hash(password)
+
+    def metrics(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,188 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+from contextlib import contextmanager
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile-queries"
+REPEATED_QUERY_THRESHOLD = 10
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+_REPEATED_TUPLES = re.compile(r"(\((?:\?, )*\?\))(?:, \1)+")
+_VALUE_LIST = re.compile(r"\((?:\?, )+\?\)")
+# Frames from these files are plumbing; the call site is the first frame outside them.
+_PLUMBING = {os.path.abspath(__file__), os.path.abspath(os.path.join(os.path.dirname(__file__), "db.py"))}
+
+
+def normalize_sql(sql):
+    """Collapses a statement to its shape: literals and placeholders become ?, VALUES and IN lists one entry."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = sql.replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+    sql = re.sub(r",(?=\S)", ", ", sql)
+    sql = _REPEATED_TUPLES.sub(r"\1, ...", sql)
+    return _VALUE_LIST.sub("(?, ...)", sql)
+
+
+def call_site():
+    """file:line (function) of the code that issued the query being recorded."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename not in _PLUMBING and "psycopg2" not in filename:
+            return f"{os.path.basename(filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "rows")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class QueryProfile:
+    """Query count, time and rows per (call site, normalized SQL) while active."""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, site, statement, seconds, rows):
+        with self._lock:
+            stats = self.stats.get((site, statement))
+            if stats is None:
+                stats = self.stats[(site, statement)] = QueryStats()
+            stats.count += 1
+            stats.seconds += seconds
+            stats.rows += rows
+
+    @property
+    def queries(self):
+        return sum(stats.count for stats in self.stats.values())
+
+    @property
+    def seconds(self):
+        return sum(stats.seconds for stats in self.stats.values())
+
+    def _grouped(self, index):
+        grouped = {}
+        for key, stats in self.stats.items():
+            total = grouped.setdefault(key[index], QueryStats())
+            total.count += stats.count
+            total.seconds += stats.seconds
+            total.rows += stats.rows
+        return grouped
+
+    def by_call_site(self):
+        return self._grouped(0)
+
+    def by_statement(self):
+        return self._grouped(1)
+
+    def repeated(self, threshold=REPEATED_QUERY_THRESHOLD):
+        """(call site, statement, stats) run at least threshold times: likely queries in a loop."""
+        return sorted(
+            ((site, statement, stats) for (site, statement), stats in self.stats.items() if stats.count >= threshold),
+            key=lambda entry: -entry[2].count,
+        )
+
+    def report(self, limit=10, threshold=REPEATED_QUERY_THRESHOLD):
+        lines = [f"{self.label or 'profile'}: {self.queries} queries, {self.seconds * 1000:.1f} ms"]
+        top = sorted(self.stats.items(), key=lambda item: -item[1].seconds)[:limit]
+        for (site, statement), stats in top:
+            lines.append(f"  {stats.count:>6}x {stats.seconds * 1000:>9.1f} ms {stats.rows:>8} rows  {site}  {statement[:120]}")
+        for site, statement, stats in self.repeated(threshold):
+            lines.append(f"  repeated {stats.count}x at {site}: {statement[:120]}")
+        return "\n".join(lines)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+_active = contextvars.ContextVar("query_profiles", default=())
+_all_threads = []
+
+
+def is_profiling():
+    return bool(_active.get() or _all_threads)
+
+
+def record_query(sql, seconds, rows):
+    """Adds a finished query to every active profile; called by db.TimedCursor."""
+    profiles = _active.get()
+    if _all_threads:
+        profiles += tuple(profile for profile in _all_threads if profile not in profiles)
+    if not profiles:
+        return
+    site = call_site()
+    statement = normalize_sql(sql)
+    for profile in profiles:
+        profile.record(site, statement, seconds, max(rows, 0))
+
+
+@contextmanager
+def profile_queries(label=None, all_threads=False):
+    """Profiles the queries run inside the block.
+
+    By default only the current context is profiled (this request, this
+    test, and threads started with a copy of the context); all_threads=True
+    also catches worker threads such as the simulator's state writer.
+    """
+    profile = QueryProfile(label)
+    if all_threads:
+        _all_threads.append(profile)
+    token = _active.set(_active.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active.reset(token)
+        if all_threads:
+            _all_threads.remove(profile)
+
+
+@contextmanager
+def assert_max_queries(limit, label=None):
+    """Fails with QueryBudgetExceeded when the block runs more than limit queries."""
+    with profile_queries(label) as profile:
+        yield profile
+    if profile.queries > limit:
+        raise QueryBudgetExceeded(f"{label or 'block'} ran {profile.queries} queries, budget is {limit}\n{profile.report()}")
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests sent with an X-Profile-Queries header.
+
+    The report is logged when the response finishes. Only installed when
+    QUERY_PROFILING=1, so production requests cannot switch it on.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(name == PROFILE_HEADER.encode() for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        with profile_queries(f"{scope['method']} {scope['path']}") as profile:
+            await self.app(scope, receive, send)
+        logger.info(profile.report())
@@ -0,0 +1,290 @@
+import hashlib
+import io
+import logging
+from collections import defaultdict
+from datetime import time
+import numpy as np
+from psycopg2.extras import execute_values
+from timetable import DEFAULT_TRAVEL_TIME, adjusted_day_type, seconds_since_midnight
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def load_calendar(cursor, start_date, end_date):
+    """Returns {date: (template_id, template_name)} for dates in [start_date, end_date)."""
+    cursor.execute("""
+        SELECT ac.date_id, st.template_id, st.template_name
+        FROM annual_calendar ac
+        JOIN schedule_templates st ON ac.template_id = st.template_id
+        WHERE ac.date_id >= %s AND ac.date_id < %s
+    """, (start_date, end_date))
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def load_patterns(cursor):
+    """Returns {pattern_id: (line_id, stops)} where stops is [(station_id, next_station_id, dwell, travel)]."""
+    cursor.execute("""
+        WITH ordered AS (
+            SELECT sp.pattern_id, sp.line_id, spd.station_sequence, spd.station_id, spd.dwell_time,
+                   LEAD(spd.station_id) OVER (PARTITION BY spd.pattern_id ORDER BY spd.station_sequence) AS next_station_id
+            FROM service_patterns sp
+            JOIN service_pattern_details spd ON spd.pattern_id = sp.pattern_id
+        )
+        SELECT o.pattern_id, o.line_id, o.station_id, o.next_station_id, o.dwell_time, r.travel_time
+        FROM ordered o
+        LEFT JOIN routes r ON r.line_id = o.line_id
+            AND r.from_station_id = o.station_id
+            AND r.to_station_id = o.next_station_id
+        ORDER BY o.pattern_id, o.station_sequence
+    """)
+    patterns = {}
+    for pattern_id, line_id, station_id, next_station_id, dwell_time, travel_time in cursor.fetchall():
+        patterns.setdefault(pattern_id, (line_id, []))[1].append((station_id, next_station_id, dwell_time, travel_time))
+    return patterns
+
+
+def load_frequency_rules(cursor, template_ids):
+    """Returns {(template_id, line_id, pattern_id): [(start, end, headway)]} ordered by start time."""
+    cursor.execute("""
+        SELECT template_id, line_id, pattern_id, start_time, end_time, headway_minutes
+        FROM frequency_rules
+        WHERE template_id = ANY(%s)
+        ORDER BY start_time
+    """, (list(template_ids),))
+    rules = defaultdict(list)
+    for template_id, line_id, pattern_id, start_time, end_time, headway in cursor.fetchall():
+        rules[(template_id, line_id, pattern_id)].append((start_time, end_time, headway))
+    return rules
+
+
+def departure_seconds(rules):
+    """First-stop departure times, in seconds since midnight, for a list of frequency rules."""
+    parts = [
+        np.arange(seconds_since_midnight(start), seconds_since_midnight(end), headway * 60, dtype=np.int32)
+        for start, end, headway in rules
+        if headway
+    ]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+
+def stop_offsets(stops):
+    """Seconds from the first-stop departure to the departure at each stop of a pattern."""
+    dwell = np.array([stop[2] or 0 for stop in stops], dtype=np.int32)
+    travel = np.array([DEFAULT_TRAVEL_TIME if stop[3] is None else stop[3] for stop in stops], dtype=np.int32) * 60
+    offsets = np.zeros(len(stops), dtype=np.int32)
+    np.cumsum((dwell + travel)[:-1], out=offsets[1:])
+    return offsets
+
+
+def pattern_departures(stops, rules):
+    """Departure matrix (trip x stop) in seconds since midnight, wrapped to one day."""
+    return (departure_seconds(rules)[:, None] + stop_offsets(stops)[None, :]) % 86400
+
+
+def format_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def write_copy_rows(buffer, line_id, day_type, stops, departures):
+    """Writes one COPY text row per (trip, stop) of a departure matrix."""
+    rows = 0
+    for column, (station_id, next_station_id, _, _) in enumerate(stops):
+        prefix = f"{line_id}\t{station_id}\t"
+        suffix = f"\t{day_type}\t{next_station_id if next_station_id else chr(92) + 'N'}\n"
+        for seconds in departures[:, column].tolist():
+            buffer.write(prefix + format_time(seconds) + suffix)
+            rows += 1
+    return rows
+
+
+def copy_into_schedules(cursor, buffer):
+    """Bulk-loads COPY text rows through a staging table and merges them into schedules."""
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS schedules_staging (
+            line_id INTEGER,
+            station_id VARCHAR(10),
+            departure_time TIME,
+            day_type VARCHAR(64),
+            next_station_id VARCHAR(10)
+        ) ON COMMIT DROP
+    """)
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY schedules_staging (line_id, station_id, departure_time, day_type, next_station_id) FROM STDIN",
+        buffer,
+    )
+    cursor.execute("""
+        INSERT INTO schedules (line_id, station_id, departure_time, day_type, next_station_id)
+        SELECT line_id, station_id, departure_time, day_type, next_station_id
+        FROM schedules_staging
+        ON CONFLICT (line_id, station_id, departure_time, day_type) DO NOTHING
+    """)
+    inserted = cursor.rowcount
+    cursor.execute("TRUNCATE schedules_staging")
+    return inserted
+
+
+def load_adjustments(cursor, start_date, end_date):
+    """Returns {(date, line_id, pattern_id): [(start, end, headway)]} for dates in [start_date, end_date)."""
+    cursor.execute("""
+        SELECT date_id, line_id, pattern_id, start_time, end_time, headway_minutes
+        FROM schedule_adjustments
+        WHERE date_id >= %s AND date_id < %s
+        ORDER BY start_time
+    """, (start_date, end_date))
+    adjustments = defaultdict(list)
+    for date_id, line_id, pattern_id, start_time, end_time, headway in cursor.fetchall():
+        adjustments[(date_id, line_id, pattern_id)].append((start_time, end_time, headway))
+    return adjustments
+
+
+def to_time(seconds):
+    return time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def apply_adjustments(rules, adjustments):
+    """Overrides frequency rules with adjustment windows.
+
+    Each adjustment replaces whatever the base rules said between its start
+    and end time; base rules keep the parts outside every adjustment window.
+    """
+    if not adjustments:
+        return list(rules)
+    windows = sorted((seconds_since_midnight(start), seconds_since_midnight(end)) for start, end, _ in adjustments)
+    effective = []
+    for start, end, headway in rules:
+        pieces = [(seconds_since_midnight(start), seconds_since_midnight(end))]
+        for window_start, window_end in windows:
+            pieces = [
+                piece
+                for piece_start, piece_end in pieces
+                for piece in ((piece_start, min(piece_end, window_start)), (max(piece_start, window_end), piece_end))
+                if piece[0] < piece[1]
+            ]
+        effective.extend((to_time(piece_start), to_time(piece_end), headway) for piece_start, piece_end in pieces)
+    effective.extend(adjustments)
+    return sorted(effective, key=lambda rule: rule[0])
+
+
+def plan_slices(calendar, patterns, rules, adjustments):
+    """Maps every (day_type, line_id, pattern_id) slice needed in the window to its effective rules.
+
+    Dates without adjustments share their template's day type. A line with
+    adjustments on a date gets its own dated day type for that date, holding
+    all of the line's patterns so it can replace the template rows wholesale.
+    """
+    adjusted_lines = {(date_id, line_id) for date_id, line_id, _ in adjustments}
+    slices = {}
+    for service_date, (template_id, template_name) in sorted(calendar.items()):
+        for pattern_id, (line_id, _) in patterns.items():
+            base_rules = rules.get((template_id, line_id, pattern_id), [])
+            if (service_date, line_id) in adjusted_lines:
+                day_type = adjusted_day_type(template_name, service_date)
+                effective = apply_adjustments(base_rules, adjustments.get((service_date, line_id, pattern_id)))
+            else:
+                day_type = template_name
+                effective = list(base_rules)
+            slices[(day_type, line_id, pattern_id)] = effective
+    return slices
+
+
+def slice_fingerprint(stops, rules):
+    return hashlib.sha1(repr((stops, rules)).encode("utf-8")).hexdigest()
+
+
+def load_slice_fingerprints(cursor):
+    cursor.execute("SELECT day_type, line_id, pattern_id, fingerprint FROM schedule_slices")
+    return {(row[0], row[1], row[2]): row[3] for row in cursor.fetchall()}
+
+
+def is_dated_in_window(day_type, start_date, end_date):
+    _, sep, suffix = day_type.rpartition("@")
+    return bool(sep) and start_date.isoformat() <= suffix < end_date.isoformat()
+
+
+def is_dated_before(day_type, before):
+    _, sep, suffix = day_type.rpartition("@")
+    return bool(sep) and suffix < before.isoformat()
+
+
+def render_slices(buffer, slices, patterns, groups=None):
+    """Writes the COPY rows of every slice whose (day_type, line_id) is in groups (all when None).
+
+    This is the database-free part of schedule generation; returns the number of rows written.
+    """
+    rows = 0
+    for (day_type, line_id, pattern_id), slice_rules in slices.items():
+        if groups is not None and (day_type, line_id) not in groups:
+            continue
+        if not slice_rules:
+            logger.warning(f"No frequency rules for {day_type}, line {line_id}, pattern {pattern_id}")
+            continue
+        stops = patterns[pattern_id][1]
+        rows += write_copy_rows(buffer, line_id, day_type, stops, pattern_departures(stops, slice_rules))
+    return rows
+
+
+def generate_schedules(cursor, start_date, end_date, incremental=False):
+    """Generates schedules for every slice used in [start_date, end_date).
+
+    schedules rows are keyed by day type rather than date, so each template
+    in the window is materialized once no matter how many days use it;
+    schedule_adjustments give their line a dated day type instead. With
+    incremental=True only (day_type, line) groups whose pattern stops,
+    frequency rules or adjustments changed since the last run are deleted
+    and rewritten. Dated day types for days before start_date are purged.
+    Returns the number of rows inserted.
+    """
+    calendar = load_calendar(cursor, start_date, end_date)
+    if not calendar:
+        logger.warning(f"No templates found between {start_date} and {end_date}, skipping")
+        return 0
+    patterns = load_patterns(cursor)
+    rules = load_frequency_rules(cursor, {template_id for template_id, _ in calendar.values()})
+    adjustments = load_adjustments(cursor, start_date, end_date)
+    slices = plan_slices(calendar, patterns, rules, adjustments)
+    stored = load_slice_fingerprints(cursor)
+    expired = sorted({day_type for day_type, _, _ in stored if is_dated_before(day_type, start_date)})
+    if expired:
+        cursor.execute("DELETE FROM schedules WHERE day_type = ANY(%s)", (expired,))
+        cursor.execute("DELETE FROM schedule_slices WHERE day_type = ANY(%s)", (expired,))
+        logger.info(f"Purged {len(expired)} dated day types before {start_date}")
+
+    fingerprints = {key: slice_fingerprint(patterns[key[2]][1], slice_rules) for key, slice_rules in slices.items()}
+    stale = [key for key in stored if key not in slices and is_dated_in_window(key[0], start_date, end_date)]
+    changed_groups = {
+        (day_type, line_id)
+        for (day_type, line_id, pattern_id), fingerprint in fingerprints.items()
+        if not incremental or stored.get((day_type, line_id, pattern_id)) != fingerprint
+    } | {(day_type, line_id) for day_type, line_id, _ in stale}
+    if not changed_groups:
+        logger.info(f"Schedules between {start_date} and {end_date} are up to date")
+        return 0
+
+    day_types = [day_type for day_type, _ in changed_groups]
+    line_ids = [line_id for _, line_id in changed_groups]
+    cursor.execute("""
+        DELETE FROM schedules s
+        USING unnest(%s::text[], %s::int[]) AS g(day_type, line_id)
+        WHERE s.day_type = g.day_type AND s.line_id = g.line_id
+    """, (day_types, line_ids))
+    cursor.execute("""
+        DELETE FROM schedule_slices s
+        USING unnest(%s::text[], %s::int[]) AS g(day_type, line_id)
+        WHERE s.day_type = g.day_type AND s.line_id = g.line_id
+    """, (day_types, line_ids))
+
+    regenerated = [
+        (day_type, line_id, pattern_id, fingerprints[(day_type, line_id, pattern_id)])
+        for day_type, line_id, pattern_id in slices
+        if (day_type, line_id) in changed_groups
+    ]
+    buffer = io.StringIO()
+    rows = render_slices(buffer, slices, patterns, changed_groups)
+    inserted = copy_into_schedules(cursor, buffer) if rows else 0
+    execute_values(cursor, """
+        INSERT INTO schedule_slices (day_type, line_id, pattern_id, fingerprint) VALUES %s
+    """, regenerated)
+    logger.info(f"Regenerated {len(changed_groups)} (day_type, line) groups: {rows} rows prepared, {inserted} inserted")
+    return inserted
@@ -0,0 +1,80 @@
+import json
+import os
+import uuid
+from cache import TTLCache
+from dotenv import load_dotenv
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+
+
+class InMemorySessionStore:
+    """Per-process session store with TTL expiry and LRU eviction."""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, maxsize=SESSION_MAX_ENTRIES, clock=None):
+        self._cache = TTLCache(maxsize, ttl, clock)
+
+    def create(self, role, user_id=None):
+        token = str(uuid.uuid4())
+        self._cache.set(token, {"role": role, "user_id": user_id})
+        return token
+
+    def get(self, token):
+        return self._cache.get(token)
+
+    def revoke(self, token):
+        self._cache.pop(token)
+
+    def items(self):
+        return self._cache.items()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class RedisSessionStore:
+    """Session store shared by every worker through Redis; expiry is left to Redis key TTLs."""
+
+    def __init__(self, client, ttl=SESSION_TTL_SECONDS, prefix="blink:session:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def create(self, role, user_id=None):
+        token = str(uuid.uuid4())
+        self.client.setex(self.prefix + token, self.ttl, json.dumps({"role": role, "user_id": user_id}))
+        return token
+
+    def get(self, token):
+        value = self.client.get(self.prefix + token)
+        return json.loads(value) if value else None
+
+    def revoke(self, token):
+        self.client.delete(self.prefix + token)
+
+    def items(self):
+        sessions = []
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            key = key.decode("utf-8") if isinstance(key, bytes) else key
+            session = self.get(key[len(self.prefix):])
+            if session:
+                sessions.append((key[len(self.prefix):], session))
+        return sessions
+
+    def __len__(self):
+        return len(self.items())
+
+
+def create_session_store():
+    """Builds the store selected by SESSION_BACKEND (memory or redis)."""
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    if backend == "redis":
+        import redis
+        logger.info("Using Redis session store")
+        return RedisSessionStore(redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+    return InMemorySessionStore()
@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+from metrics import SIMULATOR_LAG
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class FastClock:
+    """Runs events back to back, as fast as the handlers allow."""
+
+    def start(self, at):
+        pass
+
+    def wait_until(self, at):
+        return 0.0
+
+
+class RealTimeClock:
+    """Paces events against the wall clock; speed=60 plays one simulated minute per second.
+
+    start() pins simulated time at to the current wall-clock instant, so
+    events fire at their offset from the simulation start rather than
+    from the first event. wait_until returns how many wall-clock seconds
+    late the event fired.
+    """
+
+    def __init__(self, speed=1.0, sleep=time.sleep, monotonic=time.monotonic):
+        self.speed = speed
+        self.sleep = sleep
+        self.monotonic = monotonic
+        self._anchor = None
+
+    def start(self, at):
+        self._anchor = (at, self.monotonic())
+
+    def wait_until(self, at):
+        if self._anchor is None:
+            self._anchor = (at, self.monotonic())
+        sim_anchor, wall_anchor = self._anchor
+        target = wall_anchor + (at - sim_anchor).total_seconds() / self.speed
+        delay = target - self.monotonic()
+        if delay > 0:
+            self.sleep(delay)
+            return 0.0
+        return -delay
+
+
+class TrainState:
+    __slots__ = ("train_id", "line_id", "current_route_id", "current_station_id", "next_station_id", "status", "last_updated")
+
+    def __init__(self, train_id, line_id, current_route_id, current_station_id, next_station_id, status="at_station", last_updated=None):
+        self.train_id = train_id
+        self.line_id = line_id
+        self.current_route_id = current_route_id
+        self.current_station_id = current_station_id
+        self.next_station_id = next_station_id
+        self.status = status
+        self.last_updated = last_updated
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SimulationEngine:
+    """Discrete-event train simulator with a single event heap and in-memory train state.
+
+    Departures come from TripManager.get_next_departure, travel times and
+    next hops from the network snapshot, so the event loop itself never
+    queries the database. Every state change is passed to the listeners
+    registered with subscribe(), which is where persistence and live
+    updates hook in.
+    """
+
+    def __init__(self, trip_manager, trains, clock=None):
+        self.trip_manager = trip_manager
+        self.trains = {train.train_id: train for train in trains}
+        self.clock = clock or FastClock()
+        self.routes = trip_manager.network.routes_by_origin()
+        self.travel_times = {
+            route_id: travel_time
+            for hops in self.routes.values()
+            for route_id, _, travel_time in hops
+        }
+        self.listeners = []
+        self.now = None
+        self.events_processed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._events = []
+        self._sequence = itertools.count()
+        self._handlers = {"depart": self._depart, "arrive": self._arrive, "wake": self._schedule_departure}
+
+    def subscribe(self, listener):
+        """Registers listener(train_state, event_time), called after every transition."""
+        self.listeners.append(listener)
+
+    def schedule(self, at, kind, train_id):
+        heapq.heappush(self._events, (at, next(self._sequence), kind, train_id))
+
+    def start(self, start_time):
+        """Queues the first departure of every train from start_time."""
+        self.now = start_time
+        self.clock.start(start_time)
+        for train_id in self.trains:
+            self._schedule_departure(train_id)
+
+    def run(self, until=None):
+        """Processes events in time order until the heap is empty or the next event is after until."""
+        while self._events:
+            at = self._events[0][0]
+            if until is not None and at > until:
+                break
+            _, _, kind, train_id = heapq.heappop(self._events)
+            self.last_lag = self.clock.wait_until(at)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            SIMULATOR_LAG.observe(self.last_lag)
+            self.now = at
+            self._handlers[kind](train_id)
+            self.events_processed += 1
+        if until is not None:
+            self.now = until
+        return self.events_processed
+
+    def _emit(self, train):
+        train.last_updated = self.now
+        for listener in self.listeners:
+            listener(train, self.now)
+
+    def _schedule_departure(self, train_id):
+        train = self.trains[train_id]
+        line_name = self.trip_manager.valid_lines.get(train.line_id)
+        station_name = self.trip_manager.station_map_inv.get(train.current_station_id)
+        next_station_name = self.trip_manager.station_map_inv.get(train.next_station_id)
+        if not line_name or not station_name or not next_station_name:
+            logger.error(f"Train {train_id} has no valid line or stations, leaving it idle")
+            return
+        next_dep = self.trip_manager.get_next_departure(line_name, station_name, next_station_name, self.now)
+        if next_dep is None:
+            # Nothing left today; try again when the next service day starts.
+            tomorrow = datetime.combine(self.now.date() + timedelta(days=1), datetime.min.time())
+            self.schedule(tomorrow, "wake", train_id)
+            return
+        self.schedule(next_dep, "depart", train_id)
+
+    def _depart(self, train_id):
+        train = self.trains[train_id]
+        train.status = "in_transit"
+        self._emit(train)
+        travel_time = self.travel_times.get(train.current_route_id)
+        if travel_time is None:
+            logger.error(f"Route {train.current_route_id} for train {train_id} not found")
+            return
+        self.schedule(self.now + timedelta(minutes=travel_time), "arrive", train_id)
+
+    def _arrive(self, train_id):
+        train = self.trains[train_id]
+        previous_station_id = train.current_station_id
+        train.current_station_id = train.next_station_id
+        train.status = "at_station"
+        hops = self.routes.get((train.line_id, train.current_station_id), [])
+        # Keep going in the same direction; turn back only at the end of the line.
+        onward = [hop for hop in hops if hop[1] != previous_station_id] or hops
+        if onward:
+            train.current_route_id, train.next_station_id, _ = onward[0]
+        else:
+            logger.info(f"Train {train_id} reached end of line with no reverse route")
+        self._emit(train)
+        if onward:
+            self._schedule_departure(train_id)
@@ -1,11 +1,14 @@
+import argparse
 import logging
+import os
 import time
 from datetime import datetime, timedelta
-from db import get_db_connection, release_db_connection, create_session
+from db import get_db_connection, release_db_connection
+from profiler import profile_queries
+from sim_engine import FastClock, RealTimeClock, SimulationEngine, TrainState
 from trip_manager import TripManager
-from apscheduler.schedulers.background import BackgroundScheduler
+from write_behind import TrainStateWriter
 from dotenv import load_dotenv
-import os
 
 # Configure logging
 logging.basicConfig(
@@ -21,171 +24,78 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Existing imports and logging setup are fine; enhance logging usage
-def schedule_train_update(train_id, scheduler, trip_manager):
-    conn = get_db_connection(create_session(role="admin"))
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            SELECT line_id, current_station_id, next_station_id
-            FROM trains
-            WHERE train_id = %s
-        """, (train_id,))
-        row = cursor.fetchone()
-        if not row:
-            logger.error(f"Train {train_id} not found")
-            return
-        line_id, current_station_id, next_station_id = row
-        line_name = trip_manager.valid_lines.get(line_id)
-        if not line_name:
-            logger.error(f"Line ID {line_id} not found for train {train_id}")
-            return
-        station_name = trip_manager.station_map_inv[current_station_id]
-        next_station_name = trip_manager.station_map_inv[next_station_id]
-        current_time = datetime.now()
-
-        next_dep = trip_manager.get_next_departure(line_name, station_name, next_station_name, current_time)
-        if not next_dep:
-            logger.info(f"No departures for train {train_id} at {station_name} on {line_name}")
-            return
-
-        scheduler.add_job(
-            depart_train,
-            'date',
-            run_date=next_dep,
-            args=[train_id, scheduler, trip_manager],
-            id=f"depart_{train_id}",
-            replace_existing=True
-        )
-        logger.info(f"Scheduled departure for train {train_id} at {next_dep}")
-    finally:
-        cursor.close()
-        release_db_connection(conn)
-
-def depart_train(train_id, scheduler, trip_manager):
-    conn = get_db_connection(create_session(role="admin"))
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            SELECT line_id, current_station_id, next_station_id, current_route_id
-            FROM trains
-            WHERE train_id = %s
-        """, (train_id,))
-        row = cursor.fetchone()
-        if not row:
-            logger.error(f"Train {train_id} not found")
-            return
-        line_id, current_station_id, next_station_id, current_route_id = row
-
-        cursor.execute("""
-            UPDATE trains
-            SET status = 'in_transit', last_updated = CURRENT_TIMESTAMP
-            WHERE train_id = %s
-        """, (train_id,))
-        conn.commit()
-
-        cursor.execute("""
-            SELECT travel_time
-            FROM routes
-            WHERE route_id = %s
-        """, (current_route_id,))
-        travel_time = cursor.fetchone()[0]
-        arrival_time = datetime.now() + timedelta(minutes=travel_time)
+def load_trains(cursor):
+    cursor.execute("""
+        SELECT train_id, line_id, current_route_id, current_station_id, next_station_id, status
+        FROM trains
+    """)
+    return [TrainState(*row) for row in cursor.fetchall()]
 
-        scheduler.add_job(
-            arrive_at_station,
-            'date',
-            run_date=arrival_time,
-            args=[train_id, scheduler, trip_manager],
-            id=f"arrive_{train_id}",
-            replace_existing=True
-        )
-        logger.info(f"Train {train_id} departed from {current_station_id}, arriving at {next_station_id} at {arrival_time}")
-    finally:
-        cursor.close()
-        release_db_connection(conn)
-
-def arrive_at_station(train_id, scheduler, trip_manager):
-    conn = get_db_connection(create_session(role="admin"))
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            SELECT line_id, current_station_id, next_station_id
-            FROM trains
-            WHERE train_id = %s
-        """, (train_id,))
-        row = cursor.fetchone()
-        if not row:
-            logger.error(f"Train {train_id} not found")
-            return
-        line_id, current_station_id, next_station_id = row
-
-        cursor.execute("""
-            UPDATE trains
-            SET current_station_id = %s, status = 'at_station', last_updated = CURRENT_TIMESTAMP
-            WHERE train_id = %s
-        """, (next_station_id, train_id))
+def log_transition(train, event_time):
+    if train.status == "in_transit":
+        logger.info(f"Train {train.train_id} departed from {train.current_station_id} towards {train.next_station_id} at {event_time}")
+    else:
+        logger.info(f"Train {train.train_id} arrived at {train.current_station_id} at {event_time}")
 
-        cursor.execute("""
-            SELECT route_id, to_station_id
-            FROM routes
-            WHERE from_station_id = %s AND line_id = %s
-        """, (next_station_id, line_id))
-        new_route = cursor.fetchone()
-        if new_route:
-            new_route_id, new_next_station_id = new_route
-            cursor.execute("""
-                UPDATE trains
-                SET next_station_id = %s, current_route_id = %s
-                WHERE train_id = %s
-            """, (new_next_station_id, new_route_id, train_id))
-        else:
-            # Reverse direction at end of line
-            cursor.execute("""
-                SELECT route_id, from_station_id
-                FROM routes
-                WHERE to_station_id = %s AND line_id = %s
-            """, (next_station_id, line_id))
-            reverse_route = cursor.fetchone()
-            if reverse_route:
-                reverse_route_id, reverse_station_id = reverse_route
-                cursor.execute("""
-                    UPDATE trains
-                    SET next_station_id = %s, current_route_id = %s
-                    WHERE train_id = %s
-                """, (reverse_station_id, reverse_route_id, train_id))
-            else:
-                logger.info(f"Train {train_id} reached end of line with no reverse route")
+def run_simulation(fast=False, speed=1.0, start_time=None, hours=None, persist=True, listeners=()):
+    """Runs the train simulation.
 
-        conn.commit()
-        schedule_train_update(train_id, scheduler, trip_manager)
-    finally:
-        cursor.close()
-        release_db_connection(conn)
-
-def run_simulation():
-    scheduler = BackgroundScheduler()
+    fast=True replays events back to back (hours is then required), otherwise
+    events are paced against the wall clock at the given speed multiplier.
+    listeners are extra engine listeners, e.g. the live broadcast hub.
+    """
     trip_manager = TripManager()
-    start_date = datetime.now().date()
-    trip_manager.generate_weekly_schedule(start_date)
-    conn = get_db_connection(create_session(role="admin"))
+    start_time = start_time or datetime.now()
+    until = start_time + timedelta(hours=hours) if hours else None
+    if fast and until is None:
+        raise ValueError("Fast simulations need an end time")
+    trip_manager.generate_weekly_schedule(start_time.date())
+    conn = get_db_connection(internal=True)
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT train_id FROM trains")
-        train_ids = [row[0] for row in cursor.fetchall()]
-        for train_id in train_ids:
-            schedule_train_update(train_id, scheduler, trip_manager)
-        logger.info("Simulation started")
+        trains = load_trains(cursor)
     finally:
         cursor.close()
         release_db_connection(conn)
-    scheduler.start()
+
+    engine = SimulationEngine(trip_manager, trains, FastClock() if fast else RealTimeClock(speed))
+    engine.subscribe(log_transition)
+    for listener in listeners:
+        engine.subscribe(listener)
+    writer = None
+    if persist:
+        writer = TrainStateWriter(
+            max_batch=int(os.getenv("SIM_FLUSH_BATCH", "500")),
+            max_delay=float(os.getenv("SIM_FLUSH_SECONDS", "1.0")),
+            durability=os.getenv("SIM_DURABILITY", "batched"),
+        )
+        engine.subscribe(writer.record)
+        writer.start()
+    engine.start(start_time)
+    logger.info(f"Simulation started with {len(trains)} trains at {start_time}")
+    started = time.monotonic()
     try:
-        while True:
-            time.sleep(1)
+        engine.run(until)
     except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
-        logger.info("Simulation shut down")
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+    logger.info(f"Simulation shut down after {engine.events_processed} events in {time.monotonic() - started:.1f}s")
+    return engine
 
 if __name__ == "__main__":
-    run_simulation()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Simulate trains running to the generated schedules")
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible instead of in real time")
+    parser.add_argument("--speed", type=float, default=1.0, help="real-time speed multiplier")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="simulation start, ISO format (default: now)")
+    parser.add_argument("--hours", type=float, help="simulated hours to run (required with --fast)")
+    parser.add_argument("--no-persist", action="store_true", help="do not write train state to the database")
+    parser.add_argument("--profile-queries", action="store_true", help="log the queries run per call site when done")
+    args = parser.parse_args()
+    if args.profile_queries:
+        with profile_queries("simulation", all_threads=True) as profile:
+            run_simulation(args.fast, args.speed, args.start, args.hours, not args.no_persist)
+        logger.info(profile.report(limit=20))
+    else:
+        run_simulation(args.fast, args.speed, args.start, args.hours, not args.no_persist)
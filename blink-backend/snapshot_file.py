@@ -0,0 +1,147 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+from datetime import date, datetime, timedelta
+import numpy as np
+from network import ARRAY_FIELDS, SERVICE_PERIODS, NetworkSnapshot
+from timetable import ServiceTimetable
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BLINKSNP"
+VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sIQ")  # magic, version, header length
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, network, timetables=()):
+    """Writes a network and its service timetables to a snapshot file.
+
+    Layout: magic, version and header length, a JSON header, then every
+    array as raw little-endian bytes starting on a 64-byte boundary. The
+    header holds the station, line, route and transfer rows plus the
+    dtype, shape and offset of each array. Each service period's route
+    matrix, or contraction hierarchy on networks too big for one, is built
+    here, offline, and stored alongside, so loading builds nothing.
+    The file is written next to path and renamed over it, so readers
+    never see a partial snapshot.
+    """
+    arrays = [(name, getattr(network, name)) for name in ARRAY_FIELDS]
+    contraction_headers, matrix_headers = {}, {}
+    for period, is_peak in SERVICE_PERIODS.items():
+        if network.uses_contraction:
+            prefix, structure, headers = "contraction", network.contraction(is_peak), contraction_headers
+        else:
+            prefix, structure, headers = "route_matrix", network.route_matrix(is_peak), matrix_headers
+        names = {}
+        for name, array in structure.to_arrays().items():
+            names[name] = f"{prefix}.{period}.{name}"
+            arrays.append((names[name], array))
+        headers[period] = names
+    timetable_headers = []
+    for i, timetable in enumerate(timetables):
+        names = {}
+        for name, array in timetable.to_arrays().items():
+            names[name] = f"timetable{i}.{name}"
+            arrays.append((names[name], array))
+        timetable_headers.append({
+            "service_date": timetable.service_date.isoformat(),
+            "day_type": timetable.day_type,
+            "arrays": names,
+        })
+
+    layout = {}
+    offset = 0
+    for name, array in arrays:
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "fingerprint": network.fingerprint,
+        "stations": list(zip(network.station_ids, network.station_names)),
+        "lines": list(zip(network.line_ids, network.line_names)),
+        "routes": [list(row) for row in network._routes],
+        "transfer_stations": [list(row) for row in network._transfer_stations],
+        "arrays": layout,
+        "timetables": timetable_headers,
+        "contractions": contraction_headers,
+        "route_matrices": matrix_headers,
+    }).encode("utf-8")
+    data_start = _aligned(PREAMBLE.size + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays:
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote snapshot {path}: {network.num_nodes} nodes, {len(timetable_headers)} service days")
+
+
+def read_snapshot(path):
+    """Maps a snapshot file; returns (NetworkSnapshot, {service_date: ServiceTimetable}).
+
+    Arrays are read-only views straight into the shared page cache, so
+    every process mapping the same file shares one copy of them.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_length = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} network snapshot")
+    header = json.loads(buffer[PREAMBLE.size:PREAMBLE.size + header_length])
+    data_start = _aligned(PREAMBLE.size + header_length)
+
+    def array(name):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        if count == 0:
+            return np.empty(spec["shape"], dtype=dtype)
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]).reshape(spec["shape"])
+
+    def per_period(key):
+        return {SERVICE_PERIODS[period]: {name: array(stored) for name, stored in names.items()}
+                for period, names in header.get(key, {}).items() if period in SERVICE_PERIODS}
+
+    network = NetworkSnapshot.from_arrays(
+        header["stations"], header["lines"],
+        [tuple(row) for row in header["routes"]],
+        [tuple(row) for row in header["transfer_stations"]],
+        {name: array(name) for name in ARRAY_FIELDS},
+        header.get("fingerprint"),
+        per_period("contractions"),
+        per_period("route_matrices"),
+    )
+    timetables = {}
+    for entry in header["timetables"]:
+        service_date = date.fromisoformat(entry["service_date"])
+        timetables[service_date] = ServiceTimetable.from_arrays(
+            network, service_date, entry["day_type"], {name: array(key) for name, key in entry["arrays"].items()}
+        )
+    logger.info(f"Mapped snapshot {path} from {header['created_at']}: {network.num_nodes} nodes, {len(timetables)} service days")
+    return network, timetables
+
+
+if __name__ == "__main__":
+    from trip_manager import TripManager
+
+    parser = argparse.ArgumentParser(description="Write the network and upcoming timetables to a snapshot file")
+    parser.add_argument("output", help="snapshot file to write (BLINK_SNAPSHOT_FILE for the API)")
+    parser.add_argument("--start", type=date.fromisoformat, default=date.today(), help="first service date (default: today)")
+    parser.add_argument("--days", type=int, default=2, help="number of service days to include")
+    args = parser.parse_args()
+    trip_manager = TripManager()
+    trip_manager.save_snapshot(args.output, [args.start + timedelta(days=offset) for offset in range(args.days)])
@@ -0,0 +1,123 @@
+import math
+import random
+from datetime import date, time, timedelta
+from network import NetworkSnapshot
+from schedule_builder import pattern_departures
+from timetable import ServiceTimetable
+
+# (start, end, headway minutes) for a weekday template, before scaling.
+WEEKDAY_RULES = [
+    (time(5, 0), time(7, 0), 10),
+    (time(7, 0), time(9, 0), 6),
+    (time(9, 0), time(17, 0), 10),
+    (time(17, 0), time(19, 0), 6),
+    (time(19, 0), time(23, 0), 15),
+]
+WEEKEND_RULES = [(time(6, 0), time(23, 0), 12)]
+CROSSTOWN_EVERY = 5
+
+
+class SyntheticNetwork:
+    """Deterministic grid-shaped transit network for benchmarks and tests.
+
+    Stations sit on a rows x cols grid. Every row is a line, and every
+    CROSSTOWN_EVERY-th column is a crosstown line, so the stations where the
+    two meet are transfer stations. All rows have the same shape as the
+    database tables, so the result feeds NetworkSnapshot, ServiceTimetable
+    and the schedule builder directly. With ~70 stations it is about the
+    size of the HCMC metro plan; 10000 gives a city bus network. Larger
+    networks run less often (headways are multiplied by one per 2000 stations)
+    to keep the timetable a realistic size.
+    """
+
+    def __init__(self, num_stations, seed=0):
+        rng = random.Random(seed)
+        self.num_stations = num_stations
+        self.rows = max(1, int(math.sqrt(num_stations)))
+        self.cols = math.ceil(num_stations / self.rows)
+        self.headway_scale = math.ceil(num_stations / 2000)
+        self.stations = [(f"S{i}", f"Stop {i}") for i in range(num_stations)]
+
+        line_stops = []
+        for r in range(self.rows):
+            stops = [f"S{r * self.cols + c}" for c in range(self.cols) if r * self.cols + c < num_stations]
+            if len(stops) > 1:
+                line_stops.append(stops)
+        for c in range(0, self.cols, CROSSTOWN_EVERY):
+            stops = [f"S{r * self.cols + c}" for r in range(self.rows) if r * self.cols + c < num_stations]
+            if len(stops) > 1:
+                line_stops.append(stops)
+        self.lines = [(line_id, f"Line {line_id}") for line_id in range(1, len(line_stops) + 1)]
+        self.line_stops = dict(zip((line_id for line_id, _ in self.lines), line_stops))
+
+        self.routes = []
+        self.travel_times = {}
+        for line_id, stops in self.line_stops.items():
+            for a, b in zip(stops, stops[1:]):
+                travel = rng.randint(1, 4)
+                for from_station, to_station in ((a, b), (b, a)):
+                    self.routes.append((len(self.routes) + 1, line_id, from_station, to_station, travel))
+                    self.travel_times[(line_id, from_station, to_station)] = travel
+
+        lines_at = {}
+        for line_id, stops in self.line_stops.items():
+            for station_id in stops:
+                lines_at.setdefault(station_id, []).append(line_id)
+        self.transfer_stations = [
+            (station_id, line_id)
+            for station_id, line_ids in lines_at.items() if len(line_ids) > 1
+            for line_id in line_ids
+        ]
+        self.transfer_times = [
+            (station_id, from_line, to_line, 5, 3)
+            for station_id, line_ids in lines_at.items() if len(line_ids) > 1
+            for from_line in line_ids
+            for to_line in line_ids
+            if from_line != to_line
+        ]
+
+        # One service pattern per line and direction.
+        self.patterns = {}
+        for line_id, stops in self.line_stops.items():
+            for ordered in (stops, stops[::-1]):
+                self.patterns[len(self.patterns) + 1] = (line_id, [
+                    (station_id, next_station_id, 0,
+                     self.travel_times.get((line_id, station_id, next_station_id)))
+                    for station_id, next_station_id in zip(ordered, ordered[1:] + [None])
+                ])
+
+        self.templates = {1: ("Weekday", WEEKDAY_RULES), 2: ("Weekend", WEEKEND_RULES)}
+        self.rules = {
+            (template_id, line_id, pattern_id): [(start, end, headway * self.headway_scale) for start, end, headway in template_rules]
+            for template_id, (_, template_rules) in self.templates.items()
+            for pattern_id, (line_id, _) in self.patterns.items()
+        }
+
+    def snapshot(self):
+        return NetworkSnapshot(self.stations, self.lines, self.routes, self.transfer_stations, self.transfer_times)
+
+    def calendar(self, start_date, days=7):
+        """Returns {date: (template_id, template_name)} like schedule_builder.load_calendar."""
+        calendar = {}
+        for offset in range(days):
+            service_date = start_date + timedelta(days=offset)
+            template_id = 2 if service_date.weekday() >= 5 else 1
+            calendar[service_date] = (template_id, self.templates[template_id][0])
+        return calendar
+
+    def connection_rows(self, template_id=1):
+        """Departure rows as timetable.fetch_connections returns them for one template."""
+        rows = []
+        for pattern_id, (line_id, stops) in self.patterns.items():
+            departures = pattern_departures(stops, self.rules[(template_id, line_id, pattern_id)])
+            for column, (station_id, next_station_id, _, travel) in enumerate(stops):
+                if next_station_id is None:
+                    continue
+                for seconds in departures[:, column].tolist():
+                    rows.append((line_id, station_id, next_station_id,
+                                 time(seconds // 3600, seconds // 60 % 60, seconds % 60), travel))
+        return rows
+
+    def timetable(self, snapshot, service_date=date(2025, 3, 18)):
+        template_id = 2 if service_date.weekday() >= 5 else 1
+        return ServiceTimetable(snapshot, service_date, self.templates[template_id][0], self.connection_rows(template_id))
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+import numpy as np
+import network
+from fares import FareEngine, FareRules
+from network import NetworkSnapshot
+from test_network import LINES, ROUTES, STATIONS, TRANSFER_STATIONS, TRANSFER_TIMES
+
+RULES = FareRules(base=7000, per_stop=1000, per_transfer=500, cap=8200)
+
+
+def build_snapshot():
+    return NetworkSnapshot(STATIONS + [("C9", "Foxtrot")], LINES, ROUTES, TRANSFER_STATIONS, TRANSFER_TIMES)
+
+
+class TestFareEngine(unittest.TestCase):
+
+    def test_fare_matrix_counts_stops_and_transfers(self):
+        engine = FareEngine(build_snapshot(), RULES)
+        index = engine.network.station_index
+        self.assertEqual(engine.stops[index["A1"], index["A3"]], 2)
+        self.assertEqual(engine.transfers[index["A1"], index["B3"]], 1)
+        fares = engine.price(["A1", "A1", "A1", "A2", "B1", "A1", "XX"], ["A2", "A3", "B3", "A2", "A3", "C9", "A1"])
+        np.testing.assert_array_equal(fares[:5], [7000, 8000, 8200, 7000, 8200])
+        self.assertTrue(np.isnan(fares[5:]).all())
+
+    def test_large_networks_price_pairs_on_demand(self):
+        snapshot = build_snapshot()
+        expected = FareEngine(snapshot, RULES).price(["A1", "B1", "B3", "A1"], ["B3", "A3", "A1", "C9"])
+        with mock.patch.object(network, "ALL_PAIRS_MAX_NODES", 0):
+            engine = FareEngine(build_snapshot(), RULES)
+            self.assertIsNone(engine.fare_matrix)
+            fares = engine.price(["A1", "B1", "B3", "A1"], ["B3", "A3", "A1", "C9"])
+        np.testing.assert_array_equal(fares, expected)
+        self.assertEqual(len(engine._pair_fares), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+from datetime import datetime
+from ingest import GroupCommitter, parse_records
+
+STATIONS = {"Ben Thanh": "S1", "Opera House": "S2"}
+MORNING = datetime(2025, 3, 18, 8, 0)
+
+
+class TestParseRecords(unittest.TestCase):
+
+    def test_trips_and_taps(self):
+        rows, results = parse_records([
+            {"start_station": "Ben Thanh", "end_station": "Opera House", "start_time": MORNING},
+            {"tap": "in", "station": "Ben Thanh", "time": MORNING, "user_id": 9},
+            {"tap": "out", "station": "Opera House", "time": MORNING},
+        ], STATIONS, default_user_id=3)
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(rows, [
+            ("insert", 0, (3, "S1", "S2", MORNING, None, None)),
+            ("insert", 1, (9, "S1", None, MORNING, None, None)),
+            ("close", 2, (3, "S2", MORNING)),
+        ])
+
+    def test_rejections_are_per_record(self):
+        rows, results = parse_records([
+            {"start_station": "Nowhere"},
+            {"tap": "in", "station": "Ben Thanh", "time": MORNING},
+            {"tap": "sideways", "station": "Ben Thanh", "time": MORNING, "user_id": 1},
+            {"tap": "out", "station": "Ben Thanh", "user_id": 1},
+            {"start_station": "Ben Thanh", "user_id": 1},
+        ], STATIONS)
+        self.assertEqual([op for op, _, _ in rows], ["insert"])
+        self.assertEqual(rows[0][1], 4)
+        self.assertEqual([result["error"] for result in results[:4]], [
+            "user_id is required", "user_id is required", "Unknown tap kind sideways", "Tap time is required",
+        ])
+        self.assertIsNone(results[4])
+
+
+class TestGroupCommitter(unittest.TestCase):
+
+    def test_concurrent_submissions_share_a_commit(self):
+        writes = []
+
+        async def write(items):
+            writes.append(list(items))
+            return [item * 10 for item in items]
+
+        async def run():
+            committer = GroupCommitter(write, max_delay=0.01)
+            results = await asyncio.gather(committer.submit([1, 2]), committer.submit([3]), committer.submit([]))
+            return committer, results
+
+        committer, results = asyncio.run(run())
+        self.assertEqual(results, [[10, 20], [30], []])
+        self.assertEqual(writes, [[1, 2, 3]])
+        self.assertEqual((committer.commits, committer.items_written), (1, 3))
+
+    def test_full_batch_flushes_early_and_failures_reach_every_caller(self):
+        async def write(items):
+            raise OSError("connection lost")
+
+        async def run():
+            committer = GroupCommitter(write, max_batch=2, max_delay=60)
+            return await asyncio.wait_for(
+                asyncio.gather(committer.submit([1]), committer.submit([2]), return_exceptions=True), 5
+            )
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, OSError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
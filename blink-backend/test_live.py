@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+from datetime import datetime
+from live import BroadcastHub, encode_event
+from sim_engine import TrainState
+
+
+def state(line_id, station, next_station, status):
+    return {"line_id": line_id, "current_route_id": 1, "current_station_id": station,
+            "next_station_id": next_station, "status": status, "last_updated": None}
+
+
+class TestBroadcastHub(unittest.TestCase):
+
+    def test_filters_and_sends_only_deltas(self):
+        async def run():
+            hub = BroadcastHub()
+            line_sub = hub.subscribe(lines=[1])
+            station_sub = hub.subscribe(stations=["S3"])
+            hub.publish("T1", state(1, "S1", "S2", "at_station"))
+            hub.publish("T1", state(1, "S1", "S2", "in_transit"))
+            hub.publish("T1", state(1, "S1", "S2", "in_transit"))
+            hub.publish("T2", state(2, "S3", "S4", "at_station"))
+            return line_sub, station_sub
+        line_sub, station_sub = asyncio.run(run())
+        self.assertEqual(line_sub.queue.qsize(), 2)
+        line_sub.queue.get_nowait()
+        self.assertEqual(line_sub.queue.get_nowait(), {"train_id": "T1", "status": "in_transit"})
+        self.assertEqual(station_sub.queue.qsize(), 1)
+        self.assertEqual(station_sub.queue.get_nowait()["train_id"], "T2")
+
+    def test_first_event_for_a_subscriber_is_the_full_state(self):
+        async def run():
+            hub = BroadcastHub()
+            station_sub = hub.subscribe(stations=["S3"])
+            hub.publish("T1", state(1, "S1", "S2", "at_station"))
+            hub.publish("T1", state(1, "S2", "S3", "in_transit"))
+            hub.publish("T1", state(1, "S2", "S3", "at_station"))
+            return station_sub
+        station_sub = asyncio.run(run())
+        self.assertEqual(station_sub.queue.get_nowait(), {"train_id": "T1", **state(1, "S2", "S3", "in_transit")})
+        self.assertEqual(station_sub.queue.get_nowait(), {"train_id": "T1", "status": "at_station"})
+
+    def test_train_reentering_a_filter_is_diffed_against_what_was_sent(self):
+        async def run():
+            hub = BroadcastHub()
+            station_sub = hub.subscribe(stations=["S1"])
+            hub.publish("T1", state(1, "S1", "S2", "at_station"))
+            hub.publish("T1", state(1, "S2", "S3", "in_transit"))
+            hub.publish("T1", {**state(1, "S3", "S4", "at_station"), "current_route_id": 2})
+            hub.publish("T1", {**state(1, "S4", "S1", "at_station"), "current_route_id": 2})
+            return station_sub
+        station_sub = asyncio.run(run())
+        events = [station_sub.queue.get_nowait() for _ in range(station_sub.queue.qsize())]
+        self.assertEqual(len(events), 3)
+        # Away for one event: the return carries the route change it missed.
+        self.assertEqual(events[2], {"train_id": "T1", "current_route_id": 2, "current_station_id": "S4",
+                                     "next_station_id": "S1", "status": "at_station"})
+
+    def test_new_subscriber_gets_current_state(self):
+        async def run():
+            hub = BroadcastHub()
+            hub.publish("T1", state(1, "S1", "S2", "at_station"))
+            return hub.subscribe(stations=["S2"])
+        subscription = asyncio.run(run())
+        self.assertEqual(subscription.queue.get_nowait()["current_station_id"], "S1")
+
+    def test_slow_consumer_is_dropped(self):
+        async def run():
+            hub = BroadcastHub(queue_size=2)
+            slow = hub.subscribe()
+            fast = hub.subscribe()
+            received = []
+            for i in range(5):
+                hub.publish("T1", state(1, f"S{i}", f"S{i + 1}", "at_station"))
+                received.append(fast.queue.get_nowait())
+            events = [event async for event in slow]
+            return hub, slow, received, events
+        hub, slow, received, events = asyncio.run(run())
+        self.assertTrue(slow.dropped)
+        self.assertEqual(events, [])
+        self.assertEqual(len(received), 5)
+        self.assertEqual(hub.dropped, 1)
+        self.assertEqual(hub.subscriber_count, 1)
+
+    def test_publish_train_from_another_thread(self):
+        async def run():
+            hub = BroadcastHub()
+            hub.bind(asyncio.get_running_loop())
+            subscription = hub.subscribe(lines=[1])
+            train = TrainState("T1", 1, 1, "S1", "S2", "in_transit")
+            at = datetime(2025, 3, 18, 6, 0)
+            await asyncio.get_running_loop().run_in_executor(None, hub.publish_train, train, at)
+            return await asyncio.wait_for(subscription.__anext__(), 1)
+        event = asyncio.run(run())
+        self.assertEqual(event["status"], "in_transit")
+        self.assertIn('"last_updated": "2025-03-18T06:00:00"', encode_event(event))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import itertools
+import random
+import unittest
+from longest_route import longest_simple_path
+from test_network import build_sample_snapshot
+from trip_manager import TripManager
+
+
+def brute_force(adjacency):
+    best = 0
+    def extend(path):
+        nonlocal best
+        best = max(best, len(path))
+        for neighbor in adjacency[path[-1]]:
+            if neighbor not in path:
+                extend(path + [neighbor])
+    for station in adjacency:
+        extend([station])
+    return best
+
+
+def random_graph(rng, size, extra_edges):
+    adjacency = {i: set() for i in range(size)}
+    for i in range(1, size):
+        j = rng.randrange(i)
+        adjacency[i].add(j)
+        adjacency[j].add(i)
+    pairs = list(itertools.combinations(range(size), 2))
+    for a, b in rng.sample(pairs, min(extra_edges, len(pairs))):
+        adjacency[a].add(b)
+        adjacency[b].add(a)
+    return adjacency
+
+
+class TestLongestRoute(unittest.TestCase):
+
+    def assert_valid(self, adjacency, path):
+        self.assertEqual(len(path), len(set(path)))
+        for a, b in zip(path, path[1:]):
+            self.assertIn(b, adjacency[a])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            adjacency = random_graph(rng, rng.randint(1, 11), rng.randint(0, 4))
+            path, exact = longest_simple_path(adjacency)
+            self.assertTrue(exact)
+            self.assert_valid(adjacency, path)
+            self.assertEqual(len(path), brute_force(adjacency))
+
+    def test_rings_and_self_loops(self):
+        ring = {i: {(i - 1) % 6, (i + 1) % 6, i} for i in range(6)}
+        path, exact = longest_simple_path(ring)
+        self.assertTrue(exact)
+        self.assertEqual(len(path), 6)
+        self.assert_valid(ring, path)
+
+    def test_budget_returns_best_so_far(self):
+        adjacency = random_graph(random.Random(1), 400, 120)
+        path, exact = longest_simple_path(adjacency, max_expansions=1000)
+        self.assertFalse(exact)
+        self.assert_valid(adjacency, path)
+        self.assertGreater(len(path), 1)
+
+    def test_trip_manager_memoizes_per_network(self):
+        trip_manager = TripManager(build_sample_snapshot())
+        route = trip_manager.longest_route_no_repeats()
+        self.assertEqual(route, ["Alpha", "Bravo", "Charlie"])
+        self.assertIs(trip_manager._longest_route[0], trip_manager.routing)
+        route.append("Delta")
+        self.assertEqual(trip_manager.longest_route_no_repeats(), ["Alpha", "Bravo", "Charlie"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from metrics import (DB_QUERIES, METHOD_SECONDS, REGISTRY, REQUEST_QUERIES, REQUESTS, Histogram, MetricsMiddleware,
+                     record_query, register_pool, track_method)
+
+
+class Service:
+
+    @track_method
+    def lookup(self):
+        record_query(0.002)
+        return "found"
+
+    @track_method
+    def scan(self, count):
+        for i in range(count):
+            record_query(0.001)
+            yield i
+
+    @track_method
+    async def store(self):
+        record_query(0.003)
+        return "stored"
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram("test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value, route="/x")
+        self.assertEqual(histogram.render()[2:], [
+            'test_latency_seconds_bucket{route="/x",le="0.1"} 1',
+            'test_latency_seconds_bucket{route="/x",le="1"} 3',
+            'test_latency_seconds_bucket{route="/x",le="+Inf"} 4',
+            'test_latency_seconds_sum{route="/x"} 4.25',
+            'test_latency_seconds_count{route="/x"} 4',
+        ])
+
+    def test_queries_are_attributed_to_the_calling_method(self):
+        service = Service()
+        before = {name: DB_QUERIES.value(method=f"Service.{name}") for name in ("lookup", "scan", "store")}
+        calls = METHOD_SECONDS.count(method="Service.scan")
+        self.assertEqual(service.lookup(), "found")
+        self.assertEqual(list(service.scan(3)), [0, 1, 2])
+        self.assertEqual(asyncio.run(service.store()), "stored")
+        record_query(0.001)
+        self.assertEqual(DB_QUERIES.value(method="Service.lookup") - before["lookup"], 1)
+        self.assertEqual(DB_QUERIES.value(method="Service.scan") - before["scan"], 3)
+        self.assertEqual(DB_QUERIES.value(method="Service.store") - before["store"], 1)
+        self.assertEqual(METHOD_SECONDS.count(method="Service.scan"), calls + 1)
+
+    def test_middleware_records_route_templates_and_queries(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get("/items/{item_id}")
+        def get_item(item_id: int):
+            record_query(0.001)
+            record_query(0.001)
+            return {"item_id": item_id}
+
+        client = TestClient(app)
+        self.assertEqual(client.get("/items/1").status_code, 200)
+        self.assertEqual(client.get("/items/2").status_code, 200)
+        self.assertEqual(client.get("/missing").status_code, 404)
+        self.assertEqual(REQUESTS.value(method="GET", route="/items/{item_id}", status=200), 2)
+        self.assertEqual(REQUESTS.value(method="GET", route="unmatched", status=404), 1)
+        text = REGISTRY.render()
+        self.assertIn('blink_http_request_db_queries_bucket{method="GET",route="/items/{item_id}",le="1"} 0', text)
+        self.assertIn('blink_http_request_db_queries_bucket{method="GET",route="/items/{item_id}",le="2"} 2', text)
+        self.assertEqual(REQUEST_QUERIES.count(method="GET", route="/items/{item_id}"), 2)
+
+    def test_pool_gauges(self):
+        register_pool("test", lambda: (5, 20))
+        register_pool("closed", lambda: None)
+        text = REGISTRY.render()
+        self.assertIn('blink_db_pool_connections_in_use{pool="test"} 5', text)
+        self.assertIn('blink_db_pool_saturation{pool="test"} 0.25', text)
+        self.assertNotIn('pool="closed"', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
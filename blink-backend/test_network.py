@@ -0,0 +1,208 @@
+import socket
+import time
+import unittest
+from unittest import mock
+from datetime import datetime
+import network
+import trip_manager as trip_manager_module
+from network import NetworkSnapshot, dijkstra
+from network_reloader import NetworkReloader
+from synthetic import SyntheticNetwork
+from trip_manager import TripManager
+
+STATIONS = [
+    ("A1", "Alpha"), ("A2", "Bravo"), ("A3", "Charlie"),
+    ("B1", "Delta"), ("B3", "Echo"),
+]
+LINES = [(1, "Line 1"), (2, "Line 2")]
+ROUTES = [
+    (1, 1, "A1", "A2", 3), (2, 1, "A2", "A1", 3),
+    (3, 1, "A2", "A3", 4), (4, 1, "A3", "A2", 4),
+    (5, 2, "B1", "A2", 5), (6, 2, "A2", "B1", 5),
+    (7, 2, "A2", "B3", 2), (8, 2, "B3", "A2", 2),
+]
+TRANSFER_STATIONS = [("A2", 1), ("A2", 2)]
+TRANSFER_TIMES = [("A2", 1, 2, 3, 1), ("A2", 2, 1, 3, 1)]
+
+
+def build_sample_snapshot():
+    return NetworkSnapshot(STATIONS, LINES, ROUTES, TRANSFER_STATIONS, TRANSFER_TIMES)
+
+
+class TestNetworkSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = build_sample_snapshot()
+
+    def test_csr_layout(self):
+        """Every route and transfer becomes exactly one CSR edge."""
+        self.assertEqual(self.snapshot.num_nodes, 6)
+        self.assertEqual(self.snapshot.num_edges, len(ROUTES) + len(TRANSFER_TIMES))
+        self.assertEqual(len(self.snapshot.indptr), self.snapshot.num_nodes + 1)
+        self.assertEqual(int(self.snapshot.edge_is_transfer.sum()), 2)
+
+    def test_weighted_graph_matches_legacy_shape(self):
+        graph = self.snapshot.weighted_graph(is_peak=True)
+        self.assertIn((("A2", "Line 2"), 3), graph[("A2", "Line 1")])
+        self.assertIn((("A3", "Line 1"), 4), graph[("A2", "Line 1")])
+        offpeak = self.snapshot.weighted_graph(is_peak=False)
+        self.assertIn((("A2", "Line 2"), 1), offpeak[("A2", "Line 1")])
+
+    def test_station_graph_includes_transfer_loops(self):
+        graph = self.snapshot.station_graph()
+        self.assertIn(("A2", "Line 2"), graph["A2"])
+        self.assertIn(("A1", "Line 1"), graph["A2"])
+
+    def test_route_matrix_matches_dijkstra(self):
+        for is_peak in (True, False):
+            matrix = self.snapshot.route_matrix(is_peak)
+            weights = self.snapshot.weights(is_peak).tolist()
+            for source in range(self.snapshot.num_nodes):
+                distances, _, _ = dijkstra(self.snapshot.indptr.tolist(), self.snapshot.indices.tolist(), weights, [source])
+                for target in range(self.snapshot.num_nodes):
+                    expected = distances.get(target, float('inf'))
+                    self.assertEqual(matrix.dist[source, target], expected)
+                    if expected != float('inf'):
+                        path = matrix.path(source, target)
+                        graph = self.snapshot.weighted_graph(is_peak)
+                        hops = [dict(graph[self.snapshot.node_key(a)])[self.snapshot.node_key(b)] for a, b in zip(path, path[1:])]
+                        self.assertEqual((path[0], path[-1]), (source, target))
+                        self.assertEqual(sum(hops), expected)
+
+    def test_contraction_matches_dijkstra(self):
+        snapshot = SyntheticNetwork(120).snapshot()
+        indptr, indices = snapshot.indptr.tolist(), snapshot.indices.tolist()
+        for is_peak in (True, False):
+            hierarchy = snapshot.contraction(is_peak)
+            weights = snapshot.weights(is_peak).tolist()
+            hop = {(a, indices[e]): weights[e] for a in range(snapshot.num_nodes) for e in range(indptr[a], indptr[a + 1])}
+            for source in range(0, snapshot.num_nodes, 7):
+                distances, _, _ = dijkstra(indptr, indices, weights, [source])
+                for target in range(snapshot.num_nodes):
+                    path, total = hierarchy.route([source], [target])
+                    self.assertEqual(total, distances[target])
+                    self.assertEqual((path[0], path[-1]), (source, target))
+                    self.assertEqual(sum(hop[a, b] for a, b in zip(path, path[1:])), total)
+        self.assertIsNone(build_sample_snapshot().contraction(False).route([0], []))
+
+
+class TestTripManagerFromSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.trip_manager = TripManager(snapshot=build_sample_snapshot())
+
+    def test_find_shortest_path_with_transfer(self):
+        self.trip_manager.build_weighted_graph(datetime(2025, 3, 18, 12, 0))
+        path, total = self.trip_manager.find_shortest_path("Alpha", "Echo")
+        self.assertEqual(path, ["Alpha", "Bravo", "Bravo", "Echo"])
+        self.assertEqual(total, 3 + 1 + 2)
+
+    def test_find_shortest_path_peak_transfer(self):
+        self.trip_manager.build_weighted_graph(datetime(2025, 3, 18, 8, 0))
+        _, total = self.trip_manager.find_shortest_path("Alpha", "Echo")
+        self.assertEqual(total, 3 + 3 + 2)
+
+    def test_find_shortest_path_departure_time_selects_matrix(self):
+        _, total = self.trip_manager.find_shortest_path("Alpha", "Echo", departure_time=datetime(2025, 3, 18, 17, 30))
+        self.assertEqual(total, 3 + 3 + 2)
+
+    def test_find_shortest_path_without_matrix(self):
+        with mock.patch.object(network, "ALL_PAIRS_MAX_NODES", 0):
+            self.trip_manager.build_weighted_graph(datetime(2025, 3, 18, 12, 0))
+            path, total = self.trip_manager.find_shortest_path("Alpha", "Echo")
+        self.assertEqual(path, ["Alpha", "Bravo", "Bravo", "Echo"])
+        self.assertEqual(total, 6)
+
+    def test_find_shortest_paths_batch_matches_single(self):
+        pairs = [("Alpha", "Echo"), ("Delta", "Charlie"), ("Alpha", "Charlie"), ("Echo", "Nowhere")]
+        results = sorted(self.trip_manager.find_shortest_paths(pairs), key=lambda r: r["index"])
+        self.assertEqual([(r["start"], r["end"]) for r in results], pairs)
+        for result, (start, end) in zip(results, pairs):
+            self.assertEqual((result["path"], result["travel_time"]), self.trip_manager.find_shortest_path(start, end))
+
+    def test_find_shortest_paths_from_without_matrix(self):
+        with mock.patch.object(network, "ALL_PAIRS_MAX_NODES", 0):
+            results = list(self.trip_manager.find_shortest_paths_from(
+                "Echo", ["Alpha", "Charlie", "Echo"], departure_time=datetime(2025, 3, 18, 12, 0)))
+        self.assertEqual([r["travel_time"] for r in results], [2 + 1 + 3, 2 + 1 + 4, 0])
+        self.assertEqual(results[0]["path"], ["Echo", "Bravo", "Bravo", "Alpha"])
+
+    def test_find_shortest_path_unknown_station(self):
+        self.assertEqual(self.trip_manager.find_shortest_path("Alpha", "Nowhere"), (None, 0))
+
+    def test_unpinned_queries_follow_the_clock(self):
+        class MorningRush(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime(2025, 3, 18, 8, 0)
+        self.trip_manager.build_weighted_graph()
+        with mock.patch.object(trip_manager_module, "datetime", MorningRush):
+            _, total = self.trip_manager.find_shortest_path("Alpha", "Echo")
+        self.assertEqual(total, 3 + 3 + 2)
+        self.assertEqual(set(self.trip_manager.routing.graphs), {"peak", "off_peak"})
+
+    def test_reload_swaps_routing_state(self):
+        before = self.trip_manager.routing
+        slower = [route[:4] + (route[4] * 2,) for route in ROUTES]
+        self.trip_manager.reload_network(NetworkSnapshot(STATIONS, LINES, slower, TRANSFER_STATIONS, TRANSFER_TIMES))
+        self.assertIsNot(self.trip_manager.routing, before)
+        noon = datetime(2025, 3, 18, 12, 0)
+        self.assertEqual(self.trip_manager.find_shortest_path("Alpha", "Echo", noon)[1], 6 + 1 + 4)
+        # A query that already holds the old state still sees the old network.
+        old_matrix = before.graph_for(noon).route_matrix()
+        sources, targets = before.network.nodes_for_station("A1"), before.network.nodes_for_station("B3")
+        self.assertEqual(old_matrix.best_pair(sources, targets)[2], 3 + 1 + 2)
+
+    def test_timetable_loaded_across_reload_is_not_cached(self):
+        service_date = datetime(2025, 3, 18).date()
+        loaded = mock.Mock()
+
+        def reload_mid_query(cursor):
+            self.trip_manager.reload_network(build_sample_snapshot())
+            return {service_date: "Weekday"}
+        with mock.patch("trip_manager.get_db_connection"), mock.patch("trip_manager.release_db_connection"), \
+                mock.patch("trip_manager.load_day_types", side_effect=reload_mid_query), \
+                mock.patch("trip_manager.ServiceTimetable.from_cursor", return_value=loaded) as from_cursor:
+            self.assertIs(self.trip_manager.load_service_timetable(service_date), loaded)
+        self.assertNotIn(service_date, self.trip_manager.service_timetables)
+        self.assertIsNone(self.trip_manager.day_types)
+        self.assertIsNot(from_cursor.call_args[0][1], self.trip_manager.network)
+
+
+class TestNetworkReloader(unittest.TestCase):
+
+    def check(self, stored, current):
+        trip_manager = mock.Mock()
+        trip_manager.network.fingerprint = stored
+        reloader = NetworkReloader(trip_manager, listen=False)
+        with mock.patch("network_reloader.get_db_connection"), mock.patch("network_reloader.release_db_connection"), \
+                mock.patch("network_reloader.network_fingerprint", return_value=current):
+            reloaded = reloader.check()
+        return reloaded, trip_manager.reload_network.call_count, reloader
+
+    def test_reloads_only_when_tables_changed(self):
+        self.assertEqual(self.check("abc", "abc")[:2], (False, 0))
+        reloaded, calls, reloader = self.check("abc", "def")
+        self.assertEqual((reloaded, calls, reloader.reloads), (True, 1, 1))
+
+    def test_database_errors_keep_current_network(self):
+        trip_manager = mock.Mock()
+        reloader = NetworkReloader(trip_manager, listen=False)
+        with mock.patch("network_reloader.get_db_connection", side_effect=RuntimeError("db down")):
+            self.assertFalse(reloader.check())
+        self.assertEqual((reloader.failures, trip_manager.reload_network.call_count), (1, 0))
+
+    def test_stop_wakes_a_waiting_listener(self):
+        reloader = NetworkReloader(mock.Mock(), interval=60)
+        idle, _ = socket.socketpair()
+        with mock.patch.object(reloader, "_connect_listener", return_value=idle), mock.patch.object(reloader, "check"):
+            reloader.start()
+            time.sleep(0.05)
+            started = time.monotonic()
+            reloader.stop()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIsNone(reloader._thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
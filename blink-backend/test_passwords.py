@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+import bcrypt
+from fastapi import HTTPException
+from passwords import PasswordHasher, hash_rounds
+
+
+def make_hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def test_hash_rounds(self):
+        self.assertEqual(hash_rounds(make_hash("pw", 5)), 5)
+        self.assertIsNone(hash_rounds("not-a-hash"))
+
+    def test_verify(self):
+        hasher = PasswordHasher(max_concurrency=2, target_rounds=4)
+        stored = make_hash("secret", 4)
+        self.assertTrue(asyncio.run(hasher.verify("secret", stored)))
+        self.assertFalse(asyncio.run(hasher.verify("wrong", stored)))
+        self.assertEqual(hasher.metrics()["completed"], 2)
+
+    def test_verify_and_upgrade_rehashes_expensive_hashes(self):
+        hasher = PasswordHasher(max_concurrency=1, target_rounds=4)
+        valid, new_hash = asyncio.run(hasher.verify_and_upgrade("secret", make_hash("secret", 6)))
+        self.assertTrue(valid)
+        self.assertEqual(hash_rounds(new_hash), 4)
+        self.assertTrue(bcrypt.checkpw(b"secret", new_hash.encode('utf-8')))
+        self.assertEqual(asyncio.run(hasher.verify_and_upgrade("secret", new_hash)), (True, None))
+        self.assertEqual(asyncio.run(hasher.verify_and_upgrade("wrong", new_hash)), (False, None))
+
+    def test_concurrency_is_bounded(self):
+        hasher = PasswordHasher(max_concurrency=2, max_queue=100, target_rounds=4)
+        stored = make_hash("secret", 4)
+        peak = []
+
+        async def run():
+            async def watch():
+                while hasher.completed < 6:
+                    peak.append(hasher.in_flight)
+                    await asyncio.sleep(0)
+            await asyncio.gather(watch(), *(hasher.verify("secret", stored) for _ in range(6)))
+        asyncio.run(run())
+        self.assertLessEqual(max(peak), 2)
+
+    def test_rejects_when_queue_is_full(self):
+        hasher = PasswordHasher(max_concurrency=1, max_queue=1, target_rounds=4)
+        stored = make_hash("secret", 4)
+
+        async def run():
+            return await asyncio.gather(*(hasher.verify("secret", stored) for _ in range(4)), return_exceptions=True)
+        results = asyncio.run(run())
+        rejected = [r for r in results if isinstance(r, HTTPException)]
+        self.assertTrue(rejected)
+        self.assertEqual(rejected[0].status_code, 503)
+        self.assertEqual(hasher.metrics()["rejected"], len(rejected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import threading
+import unittest
+from profiler import QueryBudgetExceeded, assert_max_queries, normalize_sql, profile_queries, record_query
+
+
+def load_station(station_id):
+    record_query(f"SELECT * FROM stations WHERE station_id = '{station_id}'", 0.001, 1)
+
+
+def load_stations(station_ids):
+    for station_id in station_ids:
+        load_station(station_id)
+
+
+class TestQueryProfiler(unittest.TestCase):
+
+    def test_normalize_sql(self):
+        self.assertEqual(normalize_sql("SELECT *\n  FROM trips WHERE user_id = %s AND trip_id > 42"),
+                         "SELECT * FROM trips WHERE user_id = ? AND trip_id > ?")
+        self.assertEqual(normalize_sql(b"INSERT INTO fares (trip_id, fare) VALUES (1,7000),(2,8000),(3, 9000)"),
+                         "INSERT INTO fares (trip_id, fare) VALUES (?, ...), ...")
+        self.assertEqual(normalize_sql("SELECT 1 FROM lines WHERE line_name = 'Line 1' OR line_id IN ($1, $2)"),
+                         "SELECT ? FROM lines WHERE line_name = ? OR line_id IN (?, ...)")
+
+    def test_groups_by_call_site_and_statement(self):
+        with profile_queries("stations") as profile:
+            load_stations(["A1", "A2", "A3"])
+            record_query("SELECT 1", 0.002, 1)
+        self.assertEqual(profile.queries, 4)
+        statements = profile.by_statement()
+        self.assertEqual(statements["SELECT * FROM stations WHERE station_id = ?"].count, 3)
+        sites = profile.by_call_site()
+        self.assertEqual(len(sites), 2)
+        self.assertTrue(any("(load_station)" in site for site in sites))
+        repeated = profile.repeated(threshold=3)
+        self.assertEqual([(statement, stats.count) for _, statement, stats in repeated],
+                         [("SELECT * FROM stations WHERE station_id = ?", 3)])
+        self.assertIn("repeated 3x", profile.report(threshold=3))
+
+    def test_only_profiles_its_own_context(self):
+        record_query("SELECT 1", 0.001, 1)
+        with profile_queries() as profile:
+            worker = threading.Thread(target=load_station, args=("A1",))
+            worker.start()
+            worker.join()
+        self.assertEqual(profile.queries, 0)
+        with profile_queries(all_threads=True) as profile:
+            worker = threading.Thread(target=load_station, args=("A1",))
+            worker.start()
+            worker.join()
+            load_station("A2")
+        self.assertEqual(profile.queries, 2)
+
+    def test_query_budget(self):
+        with assert_max_queries(3):
+            load_stations(["A1", "A2", "A3"])
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with assert_max_queries(2, "load_stations"):
+                load_stations(["A1", "A2", "A3"])
+        self.assertIn("load_stations ran 3 queries, budget is 2", str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import io
+import unittest
+from datetime import date, time
+from schedule_builder import apply_adjustments, is_dated_before, is_dated_in_window, pattern_departures, plan_slices, slice_fingerprint, stop_offsets, write_copy_rows
+
+STOPS = [
+    ("S101MD", "S102STAP", 30, 4),
+    ("S102STAP", "S103SHTP", 30, None),
+    ("S103SHTP", None, 30, None),
+]
+RULES = [(time(6, 0), time(6, 30), 10), (time(23, 50), time(23, 59), 15)]
+
+
+class TestScheduleBuilder(unittest.TestCase):
+
+    def test_stop_offsets_accumulate_dwell_and_travel(self):
+        # 30s dwell + 4 min, then 30s dwell + default 5 min
+        self.assertEqual(stop_offsets(STOPS).tolist(), [0, 270, 600])
+
+    def test_pattern_departures_matrix(self):
+        departures = pattern_departures(STOPS, RULES)
+        self.assertEqual(departures.shape, (4, 3))
+        self.assertEqual(departures[:, 0].tolist(), [21600, 22200, 22800, 85800])
+        self.assertEqual(departures[1].tolist(), [22200, 22470, 22800])
+
+    def test_departures_wrap_past_midnight(self):
+        departures = pattern_departures(STOPS, RULES)
+        self.assertEqual(departures[3, 2], (85800 + 600) % 86400)
+
+    def test_write_copy_rows(self):
+        buffer = io.StringIO()
+        rows = write_copy_rows(buffer, 1, "Weekday", STOPS, pattern_departures(STOPS, RULES[:1]))
+        lines = buffer.getvalue().splitlines()
+        self.assertEqual(rows, 9)
+        self.assertEqual(lines[0], "1\tS101MD\t06:00:00\tWeekday\tS102STAP")
+        self.assertEqual(lines[-1], "1\tS103SHTP\t06:30:00\tWeekday\t\\N")
+
+    def test_apply_adjustments_overrides_window(self):
+        rules = [(time(6, 0), time(9, 0), 10), (time(9, 0), time(17, 0), 15)]
+        adjustments = [(time(8, 0), time(10, 0), 5)]
+        self.assertEqual(apply_adjustments(rules, adjustments), [
+            (time(6, 0), time(8, 0), 10),
+            (time(8, 0), time(10, 0), 5),
+            (time(10, 0), time(17, 0), 15),
+        ])
+
+    def test_apply_adjustments_splits_rule(self):
+        rules = [(time(6, 0), time(23, 0), 10)]
+        adjustments = [(time(12, 0), time(13, 0), 30)]
+        self.assertEqual([rule[:2] for rule in apply_adjustments(rules, adjustments)], [
+            (time(6, 0), time(12, 0)), (time(12, 0), time(13, 0)), (time(13, 0), time(23, 0)),
+        ])
+
+    def test_plan_slices_gives_adjusted_lines_a_dated_day_type(self):
+        calendar = {date(2025, 3, 18): (1, "Weekday"), date(2025, 3, 19): (1, "Weekday")}
+        patterns = {1: (1, STOPS), 2: (2, STOPS)}
+        rules = {(1, 1, 1): RULES[:1], (1, 2, 2): RULES[:1]}
+        adjustments = {(date(2025, 3, 19), 1, 1): [(time(6, 0), time(6, 30), 5)]}
+        slices = plan_slices(calendar, patterns, rules, adjustments)
+        self.assertEqual(set(slices), {
+            ("Weekday", 1, 1), ("Weekday", 2, 2), ("Weekday@2025-03-19", 1, 1),
+        })
+        self.assertEqual(slices[("Weekday@2025-03-19", 1, 1)], [(time(6, 0), time(6, 30), 5)])
+        self.assertEqual(slices[("Weekday", 1, 1)], RULES[:1])
+
+    def test_fingerprint_tracks_rule_changes(self):
+        self.assertEqual(slice_fingerprint(STOPS, RULES), slice_fingerprint(STOPS, list(RULES)))
+        self.assertNotEqual(slice_fingerprint(STOPS, RULES), slice_fingerprint(STOPS, RULES[:1]))
+
+    def test_is_dated_in_window(self):
+        self.assertTrue(is_dated_in_window("Weekday@2025-03-19", date(2025, 3, 18), date(2025, 3, 25)))
+        self.assertFalse(is_dated_in_window("Weekday@2025-03-25", date(2025, 3, 18), date(2025, 3, 25)))
+        self.assertFalse(is_dated_in_window("Weekday", date(2025, 3, 18), date(2025, 3, 25)))
+
+    def test_is_dated_before(self):
+        self.assertTrue(is_dated_before("Weekday@2025-03-17", date(2025, 3, 18)))
+        self.assertFalse(is_dated_before("Weekday@2025-03-18", date(2025, 3, 18)))
+        self.assertFalse(is_dated_before("Weekday", date(2025, 3, 18)))
+
+
+if __name__ == '__main__':
+    unittest.main()
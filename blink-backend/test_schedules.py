@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+from datetime import date, datetime, time
+from db import create_session
+from test_network import build_sample_snapshot
+from timetable import line_timetable_patterns
+from trip_manager import SCHEDULE_CACHE, TripManager
+
+SERVICE_DATE = date(2025, 3, 18)
+ROWS = [
+    (time(6), time(23), time(6, 0), "Weekday"),
+    (time(6), time(23), time(6, 15), "Weekday"),
+    (time(6), time(23), time(21, 45), "Weekday"),
+]
+
+
+class TestScheduleCache(unittest.TestCase):
+
+    def setUp(self):
+        SCHEDULE_CACHE.clear()
+        self.trip_manager = TripManager(build_sample_snapshot())
+        self.trip_manager.day_types = {SERVICE_DATE: "Weekday"}
+        self.session_token = create_session(role="user")
+        self.conn = mock.Mock()
+        self.conn.cursor.return_value.fetchall.return_value = ROWS
+        patches = [mock.patch("trip_manager.get_db_connection", return_value=self.conn),
+                   mock.patch("trip_manager.release_db_connection")]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def queries(self):
+        return self.conn.cursor.return_value.execute.call_count
+
+    def test_timetable_and_schedules_share_one_query(self):
+        self.assertEqual(self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 10)), ["06:15", "21:45"])
+        self.assertEqual(self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 15)), ["06:15", "21:45"])
+        self.assertEqual(self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 23, 5)), ["Station closed!"])
+        schedules = self.trip_manager.get_schedules(self.session_token, "Line 1", "Alpha", SERVICE_DATE)
+        self.assertEqual(schedules["day_type"], "Weekday")
+        self.assertEqual(schedules["schedules"][0], {"departure_time": "06:00", "day_type": "Weekday"})
+        self.assertEqual(self.queries(), 1)
+        params = self.conn.cursor.return_value.execute.call_args[0][1]
+        self.assertEqual((params["station_id"], params["day_type"], params["adjusted"]), ("A1", "Weekday", "Weekday@2025-03-18"))
+
+    def test_regeneration_invalidates(self):
+        self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 10))
+        self.trip_manager.invalidate_schedule_cache()
+        self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 10))
+        self.assertEqual(self.queries(), 2)
+
+    def test_fetch_overlapping_invalidation_is_not_cached(self):
+        # Schedules regenerated while the query runs: its rows may be stale.
+        self.conn.cursor.return_value.execute.side_effect = lambda *args: self.trip_manager.invalidate_schedule_cache()
+        self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 10))
+        self.assertEqual(len(SCHEDULE_CACHE), 0)
+        self.conn.cursor.return_value.execute.side_effect = None
+        self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 10))
+        self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 18, 6, 10))
+        self.assertEqual(self.queries(), 2)
+
+    def test_days_without_service(self):
+        self.assertEqual(self.trip_manager.get_timetable("Line 1", "Alpha", datetime(2025, 3, 19, 8)), [])
+        self.assertEqual(self.trip_manager.get_timetable("Line 1", "Nowhere", datetime(2025, 3, 18, 8)), [])
+        self.assertEqual(self.queries(), 0)
+        with self.assertRaises(Exception):
+            self.trip_manager.get_schedules(self.session_token, "Line 1", "Alpha", date(2025, 3, 19))
+
+
+class TestLineTimetable(unittest.TestCase):
+
+    def test_reshapes_trips_and_unwraps_midnight(self):
+        rows = ([(1, "Northbound", 1, "A1", t) for t in (21600, 22500, 86000)]
+                + [(1, "Northbound", 2, "A2", t) for t in (200, 22200, 23100)]
+                + [(1, "Northbound", 3, "A3", t) for t in (500, 22500, 23400)])
+        [pattern] = line_timetable_patterns(rows)
+        self.assertEqual(pattern["stations"], ["A1", "A2", "A3"])
+        self.assertEqual(pattern["starts"], [21600, 22500, 86000])
+        self.assertEqual(pattern["offsets"], [[0, 600, 900]] * 3)
+
+    def test_shared_hops_fall_back_to_stop_lists(self):
+        rows = [(1, "Short", 1, "A2", 100), (1, "Short", 1, "A2", 200), (1, "Short", 2, "A3", 400),
+                (2, "Full", 1, "A1", 50), (2, "Full", 2, "A2", 250)]
+        short, full = line_timetable_patterns(rows)
+        self.assertEqual(short["departures"], [[100, 200], [400]])
+        self.assertNotIn("offsets", short)
+        self.assertEqual((full["starts"], full["offsets"]), ([50], [[0, 200]]))
+
+    def test_one_cached_query_per_line_and_day(self):
+        trip_manager = TripManager(build_sample_snapshot())
+        trip_manager.day_types = {SERVICE_DATE: "Weekday"}
+        SCHEDULE_CACHE.clear()
+        conn = mock.Mock()
+        conn.cursor.return_value.fetchall.return_value = [(1, "Eastbound", 1, "A1", 21600), (1, "Eastbound", 2, "A2", 21960)]
+        with mock.patch("trip_manager.get_db_connection", return_value=conn), mock.patch("trip_manager.release_db_connection"):
+            timetable = trip_manager.get_line_timetable("Line 1", service_date=SERVICE_DATE)
+            self.assertIs(trip_manager.get_line_timetable("Line 1", service_date=SERVICE_DATE), timetable)
+            with self.assertRaises(ValueError):
+                trip_manager.get_line_timetable("Line 9", "Weekday")
+        self.assertEqual(conn.cursor.return_value.execute.call_count, 1)
+        self.assertEqual(timetable["station_names"], {"A1": "Alpha", "A2": "Bravo"})
+        self.assertEqual(timetable["patterns"][0]["offsets"], [[0, 360]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import fnmatch
+import unittest
+from unittest import mock
+from fastapi import HTTPException
+from cache import TTLCache
+from db import BlockingConnectionPool, create_session, get_db_connection, validate_session
+from metrics import POOL_EXHAUSTED
+from sessions import InMemorySessionStore, RedisSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LocalRedis:
+    """Dict-backed stand-in for the handful of Redis commands the store uses."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def setex(self, key, ttl, value):
+        self.data[key] = (value.encode("utf-8"), self.clock() + ttl)
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None or entry[1] <= self.clock():
+            return None
+        return entry[0]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key.encode("utf-8") for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_expiry_and_lru_eviction(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)  # evicts "b", the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.evictions, 1)
+        clock.now = 11
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.items(), [])
+        self.assertEqual(cache.purge(), 1)
+
+
+class TestSessionStores(unittest.TestCase):
+
+    def check_store(self, store, clock):
+        token = store.create("user", user_id=7)
+        self.assertEqual(store.get(token), {"role": "user", "user_id": 7})
+        self.assertEqual([t for t, _ in store.items()], [token])
+        store.revoke(token)
+        self.assertIsNone(store.get(token))
+        token = store.create("admin")
+        clock.now += 61
+        self.assertIsNone(store.get(token))
+
+    def test_in_memory_store(self):
+        clock = FakeClock()
+        self.check_store(InMemorySessionStore(ttl=60, maxsize=10, clock=clock), clock)
+
+    def test_in_memory_store_is_bounded(self):
+        store = InMemorySessionStore(ttl=60, maxsize=3)
+        tokens = [store.create("user") for _ in range(5)]
+        self.assertEqual(len(store), 3)
+        self.assertIsNone(store.get(tokens[0]))
+
+    def test_shared_store(self):
+        clock = FakeClock()
+        client = LocalRedis(clock)
+        self.check_store(RedisSessionStore(client, ttl=60), clock)
+        token = RedisSessionStore(client, ttl=60).create("user")
+        self.assertEqual(RedisSessionStore(client, ttl=60).get(token), {"role": "user", "user_id": None})
+
+
+class TestInternalCredential(unittest.TestCase):
+
+    def test_internal_callers_skip_sessions(self):
+        pool = mock.Mock()
+        with mock.patch("db.get_db_pool", return_value=pool):
+            self.assertIs(get_db_connection(internal=True), pool.getconn.return_value)
+            with self.assertRaises(HTTPException):
+                get_db_connection("bogus")
+
+    def test_user_sessions_still_checked(self):
+        token = create_session(role="user")
+        self.assertTrue(validate_session(token))
+        self.assertFalse(validate_session(token, required_role="admin"))
+        self.assertFalse(validate_session("bogus"))
+        self.assertFalse(validate_session(None))
+
+
+
+class TestBlockingPool(unittest.TestCase):
+
+    def test_exhausted_pool_waits_then_answers_503(self):
+        with mock.patch("psycopg2.connect", side_effect=lambda *args, **kwargs: mock.Mock(closed=True)):
+            pool = BlockingConnectionPool(0, 1, timeout=0.05)
+            with mock.patch("db.get_db_pool", return_value=pool):
+                conn = get_db_connection(internal=True)
+                exhausted = POOL_EXHAUSTED.value(pool="sync")
+                with self.assertRaises(HTTPException) as raised:
+                    get_db_connection(internal=True)
+                self.assertEqual(raised.exception.status_code, 503)
+                self.assertEqual(POOL_EXHAUSTED.value(pool="sync"), exhausted + 1)
+                pool.putconn(conn)
+                self.assertIsNotNone(get_db_connection(internal=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from datetime import datetime
+from sim_engine import FastClock, RealTimeClock, SimulationEngine, TrainState
+from test_network import build_sample_snapshot
+from test_timetable import ROWS, SERVICE_DATE
+from timetable import ServiceTimetable
+from trip_manager import TripManager
+
+
+class TestSimulationEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.trip_manager = TripManager(snapshot=build_sample_snapshot())
+        self.trip_manager.service_timetables.set(SERVICE_DATE, ServiceTimetable(
+            self.trip_manager.network, SERVICE_DATE, "Weekday", ROWS))
+        self.engine = SimulationEngine(self.trip_manager, [TrainState("T1", 1, 1, "A1", "A2")], FastClock())
+        self.transitions = []
+        self.engine.subscribe(lambda train, at: self.transitions.append((at.strftime("%H:%M"), train.status, train.current_station_id, train.next_station_id)))
+
+    def test_train_follows_timetable_and_turns_back(self):
+        self.engine.start(datetime(2025, 3, 18, 5, 55))
+        self.engine.run(until=datetime(2025, 3, 18, 7, 0))
+        self.assertEqual(self.transitions, [
+            ("06:00", "in_transit", "A1", "A2"),
+            ("06:03", "at_station", "A2", "A3"),
+            ("06:04", "in_transit", "A2", "A3"),
+            ("06:08", "at_station", "A3", "A2"),
+        ])
+        train = self.engine.trains["T1"]
+        self.assertEqual((train.current_route_id, train.status), (4, "at_station"))
+        # No more Charlie -> Bravo departures today, so the train waits for the next service day.
+        self.assertEqual(self.engine._events[0][2], "wake")
+
+    def test_run_stops_at_until(self):
+        self.engine.start(datetime(2025, 3, 18, 5, 55))
+        self.engine.run(until=datetime(2025, 3, 18, 6, 3))
+        self.assertEqual(len(self.transitions), 2)
+        self.assertEqual(self.engine.now, datetime(2025, 3, 18, 6, 3))
+
+
+class TestRealTimeClock(unittest.TestCase):
+
+    def test_paces_and_reports_lag(self):
+        wall = [100.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            wall[0] += seconds
+        clock = RealTimeClock(speed=60, sleep=sleep, monotonic=lambda: wall[0])
+        clock.start(datetime(2025, 3, 18, 5, 55))
+        # The first event waits for its offset from the start, not just for the events after it.
+        self.assertEqual(clock.wait_until(datetime(2025, 3, 18, 6, 0)), 0.0)
+        self.assertEqual(clock.wait_until(datetime(2025, 3, 18, 6, 2)), 0.0)
+        self.assertEqual(slept, [5.0, 2.0])
+        wall[0] += 5
+        self.assertEqual(clock.wait_until(datetime(2025, 3, 18, 6, 3)), 4.0)
+
+    def test_engine_anchors_clock_at_start(self):
+        wall = [0.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            wall[0] += seconds
+        trip_manager = TripManager(snapshot=build_sample_snapshot())
+        trip_manager.service_timetables.set(SERVICE_DATE, ServiceTimetable(trip_manager.network, SERVICE_DATE, "Weekday", ROWS))
+        engine = SimulationEngine(trip_manager, [TrainState("T1", 1, 1, "A1", "A2")],
+                                  RealTimeClock(speed=60, sleep=sleep, monotonic=lambda: wall[0]))
+        engine.start(datetime(2025, 3, 18, 5, 55))
+        engine.run(until=datetime(2025, 3, 18, 6, 0))
+        self.assertEqual(slept, [5.0])
+
+if __name__ == '__main__':
+    unittest.main()
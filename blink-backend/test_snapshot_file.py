@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from datetime import date, datetime
+import numpy as np
+from network import ARRAY_FIELDS
+from snapshot_file import read_snapshot, write_snapshot
+from synthetic import SyntheticNetwork
+from trip_manager import TripManager
+
+SERVICE_DATE = date(2025, 3, 18)
+
+
+class TestSnapshotFile(unittest.TestCase):
+
+    def setUp(self):
+        self.synthetic = SyntheticNetwork(40)
+        self.network = self.synthetic.snapshot()
+        self.timetable = self.synthetic.timetable(self.network, SERVICE_DATE)
+        handle, self.path = tempfile.mkstemp(suffix=".snapshot")
+        os.close(handle)
+        write_snapshot(self.path, self.network, [self.timetable])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        network, timetables = read_snapshot(self.path)
+        for name in ARRAY_FIELDS:
+            np.testing.assert_array_equal(getattr(network, name), getattr(self.network, name))
+        self.assertFalse(network.indices.flags.writeable)
+        self.assertEqual(network.station_graph(), self.network.station_graph())
+        self.assertEqual(network.routes_by_origin(), self.network.routes_by_origin())
+        timetable = timetables[SERVICE_DATE]
+        self.assertEqual(timetable.day_type, "Weekday")
+        self.assertEqual({key: list(times) for key, times in timetable.departures.items()}, self.timetable.departures)
+        np.testing.assert_array_equal(timetable.dep, self.timetable.dep)
+        # The scan reads the mapped arrays themselves, not per-process copies.
+        self.assertIsInstance(timetable._scan[0], memoryview)
+        self.assertTrue(np.shares_memory(np.asarray(timetable._scan[0]), timetable.dep))
+        sources, targets = network.nodes_for_station("S0"), set(network.nodes_for_station("S39"))
+        self.assertEqual(timetable.earliest_arrival(sources, targets, 8 * 3600)[:2],
+                         self.timetable.earliest_arrival(sources, targets, 8 * 3600)[:2])
+        # Small enough for route matrices: those are stored and mapped, no hierarchy is.
+        self.assertEqual(network._contractions, {})
+        for is_peak in (True, False):
+            stored = network._route_matrices[is_peak]
+            self.assertFalse(stored.dist.flags.writeable)
+            np.testing.assert_array_equal(stored.next_hop, self.network.route_matrix(is_peak).next_hop)
+
+    def test_large_networks_store_contraction_hierarchies(self):
+        with mock.patch("network.ALL_PAIRS_MAX_NODES", 0):
+            write_snapshot(self.path, self.network, [self.timetable])
+        network, _ = read_snapshot(self.path)
+        sources, targets = network.nodes_for_station("S0"), network.nodes_for_station("S39")
+        for is_peak in (True, False):
+            stored = network._contractions[is_peak]
+            self.assertTrue(np.shares_memory(np.asarray(stored.up[1]), stored.arrays["up_indices"]))
+            self.assertEqual(stored.route(sources, targets), self.network.contraction(is_peak).route(sources, targets))
+
+    def test_trip_manager_starts_from_file_without_database(self):
+        with mock.patch("network.RouteMatrix.build", side_effect=AssertionError("route matrix rebuilt")):
+            trip_manager = TripManager(snapshot_path=self.path)
+        self.assertEqual(trip_manager.find_shortest_path("Stop 0", "Stop 39", datetime(2025, 3, 18, 12))[1],
+                         TripManager(self.network).find_shortest_path("Stop 0", "Stop 39", datetime(2025, 3, 18, 12))[1])
+        self.assertIsNotNone(trip_manager.get_next_departure("Line 1", "Stop 0", "Stop 1", datetime(2025, 3, 18, 8)))
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot at all")
+        with self.assertRaises(ValueError):
+            read_snapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
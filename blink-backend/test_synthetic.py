@@ -0,0 +1,43 @@
+import unittest
+from datetime import date
+from benchmarks import benchmark_size, compare
+from synthetic import SyntheticNetwork
+
+
+class TestSyntheticNetwork(unittest.TestCase):
+
+    def test_network_is_connected_and_deterministic(self):
+        synthetic = SyntheticNetwork(70)
+        snapshot = synthetic.snapshot()
+        self.assertEqual(len(snapshot.station_ids), 70)
+        self.assertGreater(len(synthetic.transfer_stations), 0)
+        matrix = snapshot.route_matrix(False)
+        origin = snapshot.nodes_for_station("S0")
+        for station_id, _ in synthetic.stations:
+            self.assertIsNotNone(matrix.best_pair(origin, snapshot.nodes_for_station(station_id)))
+        self.assertEqual(SyntheticNetwork(70).routes, synthetic.routes)
+
+    def test_timetable_covers_every_pattern(self):
+        synthetic = SyntheticNetwork(30)
+        snapshot = synthetic.snapshot()
+        weekday = synthetic.timetable(snapshot, date(2025, 3, 18))
+        self.assertEqual(weekday.day_type, "Weekday")
+        self.assertEqual(len(weekday.departures), len(synthetic.routes))
+        self.assertEqual(synthetic.calendar(date(2025, 3, 22), 2)[date(2025, 3, 22)], (2, "Weekend"))
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_small_run_and_compare(self):
+        results = benchmark_size(12, repeat=1, queries=5)
+        names = {result["benchmark"] for result in results}
+        self.assertTrue({"find_shortest_path", "build_weighted_graph", "generate_weekly_schedule",
+                         "get_next_departure", "longest_route_no_repeats"} <= names)
+        baseline = {"results": [dict(result, median_ms=result["median_ms"] / 2) for result in results if "median_ms" in result]}
+        lines, regressions = compare({"results": results}, baseline, threshold=0.2)
+        self.assertEqual(len(lines), len(baseline["results"]))
+        self.assertEqual(len(regressions), len(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+from datetime import date, datetime, time
+from test_network import build_sample_snapshot
+from timetable import ServiceTimetable
+from trip_manager import TripManager
+
+SERVICE_DATE = date(2025, 3, 18)
+ROWS = [
+    # Line 1 Alpha -> Bravo -> Charlie every 10 minutes from 06:00
+    (1, "A1", "A2", time(6, 0), 3), (1, "A2", "A3", time(6, 4), 4),
+    (1, "A1", "A2", time(6, 10), 3), (1, "A2", "A3", time(6, 14), 4),
+    # Line 2 Delta -> Bravo -> Echo
+    (2, "B1", "A2", time(6, 0), 5), (2, "A2", "B3", time(6, 6), 2),
+    (2, "B1", "A2", time(6, 15), 5), (2, "A2", "B3", time(6, 21), 2),
+]
+
+
+class TestServiceTimetable(unittest.TestCase):
+
+    def setUp(self):
+        self.trip_manager = TripManager(snapshot=build_sample_snapshot())
+        self.trip_manager.service_timetables.set(SERVICE_DATE, ServiceTimetable(
+            self.trip_manager.network, SERVICE_DATE, "Weekday", ROWS))
+
+    def test_connections_sorted_by_departure(self):
+        timetable = self.trip_manager.service_timetables.get(SERVICE_DATE)
+        self.assertEqual(list(timetable.dep), sorted(timetable.dep))
+        self.assertEqual(len(timetable.dep), len(ROWS))
+
+    def test_fastest_path_same_line(self):
+        path, minutes = self.trip_manager.find_fastest_path("Alpha", "Charlie", datetime(2025, 3, 18, 6, 2))
+        self.assertEqual(path, ["Alpha", "Bravo", "Charlie"])
+        self.assertEqual(minutes, 16)
+
+    def test_fastest_path_waits_for_connecting_train(self):
+        # Arrive at Bravo 06:03, off-peak transfer 1 min, next Line 2 departure 06:06.
+        path, minutes = self.trip_manager.find_fastest_path("Alpha", "Echo", datetime(2025, 3, 18, 6, 0))
+        self.assertEqual(path, ["Alpha", "Bravo", "Bravo", "Echo"])
+        self.assertEqual(minutes, 8)
+
+    def test_missed_connection_uses_next_departure(self):
+        path, minutes = self.trip_manager.find_fastest_path("Alpha", "Echo", datetime(2025, 3, 18, 6, 5))
+        self.assertEqual(path, ["Alpha", "Bravo", "Bravo", "Echo"])
+        self.assertEqual(minutes, 18)
+
+    def test_get_next_departure_bisects_index(self):
+        self.assertEqual(self.trip_manager.get_next_departure("Line 1", "Alpha", "Bravo", datetime(2025, 3, 18, 6, 0)),
+                         datetime(2025, 3, 18, 6, 0))
+        self.assertEqual(self.trip_manager.get_next_departure("Line 1", "Alpha", "Bravo", datetime(2025, 3, 18, 6, 0, 0, 1)),
+                         datetime(2025, 3, 18, 6, 10))
+        self.assertIsNone(self.trip_manager.get_next_departure("Line 1", "Alpha", "Bravo", datetime(2025, 3, 18, 6, 11)))
+        self.assertIsNone(self.trip_manager.get_next_departure("Line 2", "Alpha", "Bravo", datetime(2025, 3, 18, 6, 0)))
+
+    def test_no_more_departures(self):
+        self.assertEqual(self.trip_manager.find_fastest_path("Alpha", "Echo", datetime(2025, 3, 18, 23, 0)), (None, 0))
+
+    def test_service_days_cached_across_alternating_requests(self):
+        days = [date(2025, 3, 20), date(2025, 3, 24), date(2025, 3, 20), date(2025, 3, 24), date(2025, 3, 23)]
+        with mock.patch("trip_manager.get_db_connection"), mock.patch("trip_manager.release_db_connection"), \
+                mock.patch("trip_manager.load_day_types", return_value={d: "Weekday" for d in days[:2]}), \
+                mock.patch("trip_manager.ServiceTimetable.from_cursor") as from_cursor:
+            for day in days + days:
+                self.trip_manager.load_service_timetable(day)
+        # One fetch per weekday; the day without a template is remembered as None.
+        self.assertEqual(from_cursor.call_count, 2)
+        self.assertIsNone(self.trip_manager.service_timetables.get(date(2025, 3, 23), "missing"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from datetime import datetime, timedelta
 from trip_manager import TripManager
 from db import create_session
+from profiler import assert_max_queries
 
 class TestTripManager(unittest.TestCase):
 
@@ -52,5 +53,15 @@ class TestTripManager(unittest.TestCase):
             self.trip_manager.get_schedules(self.session_token, line_name, station_name)
         self.assertIn(f"Error retrieving schedules: ", str(context.exception))
 
+    def test_query_budgets(self):
+        """Startup loads the network in a fixed number of queries; routing needs none."""
+        with assert_max_queries(6, "TripManager()"):
+            trip_manager = TripManager()
+        with assert_max_queries(0, "build_weighted_graph"):
+            trip_manager.build_weighted_graph(datetime.now())
+            trip_manager.find_shortest_path("Ben Thanh", "Suoi Tien Amusement Park")
+        with assert_max_queries(1, "get_schedules"):
+            trip_manager.get_schedules(self.session_token, "Line 1", "Ben Thanh")
+
 if __name__ == '__main__':
     unittest.main()
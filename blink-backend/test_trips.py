@@ -0,0 +1,81 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from fastapi import HTTPException
+from trip_manager import decode_trip_cursor, encode_trip_cursor, to_pyformat, trip_record, trips_json, trips_query
+
+
+class TestTripPagination(unittest.TestCase):
+
+    def test_cursor_round_trip(self):
+        trip = trip_record((42, "A1", "A3", datetime(2025, 3, 18, 8, 5), None, Decimal("12.50"), "commute"))
+        self.assertEqual(trip["start_time"], "2025-03-18T08:05:00")
+        self.assertEqual(trip["fare"], 12.5)
+        self.assertEqual(decode_trip_cursor(encode_trip_cursor(trip)), (datetime(2025, 3, 18, 8, 5), 42))
+        self.assertEqual(decode_trip_cursor(encode_trip_cursor({"start_time": None, "trip_id": 7})), (None, 7))
+
+    def test_malformed_cursor(self):
+        for cursor in ("not-base64!", "bnVsbA==", encode_trip_cursor({"start_time": "yesterday", "trip_id": 1})):
+            with self.assertRaises(ValueError):
+                decode_trip_cursor(cursor)
+
+    def test_first_page_scans_the_user_index(self):
+        sql, args = trips_query(5, limit=20)
+        self.assertIn("WHERE user_id = $1", sql)
+        self.assertIn("ORDER BY start_time DESC, trip_id DESC LIMIT $2", sql)
+        self.assertEqual(args, [5, 20])
+
+    def test_keyset_positions(self):
+        started = datetime(2025, 3, 18, 8, 5)
+        sql, args = trips_query(5, after=(started, 42))
+        self.assertIn("start_time < $2 OR (start_time = $2 AND trip_id < $3)", sql)
+        self.assertNotIn("LIMIT", sql)
+        self.assertEqual(args, [5, started, 42])
+        sql, args = trips_query(5, after=(None, 42), limit=10)
+        self.assertIn("start_time IS NOT NULL OR trip_id < $2", sql)
+        self.assertEqual(args, [5, 42, 10])
+
+    def test_pyformat_repeats_reused_arguments(self):
+        started = datetime(2025, 3, 18, 8, 5)
+        sql, args = to_pyformat(*trips_query(5, after=(started, 42), limit=10))
+        self.assertNotIn("$", sql)
+        self.assertEqual(sql.count("%s"), 5)
+        self.assertEqual(args, [5, started, started, 42, 10])
+
+
+
+async def trips_then_fail(count, error=None):
+    for trip_id in range(count):
+        yield {"trip_id": trip_id, "start_time": None}
+    if error is not None:
+        raise error
+
+
+async def read_body(trips, limit=None):
+    return "".join([chunk async for chunk in await trips_json(trips, limit)])
+
+
+class TestTripStream(unittest.TestCase):
+
+    def test_pages_end_with_a_cursor(self):
+        body = json.loads(asyncio.run(read_body(trips_then_fail(2), limit=2)))
+        self.assertEqual([trip["trip_id"] for trip in body["trips"]], [0, 1])
+        self.assertEqual(decode_trip_cursor(body["next_cursor"]), (None, 1))
+        self.assertEqual(json.loads(asyncio.run(read_body(trips_then_fail(0)))),
+                         {"trips": [], "next_cursor": None})
+
+    def test_errors_before_the_first_trip_propagate(self):
+        with self.assertRaises(HTTPException):
+            asyncio.run(read_body(trips_then_fail(0, HTTPException(status_code=500, detail="pool exhausted"))))
+
+    def test_errors_mid_stream_end_with_an_error_trailer(self):
+        body = json.loads(asyncio.run(read_body(trips_then_fail(2, HTTPException(status_code=500, detail="connection lost")))))
+        self.assertEqual(len(body["trips"]), 2)
+        self.assertIsNone(body["next_cursor"])
+        self.assertEqual(body["error"], "connection lost")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import unittest
+from datetime import datetime
+from sim_engine import TrainState
+from write_behind import TrainStateWriter
+
+
+class RecordingWriter(TrainStateWriter):
+    """Captures flushed batches instead of writing them to Postgres."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.fail = False
+
+    def _write(self, latest, transitions):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.batches.append((latest, transitions))
+
+
+def move(train, station, status, minute):
+    train.current_station_id = station
+    train.status = status
+    return train, datetime(2025, 3, 18, 6, minute)
+
+
+class TestTrainStateWriter(unittest.TestCase):
+
+    def test_batches_by_size_and_coalesces_latest_state(self):
+        writer = RecordingWriter(max_batch=3, max_delay=3600)
+        train = TrainState("T1", 1, 1, "A1", "A2")
+        writer.record(*move(train, "A1", "in_transit", 0))
+        writer.record(*move(train, "A2", "at_station", 3))
+        self.assertEqual(writer.batches, [])
+        writer.record(*move(train, "A2", "in_transit", 4))
+        self.assertEqual(len(writer.batches), 1)
+        latest, transitions = writer.batches[0]
+        self.assertEqual(len(latest), 1)
+        self.assertEqual(latest[0][5], "in_transit")
+        self.assertEqual([row[5] for row in transitions], ["in_transit", "at_station", "in_transit"])
+
+    def test_sync_durability_flushes_every_transition(self):
+        writer = RecordingWriter(durability="sync")
+        train = TrainState("T1", 1, 1, "A1", "A2")
+        writer.record(*move(train, "A1", "in_transit", 0))
+        writer.record(*move(train, "A2", "at_station", 3))
+        self.assertEqual(len(writer.batches), 2)
+
+    def test_failed_flush_is_retried(self):
+        writer = RecordingWriter(max_batch=100, max_delay=3600)
+        train = TrainState("T1", 1, 1, "A1", "A2")
+        writer.record(*move(train, "A1", "in_transit", 0))
+        writer.fail = True
+        self.assertEqual(writer.flush(), 0)
+        writer.record(*move(train, "A2", "at_station", 3))
+        writer.fail = False
+        self.assertEqual(writer.flush(), 2)
+        latest, transitions = writer.batches[0]
+        self.assertEqual(latest[0][5], "at_station")
+        self.assertEqual(len(transitions), 2)
+
+    def test_outage_backs_off_and_stays_bounded(self):
+        writer = RecordingWriter(max_batch=1, max_delay=60, max_pending=2)
+        writer.fail = True
+        calls = []
+        write = writer._write
+        writer._write = lambda latest, transitions: (calls.append(len(transitions)), write(latest, transitions))
+        train = TrainState("T1", 1, 1, "A1", "A2")
+        for minute in range(5):
+            writer.record(*move(train, "A1", "in_transit", minute))
+        # Only the first record hits the database; the rest wait out the backoff.
+        self.assertEqual(calls, [1])
+        self.assertEqual(writer.pending, 2)
+        self.assertEqual(writer.dropped, 3)
+
+    def test_started_writer_flushes_off_the_caller_thread(self):
+        writer = RecordingWriter(max_batch=1, max_delay=3600)
+        threads = []
+        written = threading.Event()
+        write = writer._write
+        writer._write = lambda latest, transitions: (threads.append(threading.current_thread()), write(latest, transitions), written.set())
+        writer.start()
+        try:
+            writer.record(*move(TrainState("T1", 1, 1, "A1", "A2"), "A1", "in_transit", 0))
+            self.assertTrue(written.wait(5))
+        finally:
+            writer.close()
+        self.assertEqual(writer.rows_written, 1)
+        self.assertNotEqual(threads[0], threading.current_thread())
+
+    def test_close_flushes_remaining(self):
+        writer = RecordingWriter(max_batch=100, max_delay=3600)
+        writer.start()
+        writer.record(*move(TrainState("T1", 1, 1, "A1", "A2"), "A1", "in_transit", 0))
+        writer.close()
+        self.assertEqual(writer.rows_written, 1)
+        self.assertEqual(writer.pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
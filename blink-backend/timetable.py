@@ -0,0 +1,278 @@
+import bisect
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from network import is_peak_time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRAVEL_TIME = 5  # minutes, used when a scheduled hop has no matching route
+CONNECTION_FIELDS = ("dep", "arr", "conn_from", "conn_to")
+
+
+def seconds_since_midnight(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def adjusted_day_type(day_type, service_date):
+    """Day type under which a date's adjusted lines are stored in schedules."""
+    return f"{day_type}@{service_date.isoformat()}"
+
+
+def resolve_day_type(cursor, service_date):
+    """Returns the schedule template name for a date, or None if it has none."""
+    cursor.execute("""
+        SELECT st.template_name
+        FROM annual_calendar ac
+        JOIN schedule_templates st ON ac.template_id = st.template_id
+        WHERE ac.date_id = %s
+    """, (service_date,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def load_day_types(cursor):
+    """Returns the whole annual calendar as {date: template_name}."""
+    cursor.execute("""
+        SELECT ac.date_id, st.template_name
+        FROM annual_calendar ac
+        JOIN schedule_templates st ON ac.template_id = st.template_id
+    """)
+    return dict(cursor.fetchall())
+
+
+def fetch_connections(cursor, day_type, service_date):
+    """Fetches every departure with a next stop for a service date, joined to its travel time.
+
+    Lines whose dated day type has been generated for the date (see
+    schedule_adjustments) use it; every other line uses the template's.
+    """
+    cursor.execute("""
+        SELECT s.line_id, s.station_id, s.next_station_id, s.departure_time, r.travel_time
+        FROM schedules s
+        LEFT JOIN routes r ON r.line_id = s.line_id
+            AND r.from_station_id = s.station_id
+            AND r.to_station_id = s.next_station_id
+        WHERE s.next_station_id IS NOT NULL
+        AND s.day_type = CASE
+            WHEN EXISTS (SELECT 1 FROM schedules d WHERE d.day_type = %(adjusted)s AND d.line_id = s.line_id)
+            THEN %(adjusted)s ELSE %(day_type)s END
+    """, {"day_type": day_type, "adjusted": adjusted_day_type(day_type, service_date)})
+    return cursor.fetchall()
+
+
+def line_timetable_patterns(rows):
+    """Reshapes one line's departures into a trip x station matrix per service pattern.
+
+    rows are (pattern_id, pattern_name, station_sequence, station_id,
+    departure seconds) ordered by pattern, sequence and departure. Each
+    pattern becomes {"pattern_id", "name", "stations", "starts", "offsets"}:
+    starts holds every trip's first-stop departure and offsets[trip][stop]
+    the seconds from it to the departure at each stop. When the stops of a
+    pattern do not all have the same number of departures (another pattern
+    shares a hop), the trips cannot be told apart and the pattern carries
+    per-stop "departures" lists instead.
+    """
+    if not rows:
+        return []
+    pattern_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    sequences = np.array([row[2] for row in rows], dtype=np.int64)
+    seconds = np.array([row[4] for row in rows], dtype=np.int32)
+    pattern_starts = np.flatnonzero(np.r_[True, pattern_ids[1:] != pattern_ids[:-1]])
+    patterns = []
+    for start, end in zip(pattern_starts, np.r_[pattern_starts[1:], len(rows)]):
+        stop_starts = start + np.flatnonzero(np.r_[True, sequences[start + 1:end] != sequences[start:end - 1]])
+        counts = np.diff(np.r_[stop_starts, end])
+        pattern = {
+            "pattern_id": int(pattern_ids[start]),
+            "name": rows[start][1],
+            "stations": [rows[i][3] for i in stop_starts.tolist()],
+        }
+        if (counts == counts[0]).all():
+            trips = int(counts[0])
+            matrix = seconds[start:end].reshape(len(counts), trips).T
+            # Trips running past midnight wrapped to the start of later stops' columns; rotate them back.
+            wrapped = (matrix < matrix[0, 0]).sum(axis=0)
+            matrix = np.take_along_axis(matrix, (np.arange(trips)[:, None] + wrapped[None, :]) % trips, axis=0)
+            pattern["starts"] = matrix[:, 0].tolist()
+            pattern["offsets"] = ((matrix - matrix[:, :1]) % 86400).tolist()
+        else:
+            pattern["departures"] = [seconds[i:j].tolist() for i, j in zip(stop_starts.tolist(), np.r_[stop_starts[1:], end].tolist())]
+        patterns.append(pattern)
+    return patterns
+
+
+def _view(array):
+    """Zero-copy sequence of Python ints over a 1-D integer array."""
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("="))
+    return memoryview(array) if len(array) else []
+
+
+class ServiceTimetable:
+    """One service day's departures as elementary connections sorted by departure.
+
+    Each connection i rides from node conn_from[i] to node conn_to[i] (nodes
+    are the NetworkSnapshot's (station, line) indices), leaving at dep[i] and
+    arriving at arr[i], both in seconds since midnight. Queries run a
+    Connection Scan over these arrays and never touch the database.
+
+    departures holds the same rows as a departure index:
+    (line_id, station_id, next_station_id) -> sorted departure seconds.
+    """
+
+    def __init__(self, network, service_date, day_type, rows):
+        self.network = network
+        self.service_date = service_date
+        self.day_type = day_type
+
+        connections = []
+        departures = defaultdict(list)
+        for line_id, station_id, next_station_id, departure_time, travel_time in rows:
+            dep = seconds_since_midnight(departure_time)
+            departures[(line_id, station_id, next_station_id)].append(dep)
+            line = network.line_index.get(line_id)
+            src = network.node_index.get((network.station_index.get(station_id), line))
+            dst = network.node_index.get((network.station_index.get(next_station_id), line))
+            if src is None or dst is None:
+                continue
+            travel_time = DEFAULT_TRAVEL_TIME if travel_time is None else travel_time
+            connections.append((dep, dep + travel_time * 60, src, dst))
+        connections.sort()
+        for times in departures.values():
+            times.sort()
+        self.departures = dict(departures)
+
+        self.dep = np.array([c[0] for c in connections], dtype=np.int32)
+        self.arr = np.array([c[1] for c in connections], dtype=np.int32)
+        self.conn_from = np.array([c[2] for c in connections], dtype=np.int32)
+        self.conn_to = np.array([c[3] for c in connections], dtype=np.int32)
+        self._index_connections()
+
+    @classmethod
+    def from_arrays(cls, network, service_date, day_type, arrays):
+        """Rebuilds a timetable from the arrays produced by to_arrays (see snapshot_file).
+
+        The connection scan and the departure lists read the arrays through
+        memoryviews instead of copying them into Python lists, so arrays
+        mapped from a snapshot file stay shared between processes; only the
+        per-hop and per-node indexes are built here.
+        """
+        timetable = cls.__new__(cls)
+        timetable.network = network
+        timetable.service_date = service_date
+        timetable.day_type = day_type
+        for name in CONNECTION_FIELDS:
+            setattr(timetable, name, arrays[name])
+        offsets = arrays["departure_offsets"].tolist()
+        times = _view(arrays["departure_times"])
+        keys = zip(arrays["departure_line"].tolist(), arrays["departure_station"].tolist(), arrays["departure_next"].tolist())
+        timetable.departures = {
+            (network.line_ids[line], network.station_ids[station], network.station_ids[next_station]): times[offsets[k]:offsets[k + 1]]
+            for k, (line, station, next_station) in enumerate(keys)
+        }
+        timetable._index_connections(shared=True)
+        return timetable
+
+    def to_arrays(self):
+        """Flattens the connections and departure index into integer arrays.
+
+        Departure keys are stored as line and station indices of the network;
+        hops whose line or stations are not in the network are dropped.
+        """
+        network = self.network
+        keys, offsets, times = [], [0], []
+        for (line_id, station_id, next_station_id), hop_times in self.departures.items():
+            key = (network.line_index.get(line_id), network.station_index.get(station_id), network.station_index.get(next_station_id))
+            if None in key:
+                continue
+            keys.append(key)
+            times.extend(hop_times)
+            offsets.append(len(times))
+        keys = np.array(keys, dtype=np.int32).reshape(-1, 3)
+        arrays = {name: getattr(self, name) for name in CONNECTION_FIELDS}
+        arrays.update({
+            "departure_line": keys[:, 0].copy(),
+            "departure_station": keys[:, 1].copy(),
+            "departure_next": keys[:, 2].copy(),
+            "departure_offsets": np.array(offsets, dtype=np.int64),
+            "departure_times": np.array(times, dtype=np.int32),
+        })
+        return arrays
+
+    def _index_connections(self, shared=False):
+        network = self.network
+        # Lists index a little faster; views avoid a private copy of shared arrays.
+        columns = (self.dep, self.arr, self.conn_from, self.conn_to)
+        self._scan = tuple(_view(column) if shared else column.tolist() for column in columns)
+
+        # Transfer edges per node as (to_node, peak_seconds, offpeak_seconds).
+        self._transfers = [[] for _ in range(network.num_nodes)]
+        for n in range(network.num_nodes):
+            for e in range(network.indptr[n], network.indptr[n + 1]):
+                if network.edge_is_transfer[e]:
+                    self._transfers[n].append((int(network.indices[e]), int(network.weight_peak[e]) * 60, int(network.weight_offpeak[e]) * 60))
+
+    @classmethod
+    def from_cursor(cls, cursor, network, service_date, day_type=None):
+        if day_type is None:
+            day_type = resolve_day_type(cursor, service_date)
+        if day_type is None:
+            logger.warning(f"No template for date {service_date}")
+            return None
+        timetable = cls(network, service_date, day_type, fetch_connections(cursor, day_type, service_date))
+        logger.info(f"Loaded {len(timetable.dep)} connections for {service_date} ({day_type})")
+        return timetable
+
+    def next_departure(self, line_id, station_id, next_station_id, seconds):
+        """Returns the first departure at or after seconds for a hop, or None."""
+        times = self.departures.get((line_id, station_id, next_station_id))
+        if not times:
+            return None
+        i = bisect.bisect_left(times, seconds)
+        return times[i] if i < len(times) else None
+
+    def earliest_arrival(self, sources, targets, start_seconds):
+        """Connection Scan from sources at start_seconds.
+
+        Returns (target_node, arrival_seconds, parent) for the earliest
+        reachable target, or None. parent maps each reached node to the node
+        it was reached from (None for sources).
+        """
+        dep, arr, conn_from, conn_to = self._scan
+        transfers = self._transfers
+        inf = float('inf')
+        earliest = {node: start_seconds for node in sources}
+        parent = {node: None for node in sources}
+        best_target, best_arrival = None, inf
+        for node in sources:
+            if node in targets:
+                return node, start_seconds, parent
+
+        for i in range(bisect.bisect_left(dep, start_seconds), len(dep)):
+            if dep[i] >= best_arrival:
+                break
+            src = conn_from[i]
+            if earliest.get(src, inf) > dep[i]:
+                continue
+            dst = conn_to[i]
+            arrival = arr[i]
+            if arrival >= earliest.get(dst, inf):
+                continue
+            earliest[dst] = arrival
+            parent[dst] = src
+            if dst in targets and arrival < best_arrival:
+                best_target, best_arrival = dst, arrival
+            peak = is_peak_time(datetime.min + timedelta(seconds=arrival))
+            for to_node, peak_seconds, offpeak_seconds in transfers[dst]:
+                transfer_arrival = arrival + (peak_seconds if peak else offpeak_seconds)
+                if transfer_arrival < earliest.get(to_node, inf):
+                    earliest[to_node] = transfer_arrival
+                    parent[to_node] = dst
+                    if to_node in targets and transfer_arrival < best_arrival:
+                        best_target, best_arrival = to_node, transfer_arrival
+
+        if best_target is None:
+            return None
+        return best_target, best_arrival, parent
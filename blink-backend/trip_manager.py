@@ -1,144 +1,332 @@
+import base64
+import bisect
+import json
+import math
+import os
+import re
+import threading
 from collections import defaultdict
-import heapq
-from datetime import datetime, timedelta
-from db import get_db_connection, release_db_connection, create_session
+from datetime import datetime, time, timedelta
+from async_db import acquire, iterate, transaction
+from cache import TTLCache
+from db import get_db_connection, release_db_connection, validate_session
+from fares import FareEngine, settle_trips
 from fastapi import HTTPException
+from ingest import GroupCommitter, parse_records
+from longest_route import longest_simple_path
+from metrics import track_method
+from network import NetworkSnapshot, RoutingState, service_period
+from schedule_builder import generate_schedules
+from snapshot_file import read_snapshot, write_snapshot
+from timetable import ServiceTimetable, adjusted_day_type, line_timetable_patterns, load_day_types, seconds_since_midnight
+import asyncpg
 import psycopg2
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-class TripManager:
-    def __init__(self):
-        conn = get_db_connection(create_session(role="user"))
-        cursor = conn.cursor()
 
-        # Fetch station map
-        cursor.execute("SELECT station_id, station_name FROM stations")
-        stations_data = cursor.fetchall()
-        self.station_map = {row[1]: row[0] for row in stations_data}
-        self.station_map_inv = {row[0]: row[1] for row in stations_data}
+TRIP_FIELDS = ("trip_id", "start_station_id", "end_station_id", "start_time", "end_time", "fare", "description")
+TRIP_PAGE_MAX = 500
+TRIP_COLUMNS = ["trip_id", "user_id", "start_station_id", "end_station_id", "start_time", "end_time", "description"]
+LONGEST_ROUTE_SECONDS = float(os.getenv("LONGEST_ROUTE_SECONDS", "5"))
+# Service days kept in memory: least recently used first out, and reloaded after the TTL.
+SERVICE_TIMETABLE_CACHE_SIZE = int(os.getenv("SERVICE_TIMETABLE_CACHE_SIZE", "14"))
+SERVICE_TIMETABLE_CACHE_TTL = float(os.getenv("SERVICE_TIMETABLE_CACHE_TTL", "21600"))
+_MISSING = object()
+
+
+def timetable_cache(timetables=None):
+    """TTLCache of service date -> ServiceTimetable (None for days without service)."""
+    cache = TTLCache(SERVICE_TIMETABLE_CACHE_SIZE, SERVICE_TIMETABLE_CACHE_TTL)
+    for service_date, timetable in (timetables or {}).items():
+        cache.set(service_date, timetable)
+    return cache
+# Station schedules keyed by (line name, station id, day type, service date),
+# shared by every TripManager in the process. Entries are dropped when
+# schedules are regenerated or the network reloads; the TTL bounds how stale
+# they get when another process regenerates them.
+SCHEDULE_CACHE = TTLCache(maxsize=int(os.getenv("SCHEDULE_CACHE_SIZE", "4096")), ttl=float(os.getenv("SCHEDULE_CACHE_TTL", "300")))
+# Bumped on every invalidation, so a fetch that started before one does not
+# put the old schedules back into the cache.
+_schedule_cache_lock = threading.Lock()
+_schedule_cache_generation = 0
+
+
+def cache_schedule(key, entry, generation):
+    """Caches a fetched schedule unless the cache was invalidated since generation."""
+    with _schedule_cache_lock:
+        if generation != _schedule_cache_generation:
+            logger.info(f"Schedule cache invalidated during fetch of {key}, not caching")
+            return
+        SCHEDULE_CACHE.set(key, entry)
+
+
+STATION_SCHEDULE_SQL = """
+    SELECT l.start_time, l.end_time, s.departure_time, s.day_type
+    FROM lines l
+    LEFT JOIN schedules s ON s.line_id = l.line_id
+        AND s.station_id = %(station_id)s
+        AND ((%(day_type)s::text IS NULL AND s.day_type NOT LIKE '%%@%%') OR s.day_type = CASE
+            WHEN EXISTS (SELECT 1 FROM schedules d WHERE d.day_type = %(adjusted)s AND d.line_id = l.line_id)
+            THEN %(adjusted)s ELSE %(day_type)s END)
+    WHERE l.line_name = %(line_name)s
+    ORDER BY s.departure_time
+"""
+LINE_TIMETABLE_SQL = """
+    WITH stops AS (
+        SELECT sp.pattern_id, sp.pattern_name, sp.line_id, spd.station_sequence, spd.station_id,
+               LEAD(spd.station_id) OVER (PARTITION BY spd.pattern_id ORDER BY spd.station_sequence) AS next_station_id
+        FROM service_patterns sp
+        JOIN service_pattern_details spd ON spd.pattern_id = sp.pattern_id
+        JOIN lines l ON l.line_id = sp.line_id
+        WHERE l.line_name = %(line_name)s
+    )
+    SELECT st.pattern_id, st.pattern_name, st.station_sequence, st.station_id,
+           EXTRACT(EPOCH FROM s.departure_time)::int
+    FROM stops st
+    JOIN schedules s ON s.line_id = st.line_id
+        AND s.station_id = st.station_id
+        AND s.next_station_id IS NOT DISTINCT FROM st.next_station_id
+        AND s.day_type = CASE
+            WHEN EXISTS (SELECT 1 FROM schedules d WHERE d.day_type = %(adjusted)s AND d.line_id = st.line_id)
+            THEN %(adjusted)s ELSE %(day_type)s END
+    ORDER BY st.pattern_id, st.station_sequence, s.departure_time
+"""
+
+
+def encode_trip_cursor(trip):
+    """Opaque keyset cursor pointing just past a trip record returned by get_trips."""
+    raw = json.dumps([trip["start_time"], trip["trip_id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_trip_cursor(cursor):
+    """Returns (start_time or None, trip_id); raises ValueError for a malformed cursor."""
+    try:
+        start_time, trip_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (datetime.fromisoformat(start_time) if start_time is not None else None), int(trip_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid trips cursor: {cursor}") from e
+
+
+def trips_query(user_id, after=None, limit=None):
+    """Builds the keyset query for one user's trips, newest first, as ($n SQL, args).
+
+    Rows are ordered by start_time DESC (NULLs first, as a backward scan of
+    idx_trips_user_start returns them) with trip_id breaking ties, and
+    after is the (start_time, trip_id) of the last row already seen.
+    """
+    sql = f"SELECT {', '.join(TRIP_FIELDS)} FROM trips WHERE user_id = $1"
+    args = [user_id]
+    if after is not None:
+        start_time, trip_id = after
+        if start_time is None:
+            sql += " AND (start_time IS NOT NULL OR trip_id < $2)"
+            args.append(trip_id)
+        else:
+            sql += " AND (start_time < $2 OR (start_time = $2 AND trip_id < $3))"
+            args += [start_time, trip_id]
+    sql += " ORDER BY start_time DESC, trip_id DESC"
+    if limit is not None:
+        args.append(limit)
+        sql += f" LIMIT ${len(args)}"
+    return sql, args
+
+
+def to_pyformat(sql, args):
+    """Rewrites an asyncpg $n query for psycopg2, repeating arguments that are reused."""
+    order = [int(n) - 1 for n in re.findall(r"\$(\d+)", sql)]
+    return re.sub(r"\$\d+", "%s", sql), [args[i] for i in order]
+
+
+def trip_record(row):
+    trip = dict(zip(TRIP_FIELDS, row))
+    for field in ("start_time", "end_time"):
+        if trip[field] is not None:
+            trip[field] = trip[field].isoformat()
+    if trip["fare"] is not None:
+        trip["fare"] = float(trip["fare"])
+    return trip
+
+
+async def trips_json(trips, limit=None):
+    """Streams trips as {"trips": [...], "next_cursor": ...} once the first one has arrived.
+
+    Errors before the first trip propagate to the caller; later ones end the
+    body with an "error" field instead of truncating it.
+    """
+    first = await anext(trips, _MISSING)
+
+    async def stream():
+        count, last = 0, None
+        yield '{"trips": ['
+        try:
+            if first is not _MISSING:
+                yield json.dumps(first)
+                count, last = 1, first
+                async for trip in trips:
+                    yield "," + json.dumps(trip)
+                    count, last = count + 1, trip
+        except Exception as e:
+            logger.error(f"Trip stream failed after {count} trips: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield f'], "next_cursor": null, "error": {json.dumps(detail)}}}'
+            return
+        next_cursor = encode_trip_cursor(last) if limit is not None and count == limit else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+        logger.info(f"Streamed {count} trips")
+    return stream()
 
-        # Fetch lines
-        cursor.execute("SELECT line_id, line_name FROM lines")
-        lines_data = cursor.fetchall()
-        self.valid_lines = {row[0]: row[1] for row in lines_data}
 
-        # Build station_graph
-        self.station_graph = defaultdict(list)
-        for line_id, line_name in self.valid_lines.items():
-            cursor.execute("""
-                SELECT from_station_id, to_station_id FROM routes WHERE line_id = %s
-            """, (line_id,))
-            route_segments = cursor.fetchall()
-            for from_station, to_station in route_segments:
-                self.station_graph[from_station].append((to_station, line_name))
-                self.station_graph[to_station].append((from_station, line_name))
-
-        # Fetch transfer stations
-        cursor.execute("""
-            SELECT station_id, line_name 
-            FROM transfer_stations 
-            JOIN lines ON transfer_stations.line_id = lines.line_id
-        """)
-        transfer_data = cursor.fetchall()
-        transfer_stations = defaultdict(list)
-        for station_id, line_name in transfer_data:
-            transfer_stations[station_id].append(line_name)
-        for station, lines_at_station in transfer_stations.items():
-            for line1 in lines_at_station:
-                for line2 in lines_at_station:
-                    if line1 != line2:
-                        self.station_graph[station].append((station, line2))
-        cursor.close()
-        release_db_connection(conn)
+class TripManager:
+    def __init__(self, snapshot=None, snapshot_path=None):
+        """Builds from a NetworkSnapshot, a snapshot file, or the database.
+
+        snapshot_path defaults to BLINK_SNAPSHOT_FILE; when set, the network
+        and the service days stored in the file are mapped from it and the
+        database is only needed for days the file does not cover.
+        """
+        preloaded = {}
+        snapshot_path = snapshot_path or (os.getenv("BLINK_SNAPSHOT_FILE") if snapshot is None else None)
+        if snapshot_path:
+            snapshot, preloaded = read_snapshot(snapshot_path)
+        elif snapshot is None:
+            snapshot = self.load_network()
+        # Warm: the route matrices (or hierarchies) are built here, not inside the first query.
+        self.routing = RoutingState(snapshot, warm=True)
+        self.pinned_period = None
+        self.day_types = None
+        self.preloaded_timetables = preloaded
+        self.service_timetables = timetable_cache(preloaded)
+        # Bumped whenever the network or the timetables are swapped; a service day
+        # loaded across a swap was built on the old state and is not cached.
+        self._timetable_lock = threading.Lock()
+        self._timetable_generation = 0
+        self.trip_ingestor = GroupCommitter(self._write_trip_rows)
+        self._fare_engine = FareEngine(snapshot)
+        self._longest_route = None
         self.build_weighted_graph()
         logger.info("TripManager initialized")
 
-    def build_weighted_graph(self, current_time=None):
-        if current_time is None:
-            current_time = datetime.now()
-        conn = get_db_connection(create_session(role="user"))
+    # The routing state is swapped as a whole on reload; these read the current one.
+    network = property(lambda self: self.routing.network)
+    station_map = property(lambda self: self.routing.station_map)
+    station_map_inv = property(lambda self: self.routing.station_map_inv)
+    valid_lines = property(lambda self: self.routing.valid_lines)
+    line_map = property(lambda self: self.routing.line_map)
+    station_graph = property(lambda self: self.routing.station_graph)
+    lines_per_station = property(lambda self: self.routing.lines_per_station)
+    # Legacy dict-of-dicts graph of the pinned (or current) period, built on first access.
+    weighted_graph = property(lambda self: self._graph_for(self.routing, None).weighted_graph)
+
+    @track_method
+    def load_network(self):
+        conn = get_db_connection(internal=True)
         cursor = conn.cursor()
-        self.lines_per_station = defaultdict(set)
-        for station in self.station_graph:
-            for neighbor, line in self.station_graph[station]:
-                self.lines_per_station[station].add(line)
-
-        self.weighted_graph = {}
-        for station in self.station_graph:
-            lines = self.lines_per_station[station]
-            for line in lines:
-                node = (station, line)
-                self.weighted_graph[node] = []
-                # Fetch travel times between stations on the same line
-                cursor.execute("""
-                    SELECT r.to_station_id, r.travel_time
-                    FROM routes r
-                    WHERE r.from_station_id = %s AND r.line_id = (
-                        SELECT line_id FROM lines WHERE line_name = %s
-                    )
-                """, (station, line))
-                route_data = cursor.fetchall()
-                for to_station, travel_time in route_data:
-                    self.weighted_graph[node].append(((to_station, line), travel_time))
-
-                # Fetch transfer times between lines at the same station
-                for other_line in lines:
-                    if other_line != line:
-                        cursor.execute("""
-                            SELECT transfer_time_peak, transfer_time_offpeak
-                            FROM transfer_times
-                            WHERE station_id = %s AND from_line_id = (
-                                SELECT line_id FROM lines WHERE line_name = %s
-                            ) AND to_line_id = (
-                                SELECT line_id FROM lines WHERE line_name = %s
-                            )
-                        """, (station, line, other_line))
-                        transfer_data = cursor.fetchone()
-                        if transfer_data:
-                            transfer_time_peak, transfer_time_offpeak = transfer_data
-                            is_peak = (7 <= current_time.hour < 9) or (17 <= current_time.hour < 19)
-                            transfer_time = transfer_time_peak if is_peak else transfer_time_offpeak
-                            self.weighted_graph[node].append(((station, other_line), transfer_time))
-        cursor.close()
-        release_db_connection(conn)
-
-    # In trip_manager.py
-    def find_shortest_path(self, start_station, end_station):
-        if start_station not in self.station_map_inv or end_station not in self.station_map_inv:
-            return None, 0
-        start_id = self.station_map[start_station]
-        end_id = self.station_map[end_station]
-        lines_start = self.lines_per_station[start_id]
-
-        distances = {node: float('inf') for node in self.weighted_graph}
-        for line in lines_start:
-            distances[(start_id, line)] = 0
-        pq = [(0, (start_id, line)) for line in lines_start]
-        heapq.heapify(pq)
-        parent = {node: None for node in self.weighted_graph}
-
-        while pq:
-            dist, current = heapq.heappop(pq)
-            if current[0] == end_id:
-                path = []
-                while current:
-                    path.append(current[0])
-                    current = parent[current]
-                path.reverse()
-                station_path = [self.station_map_inv[sid] for sid in path]
-                return station_path, dist
-            if dist > distances[current]:
-                continue
-            for neighbor, weight in self.weighted_graph[current]:
-                new_dist = dist + weight
-                if new_dist < distances[neighbor]:
-                    distances[neighbor] = new_dist
-                    parent[neighbor] = current
-                    heapq.heappush(pq, (new_dist, neighbor))
-        return None, 0
-
+        try:
+            return NetworkSnapshot.from_cursor(cursor)
+        finally:
+            cursor.close()
+            release_db_connection(conn)
 
+    def build_weighted_graph(self, current_time=None):
+        """Pins the period used by queries without a departure time; None follows the clock."""
+        self.pinned_period = None if current_time is None else service_period(current_time)
+        graph = self.routing.graphs[self.pinned_period or service_period(datetime.now())]
+        self.is_peak = graph.is_peak
+
+    def _graph_for(self, routing, departure_time):
+        if departure_time is None and self.pinned_period is not None:
+            return routing.graphs[self.pinned_period]
+        return routing.graph_for(departure_time or datetime.now())
+
+    @track_method
+    def reload_network(self, snapshot=None, warm=True):
+        """Rebuilds the routing state and cached timetables off to the side, then swaps them in."""
+        if snapshot is None:
+            snapshot = self.load_network()
+        routing = RoutingState(snapshot, warm=warm)
+        fare_engine = FareEngine(snapshot)
+        day_types, timetables = None, {}
+        if self.service_timetables:
+            day_types, timetables = self._fetch_timetables(snapshot, [d for d, _ in self.service_timetables.items()])
+        with self._timetable_lock:
+            self._timetable_generation += 1
+            self.routing = routing
+            self.day_types = day_types
+            self.preloaded_timetables = {}
+            self.service_timetables = timetable_cache(timetables)
+        self._fare_engine = fare_engine
+        self.invalidate_schedule_cache()
+        graph = routing.graphs[self.pinned_period or service_period(datetime.now())]
+        self.is_peak = graph.is_peak
+        logger.info(f"Reloaded network: {snapshot.num_nodes} nodes, {len(timetables)} service days")
+
+    def find_shortest_path(self, start_station, end_station, departure_time=None):
+        """Returns (station names, travel minutes) using the precomputed route matrix.
+
+        Networks too large for a matrix are routed over the period's
+        contraction hierarchy instead. departure_time picks the service
+        period's graph; without one the pinned period (see
+        build_weighted_graph) or the current one is used.
+        """
+        routing = self.routing
+        if start_station not in routing.station_map or end_station not in routing.station_map:
+            return None, 0
+        graph = self._graph_for(routing, departure_time)
+        sources = routing.network.nodes_for_station(routing.station_map[start_station])
+        targets = routing.network.nodes_for_station(routing.station_map[end_station])
+        matrix = graph.route_matrix()
+        if matrix is not None:
+            best = matrix.best_pair(sources, targets)
+            if best is None:
+                return None, 0
+            source, target, total = best
+            return routing.station_path(matrix.path(source, target)), total
+
+        route = graph.contraction().route(sources, targets)
+        if route is None:
+            return None, 0
+        path, total = route
+        return routing.station_path(path), total
+
+    @track_method
+    def find_shortest_paths(self, pairs, departure_time=None):
+        """Routes many (start, end) pairs, sharing one route tree per origin.
+
+        Yields one result dict per pair as soon as it is computed; "index"
+        is the pair's position in the input.
+        """
+        by_origin = defaultdict(list)
+        for index, (start_station, end_station) in enumerate(pairs):
+            by_origin[start_station].append((index, end_station))
+        for start_station, destinations in by_origin.items():
+            for index, end_station, path, total in self._routes_from(start_station, destinations, departure_time):
+                yield {"index": index, "start": start_station, "end": end_station, "path": path, "travel_time": total}
+
+    def find_shortest_paths_from(self, origin, destinations, departure_time=None):
+        """Routes one origin to many destinations from a single route tree."""
+        return self.find_shortest_paths([(origin, end_station) for end_station in destinations], departure_time)
+
+    def _routes_from(self, start_station, destinations, departure_time):
+        routing = self.routing
+        if start_station not in routing.station_map:
+            for index, end_station in destinations:
+                yield index, end_station, None, 0
+            return
+        graph = self._graph_for(routing, departure_time)
+        tree = routing.network.origin_tree(routing.network.nodes_for_station(routing.station_map[start_station]), graph.is_peak)
+        for index, end_station in destinations:
+            route = None
+            if end_station in routing.station_map:
+                route = tree.route_to(routing.network.nodes_for_station(routing.station_map[end_station]))
+            if route is None:
+                yield index, end_station, None, 0
+            else:
+                nodes, total = route
+                yield index, end_station, routing.station_path(nodes), total
+
+    @track_method
     def add_trip(self, trip, session_token, user_id=None, start_station=None, end_station=None, start_time=None):
         conn = get_db_connection(session_token)
         cursor = conn.cursor()
@@ -164,324 +352,448 @@ class TripManager:
             cursor.close()
             release_db_connection(conn)
 
-    def get_trips(self, session_token):
+    @track_method
+    def get_trips(self, session_token, user_id, after=None, limit=None):
+        """Yields one user's trips newest first through a server-side cursor.
+
+        after is a (start_time, trip_id) keyset position from decode_trip_cursor;
+        limit caps the page, None streams the whole history.
+        """
+        sql, args = to_pyformat(*trips_query(user_id, after, limit))
         conn = get_db_connection(session_token)
-        cursor = conn.cursor()
+        cursor = conn.cursor(name=f"trips_{user_id}")
+        cursor.itersize = TRIP_PAGE_MAX
         try:
-            cursor.execute("SELECT description FROM trips WHERE description IS NOT NULL")
-            trips = [row[0] for row in cursor.fetchall()]
-            return {"trips": trips}
+            cursor.execute(sql, args)
+            for row in cursor:
+                yield trip_record(row)
         except psycopg2.Error as e:
             raise HTTPException(status_code=500, detail=f"Database error retrieving trips: {str(e)}")
         finally:
             cursor.close()
+            conn.rollback()
             release_db_connection(conn)
-            # In trip_manager.py
+
+    @track_method
+    async def add_trip_async(self, trip, session_token, user_id=None, start_station=None, end_station=None, start_time=None):
+        """Async counterpart of add_trip for the FastAPI endpoints."""
+        try:
+            async with acquire(session_token) as conn:
+                trip_id = await conn.fetchval("""
+                    INSERT INTO trips (user_id, start_station_id, end_station_id, start_time, description)
+                    VALUES ($1, $2, $3, $4, $5)
+                    RETURNING trip_id
+                """, user_id, self.station_map.get(start_station), self.station_map.get(end_station), start_time, trip)
+            logger.info(f"Trip {trip_id} added: {trip}")
+            return {"message": f"Trip {trip_id} added successfully", "trip_id": trip_id}
+        except HTTPException:
+            raise
+        except asyncpg.IntegrityConstraintViolationError as e:
+            logger.error(f"Integrity error adding trip: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Invalid station or user data: {str(e)}")
+        except Exception as e:
+            logger.error(f"Database error adding trip: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    @track_method
+    async def get_trips_async(self, session_token, user_id, after=None, limit=None):
+        """Async counterpart of get_trips for the FastAPI endpoints."""
+        sql, args = trips_query(user_id, after, limit)
+        try:
+            async with transaction(session_token) as conn:
+                async for row in iterate(conn, sql, *args, prefetch=TRIP_PAGE_MAX):
+                    yield trip_record(tuple(row))
+        except (asyncpg.PostgresError, OSError) as e:
+            raise HTTPException(status_code=500, detail=f"Database error retrieving trips: {str(e)}")
+
+    @track_method
+    async def ingest_trips_async(self, records, session_token, user_id=None):
+        """Stores a batch of trip and tap records (see ingest.parse_records).
+
+        Records missing a user_id are attributed to user_id. Concurrent
+        batches are written together by trip_ingestor in one transaction.
+        Returns one result per record: {"index", "status": "ok", "trip_id"}
+        or {"index", "status": "rejected", "error"}.
+        """
+        if not validate_session(session_token):
+            raise HTTPException(status_code=403, detail="Invalid session")
+        rows, results = parse_records(records, self.station_map, user_id)
+        try:
+            written = await self.trip_ingestor.submit(rows)
+        except (asyncpg.PostgresError, OSError) as e:
+            logger.error(f"Database error ingesting {len(rows)} trip records: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        for (_, index, _), result in zip(rows, written):
+            results[index] = {"index": index, **result}
+        return results
+
+    async def _write_trip_rows(self, rows):
+        """Writes one commit group: COPY for new trips, one UPDATE closing trips on tap-out."""
+        results = [None] * len(rows)
+        async with transaction() as conn:
+            known_users = {
+                row[0] for row in await conn.fetch(
+                    "SELECT user_id FROM users WHERE user_id = ANY($1::int[])",
+                    list({values[0] for _, _, values in rows})
+                )
+            }
+            for position, (_, _, values) in enumerate(rows):
+                if values[0] not in known_users:
+                    results[position] = {"status": "rejected", "error": f"Unknown user {values[0]}"}
+
+            inserts = [position for position, (op, _, _) in enumerate(rows) if op == "insert" and results[position] is None]
+            if inserts:
+                # Ids are drawn up front so every record knows its trip_id without relying on RETURNING order.
+                trip_ids = [row[0] for row in await conn.fetch(
+                    "SELECT nextval(pg_get_serial_sequence('trips', 'trip_id')) FROM generate_series(1, $1)", len(inserts)
+                )]
+                await conn.copy_records_to_table("trips", columns=TRIP_COLUMNS, records=[
+                    (trip_id, *rows[position][2]) for trip_id, position in zip(trip_ids, inserts)
+                ])
+                for trip_id, position in zip(trip_ids, inserts):
+                    results[position] = {"status": "ok", "trip_id": trip_id}
+
+            closes = [position for position, (op, _, _) in enumerate(rows) if op == "close" and results[position] is None]
+            if closes:
+                closed = await conn.fetch("""
+                    UPDATE trips t
+                    SET end_station_id = c.station_id, end_time = c.tapped_at
+                    FROM (
+                        SELECT DISTINCT ON (open_trip.trip_id) taps.position, open_trip.trip_id, taps.station_id, taps.tapped_at
+                        FROM unnest($1::int[], $2::int[], $3::varchar[], $4::timestamp[])
+                            AS taps(position, user_id, station_id, tapped_at)
+                        CROSS JOIN LATERAL (
+                            SELECT trip_id FROM trips
+                            WHERE user_id = taps.user_id AND end_time IS NULL AND start_time <= taps.tapped_at
+                            ORDER BY start_time DESC
+                            LIMIT 1
+                        ) open_trip
+                        ORDER BY open_trip.trip_id, taps.tapped_at
+                    ) c
+                    WHERE t.trip_id = c.trip_id
+                    RETURNING c.position, t.trip_id
+                """, closes, *[list(column) for column in zip(*(rows[position][2] for position in closes))])
+                for position, trip_id in closed:
+                    results[position] = {"status": "ok", "trip_id": trip_id}
+                for position in closes:
+                    if results[position] is None:
+                        results[position] = {"status": "rejected", "error": "No open trip to close"}
+        logger.info(f"Ingested {len(rows)} trip records in one commit")
+        return results
+
     def get_station_id(self, station_name):
         """Returns the station ID for a given station name."""
         if station_name not in self.station_map:  # Use station_map
             raise ValueError(f"Station {station_name} not found")
         return self.station_map[station_name]  # Use station_map
 
-    def longest_route_no_repeats(self):
-        """Finds the longest route without repeating stations."""
-        def dfs(current, visited):
-            longest = [current]
-            for neighbor, _ in self.station_graph.get(current, []):
-                if neighbor not in visited:
-                    new_visited = visited | {neighbor}
-                    sub_route = dfs(neighbor, new_visited)
-                    if len(sub_route) + 1 > len(longest):
-                        longest = [current] + sub_route
-            return longest
-
-        longest_path = []
-        for start in self.station_graph:
-            path = dfs(start, {start})
-            if len(path) > len(longest_path):
-                longest_path = path
-        return [self.station_map_inv[sid] for sid in longest_path]
+    @track_method
+    def longest_route_no_repeats(self, time_budget=None, max_expansions=None):
+        """Longest route without repeating stations, the best found within the budget; memoized per network."""
+        routing = self.routing
+        time_budget = LONGEST_ROUTE_SECONDS if time_budget is None else time_budget
+        cached = self._longest_route
+        if cached is not None and cached[0] is routing and (cached[3] or cached[1] == (time_budget, max_expansions)):
+            return list(cached[2])
+        adjacency = {station: [neighbor for neighbor, _ in edges] for station, edges in routing.station_graph.items()}
+        path, exact = longest_simple_path(adjacency, time_budget, max_expansions)
+        names = [routing.station_map_inv[station_id] for station_id in path]
+        self._longest_route = (routing, (time_budget, max_expansions), names, exact)
+        return list(names)
 
     def get_timetable(self, line, station, current_time):
-        conn = get_db_connection(create_session(role="user"))
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT start_time, end_time FROM lines WHERE line_name = %s", (line,))
-            row = cursor.fetchone()
-            if not row:
-                return []
-            start_time, end_time = row
-            start_hour = start_time.hour
-            end_hour = end_time.hour
-            if current_time.hour < start_hour or current_time.hour >= end_hour:
-                return ["Station closed!"]
-            is_peak = current_time.hour < start_hour or current_time.hour >= end_hour
-            frequency = 10 if is_peak else 15
-            start_hour = 6
-            times = []
-            for minute in range(0, 60, frequency):
-                time = current_time.replace(hour=start_hour, minute=minute, second=0, microsecond=0)
-                while time <= current_time.replace(hour=22, minute=0, second=0, microsecond=0):
-                    if time >= current_time:
-                        times.append(time.strftime("%H:%M"))
-                    time += timedelta(minutes=frequency)
-                if times:
-                    break
-            return times if times else []
-        finally:
-            cursor.close()
-            release_db_connection(conn)
-    def get_schedules(self, session_token, line_name, station_name):
-        conn = get_db_connection(session_token)
-        cursor = conn.cursor()
+        """Departures still to come today from station on line, as HH:MM strings."""
+        station_id = self.station_map.get(station)
+        if station_id is None:
+            return []
+        entry = self._station_schedule(line, station_id, current_time.date())
+        if entry is None:
+            return []
+        opens, closes = entry["opens"], entry["closes"]
+        if opens and closes and (current_time.hour < opens.hour or current_time.hour >= closes.hour):
+            return ["Station closed!"]
+        index = bisect.bisect_left(entry["seconds"], seconds_since_midnight(current_time) + (1 if current_time.microsecond else 0))
+        return [item["departure_time"] for item in entry["schedules"][index:]]
+
+    def get_schedules(self, session_token, line_name, station_name, service_date=None):
+        """Every scheduled departure from a station on a line; only service_date's when given."""
+        if not validate_session(session_token):
+            raise HTTPException(status_code=403, detail="Invalid session")
         try:
             station_id = self.station_map.get(station_name)
             if not station_id:
                 raise ValueError(f"Station {station_name} not found")
-            
-            cursor.execute("""
-                SELECT departure_time, day_type
-                FROM schedules
-                WHERE line_id = (SELECT line_id FROM lines WHERE line_name = %s)
-                AND station_id = %s
-                ORDER BY departure_time
-            """, (line_name, station_id))
-            schedules = cursor.fetchall()
-            if not schedules:
+            entry = self._station_schedule(line_name, station_id, service_date)
+            if entry is None or not entry["schedules"]:
                 raise ValueError(f"No schedules found for {station_name} on {line_name}")
-            
-            schedule_list = [{"departure_time": row[0].strftime("%H:%M"), "day_type": row[1]} for row in schedules]
-            return {"line": line_name, "station": station_name, "schedules": schedule_list}
+            result = {"line": line_name, "station": station_name, "schedules": entry["schedules"]}
+            if service_date is not None:
+                result["service_date"] = service_date.isoformat()
+                result["day_type"] = entry["day_type"]
+            return result
         except Exception as e:
             raise Exception(f"Error retrieving schedules: {str(e)}")
+
+    def _station_schedule(self, line_name, station_id, service_date=None):
+        """Cached schedule of one station on one line, or None if the line does not exist."""
+        day_type = None
+        if service_date is not None:
+            if self.day_types is None:
+                self._load_day_types()
+            day_type = self.day_types.get(service_date)
+            if day_type is None:
+                # No template runs that day, so nothing departs.
+                return {"day_type": None, "opens": None, "closes": None, "seconds": [], "schedules": []}
+        key = (line_name, station_id, day_type, service_date)
+        generation = _schedule_cache_generation
+        entry = SCHEDULE_CACHE.get(key, key)
+        if entry is key:
+            entry = self._fetch_station_schedule(line_name, station_id, day_type, service_date)
+            cache_schedule(key, entry, generation)
+        return entry
+
+    @track_method
+    def _fetch_station_schedule(self, line_name, station_id, day_type, service_date):
+        conn = get_db_connection(internal=True)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(STATION_SCHEDULE_SQL, {
+                "line_name": line_name,
+                "station_id": station_id,
+                "day_type": day_type,
+                "adjusted": adjusted_day_type(day_type, service_date) if day_type else None,
+            })
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            release_db_connection(conn)
+        if not rows:
+            return None
+        departures = [(departure, row_day_type) for _, _, departure, row_day_type in rows if departure is not None]
+        return {
+            "day_type": day_type,
+            "opens": rows[0][0],
+            "closes": rows[0][1],
+            "seconds": [seconds_since_midnight(departure) for departure, _ in departures],
+            "schedules": [{"departure_time": departure.strftime("%H:%M"), "day_type": row_day_type} for departure, row_day_type in departures],
+        }
+
+    def get_line_timetable(self, line_name, day_type=None, service_date=None):
+        """Every trip on a line for a day type or service date, as trip x station matrices (see line_timetable_patterns)."""
+        if line_name not in self.line_map:
+            raise ValueError(f"Line {line_name} not found")
+        if service_date is not None:
+            if self.day_types is None:
+                self._load_day_types()
+            day_type = self.day_types.get(service_date)
+        if day_type is None:
+            raise ValueError(f"No schedule template for {service_date or 'that day'}")
+        key = (line_name, None, day_type, service_date)
+        generation = _schedule_cache_generation
+        timetable = SCHEDULE_CACHE.get(key)
+        if timetable is None:
+            timetable = self._fetch_line_timetable(line_name, day_type, service_date)
+            cache_schedule(key, timetable, generation)
+        return timetable
+
+    @track_method
+    def _fetch_line_timetable(self, line_name, day_type, service_date):
+        conn = get_db_connection(internal=True)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(LINE_TIMETABLE_SQL, {
+                "line_name": line_name,
+                "day_type": day_type,
+                "adjusted": adjusted_day_type(day_type, service_date) if service_date else None,
+            })
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            release_db_connection(conn)
+        patterns = line_timetable_patterns(rows)
+        station_ids = {station_id for pattern in patterns for station_id in pattern["stations"]}
+        return {
+            "line": line_name,
+            "day_type": day_type,
+            "service_date": service_date.isoformat() if service_date else None,
+            "station_names": {station_id: self.station_map_inv.get(station_id) for station_id in sorted(station_ids)},
+            "patterns": patterns,
+        }
+
+    @track_method
+    def _load_day_types(self):
+        conn = get_db_connection(internal=True)
+        cursor = conn.cursor()
+        try:
+            self.day_types = load_day_types(cursor)
         finally:
             cursor.close()
             release_db_connection(conn)
 
-
-
-    def get_next_departure(self, line, station, next_station, current_time):
-        conn = get_db_connection(create_session(role="user"))
+    def invalidate_schedule_cache(self):
+        """Drops cached station schedules; called whenever schedules are regenerated."""
+        global _schedule_cache_generation
+        with _schedule_cache_lock:
+            _schedule_cache_generation += 1
+            SCHEDULE_CACHE.clear()
+        logger.info("Schedule cache cleared")
+
+    def load_service_timetable(self, service_date):
+        """Returns the preloaded timetable for a service date, loading it on first use."""
+        if service_date in self.preloaded_timetables:
+            return self.preloaded_timetables[service_date]
+        timetable = self.service_timetables.get(service_date, _MISSING)
+        if timetable is _MISSING:
+            return self._load_service_timetable(service_date)
+        return timetable
+
+    @track_method
+    def _load_service_timetable(self, service_date):
+        """Fetches one service day and caches it unless the state was swapped meanwhile."""
+        with self._timetable_lock:
+            generation, network, day_types = self._timetable_generation, self.network, self.day_types
+        conn = get_db_connection(internal=True)
         cursor = conn.cursor()
         try:
-            station_id = self.station_map[station]
-            next_station_id = self.station_map[next_station]
-            line_id = next(lid for lid, lname in self.valid_lines.items() if lname == line)
-            day_type = "weekend" if current_time.weekday() >= 5 else "weekday"
-            cursor.execute("SELECT holiday_date FROM holidays WHERE holiday_date = %s", (current_time.date(),))
-            if cursor.fetchone():
-                day_type = "holiday"
-            cursor.execute("""
-                SELECT departure_time FROM schedules
-                WHERE line_id = %s AND station_id = %s AND next_station_id = %s AND day_type = %s
-                AND departure_time >= %s
-                ORDER BY departure_time LIMIT 1
-            """, (line_id, station_id, next_station_id, day_type, current_time.time()))
-            next_dep = cursor.fetchone()
-            if next_dep:
-                dep_time = datetime.combine(current_time.date(), next_dep[0])
-                if dep_time < current_time:
-                    dep_time += timedelta(days=1)
-                return dep_time
-            return None
+            if day_types is None:
+                day_types = load_day_types(cursor)
+            day_type = day_types.get(service_date)
+            timetable = None
+            if day_type:
+                timetable = ServiceTimetable.from_cursor(cursor, network, service_date, day_type)
+            else:
+                logger.warning(f"No template for date {service_date}")
         finally:
             cursor.close()
             release_db_connection(conn)
+        with self._timetable_lock:
+            if generation != self._timetable_generation:
+                logger.info(f"Timetables were swapped while loading {service_date}; not caching it")
+                return timetable
+            if self.day_types is None:
+                self.day_types = day_types
+            self.service_timetables.set(service_date, timetable)
+        return timetable
+
+    def _fetch_timetables(self, network, service_dates):
+        """Loads the calendar and the timetables of service_dates against network."""
+        conn = get_db_connection(internal=True)
+        cursor = conn.cursor()
+        try:
+            day_types = load_day_types(cursor)
+            timetables = {
+                d: ServiceTimetable.from_cursor(cursor, network, d, day_types[d]) if d in day_types else None
+                for d in service_dates
+            }
+        finally:
+            cursor.close()
+            release_db_connection(conn)
+        return day_types, timetables
+
+    @track_method
+    def refresh_service_timetables(self):
+        """Reloads every cached service day and swaps them in at once."""
+        with self._timetable_lock:
+            generation, network = self._timetable_generation, self.network
+            service_dates = [d for d, _ in self.service_timetables.items()]
+        day_types, refreshed = self._fetch_timetables(network, service_dates)
+        with self._timetable_lock:
+            if generation != self._timetable_generation:
+                # A network reload fetched its own timetables in the meantime.
+                logger.info("Timetables were swapped during the refresh; keeping the newer ones")
+                return
+            self._timetable_generation += 1
+            self.day_types = day_types
+            # Freshly generated schedules supersede whatever a snapshot file held.
+            self.preloaded_timetables = {}
+            self.service_timetables = timetable_cache(refreshed)
+        logger.info(f"Refreshed timetables for {len(refreshed)} service days")
+
+    @track_method
+    def save_snapshot(self, path, service_dates):
+        """Writes the network and the timetables of service_dates to a snapshot file."""
+        timetables = [self.load_service_timetable(service_date) for service_date in service_dates]
+        write_snapshot(path, self.network, [timetable for timetable in timetables if timetable is not None])
+
+    def get_next_departure(self, line, station, next_station, current_time):
+        """Returns the next departure from station towards next_station on line, or None."""
+        station_id = self.station_map[station]
+        next_station_id = self.station_map[next_station]
+        line_id = self.line_map[line]
+        timetable = self.load_service_timetable(current_time.date())
+        if timetable is None:
+            return None
+        seconds = seconds_since_midnight(current_time) + (1 if current_time.microsecond else 0)
+        departure = timetable.next_departure(line_id, station_id, next_station_id, seconds)
+        if departure is None:
+            return None
+        return datetime.combine(current_time.date(), time()) + timedelta(seconds=departure)
 
+    @track_method
     def find_fastest_path(self, start, end, start_time):
-        """Finds the fastest path considering departure times."""
+        """Finds the earliest-arrival path considering departure times."""
         start_id = self.get_station_id(start)
         end_id = self.get_station_id(end)
-        if start_id not in self.station_graph or end_id not in self.station_graph:
+        timetable = self.load_service_timetable(start_time.date())
+        if timetable is None:
             return None, 0
-
-        pq = [(start_time, start_id, [start])]
-        earliest = {start_id: start_time}
-
-        while pq:
-            current_time, current_station, path = heapq.heappop(pq)
-            if current_station == end_id:
-                total_time = (current_time - start_time).total_seconds() / 60
-                return path, total_time
-
-            if current_time > earliest.get(current_station, datetime.max):
-                continue
-
-            for neighbor, line in self.station_graph[current_station]:
-                dep_time = self.get_next_departure(line, self.station_map_inv[current_station], current_time)
-                if dep_time is None:
-                    continue
-                # Fetch travel time from routes table
-                conn = get_db_connection(create_session(role="user"))
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT travel_time
-                    FROM routes
-                    WHERE from_station_id = %s AND to_station_id = %s AND line_id = (
-                        SELECT line_id FROM lines WHERE line_name = %s
-                    )
-                """, (current_station, neighbor, line))
-                route_data = cursor.fetchone()
-                cursor.close()
-                release_db_connection(conn)
-                if route_data:
-                    travel_time = route_data[0]
-                else:
-                    travel_time = 5  # Default travel time if not found
-
-                # Fetch transfer time if applicable (same station, different line)
-                if current_station == neighbor:
-                    cursor = get_db_connection(create_session(role="user")).cursor()
-                    cursor.execute("""
-                        SELECT transfer_time_peak, transfer_time_offpeak
-                        FROM transfer_times tt
-                        JOIN routes r ON tt.route_id = r.route_id
-                        WHERE r.from_station_id = %s AND r.line_id = (
-                            SELECT line_id FROM lines WHERE line_name = %s
-                        )
-                    """, (current_station, line))
-                    transfer_data = cursor.fetchone()
-                    cursor.close()
-                    release_db_connection(conn)
-                    if transfer_data:
-                        transfer_time_peak, transfer_time_offpeak = transfer_data
-                        is_peak = (7 <= current_time.hour < 9) or (17 <= current_time.hour < 19)
-                        travel_time = transfer_time_peak if is_peak else transfer_time_offpeak
-                arr_time = dep_time + timedelta(minutes=travel_time)
-
-                if arr_time < earliest.get(neighbor, datetime.max):
-                    earliest[neighbor] = arr_time
-                    new_path = path + [self.station_map_inv[neighbor]]
-    
-    def generate_weekly_schedule(self, start_date):
-        conn = get_db_connection(create_session(role="admin"))
+        # Node indices must come from the network the timetable was built on.
+        network = timetable.network
+        sources = network.nodes_for_station(start_id)
+        targets = set(network.nodes_for_station(end_id))
+        start_seconds = seconds_since_midnight(start_time)
+        result = timetable.earliest_arrival(sources, targets, start_seconds)
+        if result is None:
+            return None, 0
+        current, arrival, parent = result
+        path = []
+        while current is not None:
+            path.append(current)
+            current = parent[current]
+        path.reverse()
+        return [self.station_map_inv[network.station_ids[network.node_station[n]]] for n in path], (arrival - start_seconds) / 60
+
+    @track_method
+    def generate_weekly_schedule(self, start_date, incremental=False):
+        """Generates a week of schedules; incremental=True only rewrites slices whose inputs changed."""
+        conn = get_db_connection(internal=True)
         cursor = conn.cursor()
         end_date = start_date + timedelta(days=7)
-        current_date = start_date
-
-        while current_date < end_date:
-            # Fetch template_name instead of template_id
-            cursor.execute("""
-                SELECT st.template_name
-                FROM annual_calendar ac
-                JOIN schedule_templates st ON ac.template_id = st.template_id
-                WHERE ac.date_id = %s
-            """, (current_date,))
-            row = cursor.fetchone()
-            if not row:
-                logger.warning(f"No template found for date {current_date}, skipping")
-                current_date += timedelta(days=1)
-                continue
-            day_type = row[0]  # e.g., 'Weekday' or 'Weekend'
-
-            cursor.execute("SELECT line_id, line_name, start_time, end_time FROM lines")
-            lines = cursor.fetchall()
-
-            for line_id, line_name, start_time, end_time in lines:
-                cursor.execute("SELECT pattern_id FROM service_patterns WHERE line_id = %s", (line_id,))
-                patterns = cursor.fetchall()
-
-                for (pattern_id,) in patterns:
-                    cursor.execute("""
-                        SELECT station_id, station_sequence, dwell_time
-                        FROM service_pattern_details
-                        WHERE pattern_id = %s
-                        ORDER BY station_sequence
-                    """, (pattern_id,))
-                    stations = cursor.fetchall()
-                    if not stations:
-                        logger.warning(f"No stations found for pattern {pattern_id} on line {line_name}")
-                        continue
-
-                    cursor.execute("""
-                        SELECT start_time, end_time, headway_minutes
-                        FROM frequency_rules
-                        WHERE template_id = (SELECT template_id FROM schedule_templates WHERE template_name = %s)
-                        AND line_id = %s AND pattern_id = %s
-                        ORDER BY start_time
-                    """, (day_type, line_id, pattern_id))
-                    frequency_rules = cursor.fetchall()
-
-                    if not frequency_rules:
-                        logger.warning(f"No frequency rules for {day_type}, line {line_name}, pattern {pattern_id}")
-                        continue
-
-                    departure_times = []
-                    for rule_start, rule_end, headway in frequency_rules:
-                        start_dt = datetime.combine(current_date, rule_start)
-                        end_dt = datetime.combine(current_date, rule_end)
-                        current_time = start_dt
-                        while current_time < end_dt:
-                            departure_times.append(current_time)
-                            current_time += timedelta(minutes=headway)
-
-                    for dep_time in departure_times:
-                        current_dt = dep_time
-                        for i, (station_id, seq, dwell_time) in enumerate(stations):
-                            next_station_id = stations[i + 1][0] if i < len(stations) - 1 else None
-                            if next_station_id:
-                                cursor.execute("""
-                                    SELECT travel_time
-                                    FROM routes
-                                    WHERE line_id = %s AND from_station_id = %s AND to_station_id = %s
-                                """, (line_id, station_id, next_station_id))
-                                row = cursor.fetchone()
-                                travel_time = row[0] if row else 5
-
-                                cursor.execute("""
-                                    INSERT INTO schedules (line_id, station_id, departure_time, day_type, next_station_id)
-                                    VALUES (%s, %s, %s, %s, %s)
-                                    ON CONFLICT (line_id, station_id, departure_time, day_type) DO NOTHING
-                                """, (line_id, station_id, current_dt.time(), day_type, next_station_id))
-
-                                current_dt += timedelta(seconds=dwell_time)
-                                current_dt += timedelta(minutes=travel_time)
-                            else:
-                                cursor.execute("""
-                                    INSERT INTO schedules (line_id, station_id, departure_time, day_type, next_station_id)
-                                    VALUES (%s, %s, %s, %s, NULL)
-                                    ON CONFLICT (line_id, station_id, departure_time, day_type) DO NOTHING
-                                """, (line_id, station_id, current_dt.time(), day_type))
-
-                current_date += timedelta(days=1)
-        conn.commit()
-        cursor.close()
-        release_db_connection(conn)
-        logger.info(f"Generated weekly schedule from {start_date} to {end_date}")
-    def get_next_departure(self, line, station, next_station, current_time):
-        conn = get_db_connection(create_session(role="user"))
-        cursor = conn.cursor()
         try:
-            station_id = self.station_map[station]
-            next_station_id = self.station_map[next_station]
-            line_id = next(lid for lid, lname in self.valid_lines.items() if lname == line)
-
-            cursor.execute("""
-                SELECT st.template_name
-                FROM annual_calendar ac
-                JOIN schedule_templates st ON ac.template_id = st.template_id
-                WHERE ac.date_id = %s
-            """, (current_time.date(),))
-            row = cursor.fetchone()
-            if not row:
-                logger.warning(f"No template for date {current_time.date()}")
-                return None
-            day_type = row[0]  # e.g., 'Weekday' or 'Weekend'
-
-            cursor.execute("""
-                SELECT departure_time FROM schedules
-                WHERE line_id = %s AND station_id = %s AND next_station_id = %s AND day_type = %s
-                AND departure_time >= %s
-                ORDER BY departure_time LIMIT 1
-            """, (line_id, station_id, next_station_id, day_type, current_time.time()))
-            next_dep = cursor.fetchone()
-            if next_dep:
-                dep_time = datetime.combine(current_time.date(), next_dep[0])
-                if dep_time < current_time:
-                    dep_time += timedelta(days=1)
-                return dep_time
-            return None
+            generate_schedules(cursor, start_date, end_date, incremental=incremental)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             cursor.close()
             release_db_connection(conn)
-        
+        self.refresh_service_timetables()
+        self.invalidate_schedule_cache()
+        logger.info(f"Generated weekly schedule from {start_date} to {end_date}")
+
+    @property
+    def fare_engine(self):
+        """FareEngine over the loaded network, built with it (see __init__ and reload_network)."""
+        if self._fare_engine is None:
+            self._fare_engine = FareEngine(self.network)
+        return self._fare_engine
+
+    @track_method
+    def get_fare(self, start_station, end_station):
+        """Returns the fare between two station names, or None when no route exists."""
+        fare = self.fare_engine.price([self.get_station_id(start_station)], [self.get_station_id(end_station)])[0]
+        return None if math.isnan(fare) else float(fare)
+
+    @track_method
+    def settle_fares(self, session_token, ended_before=None):
+        """Prices and charges every completed, unpriced trip in one transaction."""
+        conn = get_db_connection(session_token)
+        try:
+            settled, skipped, total = settle_trips(conn, self.fare_engine, ended_before)
+        except psycopg2.Error as e:
+            logger.error(f"Database error settling fares: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error settling fares: {str(e)}")
+        finally:
+            release_db_connection(conn)
+        return {"settled": settled, "skipped": skipped, "total": total}
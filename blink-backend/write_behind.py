@@ -0,0 +1,160 @@
+import threading
+import time
+from psycopg2.extras import execute_values
+from db import get_db_connection, release_db_connection
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class TrainStateWriter:
+    """Write-behind buffer for train transitions.
+
+    record() only touches memory. A flush writes the latest state of every
+    changed train with one batched UPDATE of trains and appends all buffered
+    transitions to real_time_status, in a single commit. Flushes happen once
+    max_batch transitions are buffered or max_delay seconds have passed since
+    the last one, whichever comes first; durability="sync" flushes on every
+    transition instead. Once start() has run, batched flushes happen on the
+    writer thread, so record() never waits for the database. If a flush
+    fails the rows are kept, up to max_pending buffered transitions, and
+    retried after a backoff that doubles from max_delay to max_backoff.
+    """
+
+    def __init__(self, max_batch=500, max_delay=1.0, durability="batched", history=True, max_pending=100000, max_backoff=30.0):
+        if durability not in ("batched", "sync"):
+            raise ValueError(f"Unknown durability mode {durability}")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durability = durability
+        self.history = history
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._latest = {}
+        self._transitions = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.dropped = 0
+
+    def record(self, train, event_time):
+        """Engine listener: buffers one transition."""
+        row = (train.train_id, train.line_id, train.current_route_id, train.current_station_id,
+               train.next_station_id, train.status, event_time)
+        with self._lock:
+            self._latest[train.train_id] = row
+            if self.history:
+                self._transitions.append(row)
+                self._trim()
+            now = time.monotonic()
+            due = now >= self._retry_at and (
+                self.durability == "sync"
+                or len(self._transitions) >= self.max_batch
+                or len(self._latest) >= self.max_batch
+                or now - self._last_flush >= self.max_delay
+            )
+        if not due:
+            return
+        if self._thread is not None and self.durability != "sync":
+            self._wake.set()
+        else:
+            self.flush()
+
+    def _trim(self):
+        """Drops the oldest transitions beyond max_pending; call with _lock held."""
+        overflow = len(self._transitions) - self.max_pending
+        if overflow > 0:
+            del self._transitions[:overflow]
+            self.dropped += overflow
+
+    @property
+    def pending(self):
+        return max(len(self._latest), len(self._transitions))
+
+    def flush(self):
+        """Writes everything buffered so far; returns the number of transitions written."""
+        # Flushes are serialized so an older batch can never commit after a newer one.
+        with self._flush_lock:
+            with self._lock:
+                latest, self._latest = self._latest, {}
+                transitions, self._transitions = self._transitions, []
+                self._last_flush = time.monotonic()
+            if not latest and not transitions:
+                return 0
+            try:
+                self._write(list(latest.values()), transitions)
+            except Exception as e:
+                with self._lock:
+                    for train_id, row in latest.items():
+                        self._latest.setdefault(train_id, row)
+                    self._transitions[:0] = transitions
+                    self._trim()
+                    self._backoff = min(self.max_backoff, max(self.max_delay, self._backoff * 2))
+                    self._retry_at = time.monotonic() + self._backoff
+                logger.error(f"Flushing {len(transitions)} train transitions failed, retrying in {self._backoff:.1f}s: {e}")
+                return 0
+            with self._lock:
+                self._backoff = 0.0
+                self._retry_at = 0.0
+            self.flushes += 1
+            self.rows_written += len(transitions)
+            return len(transitions)
+
+    def _write(self, latest, transitions):
+        conn = get_db_connection(internal=True)
+        cursor = conn.cursor()
+        try:
+            execute_values(cursor, """
+                UPDATE trains t
+                SET line_id = v.line_id, current_route_id = v.current_route_id,
+                    current_station_id = v.current_station_id, next_station_id = v.next_station_id,
+                    status = v.status, last_updated = v.last_updated
+                FROM (VALUES %s) AS v(train_id, line_id, current_route_id, current_station_id, next_station_id, status, last_updated)
+                WHERE t.train_id = v.train_id
+            """, latest, template="(%s, %s::int, %s::int, %s, %s, %s, %s::timestamp)", page_size=1000)
+            if transitions:
+                execute_values(cursor, """
+                    INSERT INTO real_time_status (train_id, line_id, route_id, current_station_id, status, last_updated)
+                    VALUES %s
+                """, [(row[0], row[1], row[2], row[3], row[5], row[6]) for row in transitions], page_size=1000)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            release_db_connection(conn)
+
+    def start(self):
+        """Starts a background thread so quiet periods still flush within max_delay."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="train-state-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.max_delay)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            now = time.monotonic()
+            if now >= self._retry_at and (woken or now - self._last_flush >= self.max_delay):
+                self.flush()
+
+    def close(self):
+        """Stops the background thread and flushes what is left."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()